@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        # register the product change receivers that invalidate search results,
+        # the customer delete receiver that reaches their orders on every shard,
+        # the Celery and database hooks that record trace spans, and the
+        # queue wait logging (after tracing, so it can tag the task span)
+        from . import search, sharding, tracing, queues  # noqa: F401
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.db import transaction
+
+from .redis_client import get_redis, mark_redis_down
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "orders:events:"
+
+
+def publish_order_event(order_id, using=None, **fields):
+    """
+    Publish an order status change to ``orders:events:<order_id>`` once the
+    current transaction on database ``using`` (the order's shard) commits, so
+    listeners never see uncommitted state. Fails open: a Redis outage only
+    costs the push, clients can still poll.
+    """
+    message = json.dumps({"order_id": str(order_id), **fields, "published_at": time.time()})
+    channel = f"{CHANNEL_PREFIX}{order_id}"
+
+    def publish():
+        client = get_redis()
+        if client is None:
+            return
+        try:
+            client.publish(channel, message)
+        except redis.RedisError as exc:
+            mark_redis_down(exc)
+
+    transaction.on_commit(publish, using=using)
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class OrderEventBroker:
+    """
+    One Redis pub/sub subscription per process, fanned out to every open
+    event stream in that process.
+
+    Each stream gets a small bounded queue; a stream that stops reading loses
+    its oldest events rather than growing without bound.
+    """
+
+    def __init__(self, queue_size=None):
+        self.queue_size = queue_size or settings.ORDER_EVENTS["QUEUE_SIZE"]
+        self.listeners = {}
+        self.connections = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.latencies = deque(maxlen=1000)
+        self._reader = None
+        self._loop = None
+        # set while the reader's Redis subscription is live
+        self.subscribed = None
+        self._baseline_rss = None
+
+    def subscribe(self, order_id):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.listeners.setdefault(str(order_id), set()).add(queue)
+        self.connections += 1
+        if self._baseline_rss is None:
+            self._baseline_rss = _rss_bytes()
+        self._ensure_reader()
+        return queue
+
+    async def wait_subscribed(self, timeout):
+        """
+        Wait until Redis has confirmed the subscription, so events published
+        from now on reach the queues. False if it isn't within ``timeout``
+        seconds (Redis down).
+        """
+        try:
+            await asyncio.wait_for(self.subscribed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def unsubscribe(self, order_id, queue):
+        listeners = self.listeners.get(str(order_id))
+        if listeners is None or queue not in listeners:
+            return
+        listeners.discard(queue)
+        if not listeners:
+            del self.listeners[str(order_id)]
+        self.connections -= 1
+
+    def dispatch(self, raw):
+        event = json.loads(raw)
+        listeners = self.listeners.get(event["order_id"])
+        if not listeners:
+            return
+        for queue in listeners:
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(event)
+        self.delivered += len(listeners)
+        self.latencies.append(time.time() - event["published_at"])
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        rss = _rss_bytes()
+        per_connection = None
+        if self.connections and rss is not None and self._baseline_rss is not None:
+            per_connection = max(rss - self._baseline_rss, 0) // self.connections
+        return {
+            "pid": os.getpid(),
+            "connections": self.connections,
+            "orders": len(self.listeners),
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "fanout_latency_ms": {
+                "p50": round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+                "p99": round(latencies[int(len(latencies) * 0.99)] * 1000, 2) if latencies else None,
+            },
+            "rss_bytes": rss,
+            "bytes_per_connection": per_connection,
+        }
+
+    def _ensure_reader(self):
+        loop = asyncio.get_running_loop()
+        if self._reader is None or self._reader.done() or self._loop is not loop:
+            self._loop = loop
+            self.subscribed = asyncio.Event()
+            self._reader = loop.create_task(self._read(self.subscribed))
+        return self.subscribed
+
+    async def _read(self, subscribed):
+        while self.listeners:
+            client = aioredis.Redis.from_url(settings.REDIS_URL)
+            pubsub = client.pubsub()
+            try:
+                await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                while self.listeners and not subscribed.is_set():
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message is not None and message["type"] == "psubscribe":
+                        subscribed.set()
+                while self.listeners:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is not None:
+                        self.dispatch(message["data"])
+            except redis.RedisError as exc:
+                logger.warning(f"Order event subscription lost, reconnecting: {exc}")
+                await asyncio.sleep(1)
+            finally:
+                subscribed.clear()
+                await pubsub.aclose()
+                await client.aclose()
+
+
+broker = OrderEventBroker()
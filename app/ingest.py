@@ -0,0 +1,228 @@
+import json
+import logging
+import socket
+import time
+import uuid
+
+import redis
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, close_old_connections, transaction
+
+from .models import Customer, Order, Product
+from .redis_client import get_redis, mark_redis_down
+from .services import create_order, create_orders
+from .sharding import encoded_shard, new_order_id, shard_for_customer
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "QUEUED"
+FAILED = "FAILED"
+
+# Atomically move up to ARGV[1] items from the head of the queue to the
+# worker's processing list, so a crash mid-batch never loses orders.
+CLAIM_LUA = """
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], #items, -1)
+    redis.call('RPUSH', KEYS[2], unpack(items))
+end
+return items
+"""
+
+
+def group_commit_enabled():
+    return settings.ORDER_INGESTION["MODE"] == "group_commit"
+
+
+def _queue_key():
+    return settings.ORDER_INGESTION["QUEUE_KEY"]
+
+
+def _status_key(order_id):
+    return f"{_queue_key()}:status:{order_id}"
+
+
+def enqueue_order(validated_data):
+    """
+    Queue a validated order for group commit and return its pre-assigned id,
+    or None if Redis is unavailable and the caller should write synchronously.
+    """
+    client = get_redis()
+    if client is None:
+        return None
+
+    # the id encodes the customer's shard, which is where the worker writes it
+    order_id = new_order_id(shard_for_customer(validated_data["customer"]))
+    payload = json.dumps({
+        "id": str(order_id),
+        "customer": validated_data["customer"].pk,
+        "items": [
+            {"product": str(item["product"].pk), "quantity": item["quantity"]}
+            for item in validated_data["items"]
+        ],
+        "queued_at": time.time(),
+    })
+    try:
+        pipe = client.pipeline(transaction=False)
+        # status first, so a poll can never miss an order that is in the queue
+        pipe.set(_status_key(order_id), json.dumps({"status": QUEUED}), ex=settings.ORDER_INGESTION["STATUS_TTL"])
+        pipe.rpush(_queue_key(), payload)
+        pipe.execute()
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return None
+    return order_id
+
+
+def ingestion_status(order_id):
+    """
+    Return ``{"status": "QUEUED"}`` or ``{"status": "FAILED", "errors": ...}``
+    for an order that has not been committed yet, or None if unknown.
+    """
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        raw = client.get(_status_key(order_id))
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return None
+    return json.loads(raw) if raw else None
+
+
+def commit_batch(payloads):
+    """
+    Write a batch of queued orders with a single transaction per shard, so the
+    whole batch costs one commit (and one WAL fsync) per shard instead of one
+    per order. Each order goes to the shard its pre-assigned id encodes.
+
+    Each shard's orders are first inserted with two bulk INSERTs. If that
+    fails, each order is retried in its own savepoint so a bad order is
+    rolled back and reported without aborting the rest. Orders already in
+    the database (a batch replayed after a worker crash) are skipped. Returns
+    ``{order_id: errors}`` for the orders that failed.
+    """
+    failures = {}
+    customers = Customer.objects.in_bulk({payload["customer"] for payload in payloads})
+    products = Product.objects.in_bulk({
+        uuid.UUID(item["product"]) for payload in payloads for item in payload["items"]
+    })
+
+    by_shard = {}
+    for payload in payloads:
+        order_id = uuid.UUID(payload["id"])
+        # ids queued before sharding encode no shard; lookups fall back to "default"
+        by_shard.setdefault(encoded_shard(order_id) or DEFAULT_DB_ALIAS, []).append((order_id, payload))
+
+    for shard, entries in by_shard.items():
+        with transaction.atomic(using=shard):
+            existing = set(
+                Order.objects.using(shard).filter(id__in=[order_id for order_id, _ in entries])
+                .values_list("id", flat=True)
+            )
+            ready = []
+            for order_id, payload in entries:
+                if order_id in existing:
+                    continue
+                customer = customers.get(payload["customer"])
+                if customer is None:
+                    failures[str(order_id)] = {"customer": ["Customer no longer exists."]}
+                    continue
+                items = [
+                    {"product": products.get(uuid.UUID(item["product"])), "quantity": item["quantity"]}
+                    for item in payload["items"]
+                ]
+                if any(item["product"] is None for item in items):
+                    failures[str(order_id)] = {"items": ["Product no longer exists."]}
+                    continue
+                ready.append((customer, items, order_id))
+
+            try:
+                with transaction.atomic(using=shard):
+                    create_orders(ready, using=shard)
+            except DatabaseError:
+                for customer, items, order_id in ready:
+                    try:
+                        with transaction.atomic(using=shard):
+                            create_order(customer, items, order_id=order_id, using=shard)
+                    except DatabaseError as exc:
+                        logger.error(f"Queued order {order_id} failed to commit: {exc}")
+                        failures[str(order_id)] = {"detail": ["Order could not be saved."]}
+    return failures
+
+
+class OrderIngester:
+    """
+    Worker that drains the ingestion queue in group-commit batches.
+
+    A batch is closed when it holds ``MAX_BATCH`` orders or ``MAX_WAIT_MS``
+    after its first order arrived, whichever comes first.
+    """
+
+    def __init__(self, name=None, max_batch=None, max_wait_ms=None):
+        config = settings.ORDER_INGESTION
+        self.name = name or socket.gethostname()
+        self.max_batch = max_batch or config["MAX_BATCH"]
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else config["MAX_WAIT_MS"]) / 1000
+        self.processing_key = f"{_queue_key()}:processing:{self.name}"
+        self.client = redis.Redis.from_url(settings.REDIS_URL)
+        self.claim = self.client.register_script(CLAIM_LUA)
+
+    def recover(self):
+        """Re-commit a batch left in the processing list by a previous crash."""
+        items = self.client.lrange(self.processing_key, 0, -1)
+        if items:
+            logger.warning(f"Recovering {len(items)} queued orders from {self.processing_key}")
+            self._commit(items)
+
+    def run_once(self, block_timeout=1):
+        """Collect and commit one batch. Returns the number of orders handled."""
+        first = self.client.blmove(_queue_key(), self.processing_key, block_timeout, "LEFT", "RIGHT")
+        if first is None:
+            return 0
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch and time.monotonic() < deadline:
+            claimed = self.claim(keys=[_queue_key(), self.processing_key], args=[self.max_batch - len(batch)])
+            if claimed:
+                batch.extend(claimed)
+            else:
+                time.sleep(0.001)
+
+        self._commit(batch)
+        return len(batch)
+
+    def run(self):
+        self.recover()
+        while True:
+            try:
+                self.run_once()
+            except (DatabaseError, redis.RedisError) as exc:
+                logger.error(f"Order ingestion batch failed, retrying: {exc}")
+                close_old_connections()
+                time.sleep(1)
+                self.recover()
+
+    def _commit(self, raw_items):
+        payloads = [json.loads(item) for item in raw_items]
+        started = time.perf_counter()
+        failures = commit_batch(payloads)
+        commit_ms = (time.perf_counter() - started) * 1000
+
+        ttl = settings.ORDER_INGESTION["STATUS_TTL"]
+        pipe = self.client.pipeline(transaction=False)
+        for payload in payloads:
+            errors = failures.get(payload["id"])
+            if errors:
+                pipe.set(_status_key(payload["id"]), json.dumps({"status": FAILED, "errors": errors}), ex=ttl)
+            else:
+                pipe.delete(_status_key(payload["id"]))
+        pipe.delete(self.processing_key)
+        pipe.execute()
+
+        oldest_ms = (time.time() - min(payload["queued_at"] for payload in payloads)) * 1000
+        logger.info(
+            f"Committed {len(payloads) - len(failures)}/{len(payloads)} queued orders in {commit_ms:.1f}ms "
+            f"(oldest waited {oldest_ms:.0f}ms)"
+        )
@@ -0,0 +1,140 @@
+"""
+Append-only journal of raw webhook callbacks.
+
+Each web process appends to its own segment file, ``<start_ms>-<pid>.seg``.
+A record is framed as::
+
+    received_at_ms (8 bytes) | length (4 bytes) | zlib(headers JSON + "\\n" + raw body)
+
+and every record also gets a ``(received_at_ms, offset)`` entry in the
+segment's ``.idx`` file, so a replay can seek straight to the start of a time
+range. Segments roll over at ``WEBHOOK_JOURNAL["SEGMENT_BYTES"]``.
+"""
+import bisect
+import heapq
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+FRAME = struct.Struct(">QI")
+INDEX_ENTRY = struct.Struct(">QQ")
+
+
+class WebhookJournal:
+    """Per-process writer; safe to share between threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._segment = None
+        self._index = None
+        self._directory = None
+        self._pid = None
+
+    def append(self, body, meta):
+        """
+        Record a raw webhook body with the configured request headers. Never
+        raises: losing a journal entry must not fail the webhook.
+        """
+        config = settings.WEBHOOK_JOURNAL
+        if not config["ENABLED"]:
+            return
+        headers = {name: meta[name] for name in config["HEADERS"] if name in meta}
+        record = zlib.compress(json.dumps(headers).encode() + b"\n" + bytes(body), 1)
+        try:
+            with self._lock:
+                # stamped under the lock so each segment stays in time order
+                received_at_ms = time.time_ns() // 1_000_000
+                self._open(Path(config["DIR"]), config["SEGMENT_BYTES"], received_at_ms)
+                offset = self._segment.tell()
+                self._segment.write(FRAME.pack(received_at_ms, len(record)) + record)
+                self._segment.flush()
+                self._index.write(INDEX_ENTRY.pack(received_at_ms, offset))
+                self._index.flush()
+        except OSError as exc:
+            logger.error(f"Could not journal webhook: {exc}")
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _open(self, directory, segment_bytes, received_at_ms):
+        if (
+            self._segment is not None
+            and self._pid == os.getpid()
+            and self._directory == directory
+            and self._segment.tell() < segment_bytes
+        ):
+            return
+        self._close()
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f"{received_at_ms:013d}-{os.getpid()}"
+        self._segment = open(directory / f"{name}.seg", "ab")
+        self._index = open(directory / f"{name}.idx", "ab")
+        self._directory = directory
+        self._pid = os.getpid()
+
+    def _close(self):
+        # after a fork the handles belong to the parent; just drop them
+        if self._segment is not None and self._pid == os.getpid():
+            self._segment.close()
+            self._index.close()
+        self._segment = self._index = None
+
+
+journal = WebhookJournal()
+
+
+def read_segment(path, since_ms=0, until_ms=None):
+    """
+    Yield ``(received_at_ms, headers, body)`` from one segment, starting at
+    the first record at or after ``since_ms`` according to its index.
+    """
+    index = path.with_suffix(".idx").read_bytes()
+    timestamps = [
+        INDEX_ENTRY.unpack_from(index, position)[0]
+        for position in range(0, len(index) - len(index) % INDEX_ENTRY.size, INDEX_ENTRY.size)
+    ]
+    start = bisect.bisect_left(timestamps, since_ms)
+    if start == len(timestamps):
+        return
+    offset = INDEX_ENTRY.unpack_from(index, start * INDEX_ENTRY.size)[1]
+
+    with open(path, "rb") as segment:
+        segment.seek(offset)
+        while True:
+            frame = segment.read(FRAME.size)
+            if len(frame) < FRAME.size:
+                return
+            received_at_ms, length = FRAME.unpack(frame)
+            record = segment.read(length)
+            if len(record) < length:
+                # torn write at the tail of a live segment
+                return
+            if until_ms is not None and received_at_ms >= until_ms:
+                return
+            headers, _, body = zlib.decompress(record).partition(b"\n")
+            yield received_at_ms, json.loads(headers), body
+
+
+def read_journal(directory=None, since_ms=0, until_ms=None):
+    """
+    Yield journal records from every segment in ``[since_ms, until_ms)``,
+    merged into received order.
+    """
+    directory = Path(directory or settings.WEBHOOK_JOURNAL["DIR"])
+    segments = []
+    for path in sorted(directory.glob("*.seg")):
+        start_ms = int(path.stem.split("-", 1)[0])
+        if until_ms is not None and start_ms >= until_ms:
+            continue
+        segments.append(read_segment(path, since_ms, until_ms))
+    return heapq.merge(*segments, key=lambda record: record[0])
@@ -0,0 +1,15 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.throttling import admission_state
+
+
+class Command(BaseCommand):
+    help = "Print admission-control counters and in-flight request slots."
+
+    def handle(self, *args, **options):
+        state = admission_state()
+        if state is None:
+            raise CommandError("Redis is unavailable; no limiter state to report.")
+        self.stdout.write(json.dumps(state, indent=2, sort_keys=True))
@@ -0,0 +1,61 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app.ids import uuid7
+from app.ingest import commit_batch
+from app.models import Customer, Order, Product
+from app.services import create_order
+from app.sharding import new_order_id
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure order write throughput of the synchronous path (one "
+        "transaction per order) against group commit (one per batch)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=5000)
+        parser.add_argument("--items", type=int, default=3, help="Items per order.")
+        parser.add_argument("--batch-size", type=int, default=200)
+
+    def handle(self, *args, **options):
+        customer = Customer.objects.create(username=f"bench-{uuid7().hex}")
+        products = [
+            Product.objects.create(name=f"bench product {i}", price=Decimal("9.99"))
+            for i in range(options["items"])
+        ]
+        try:
+            sync_rate = self._bench_sync(customer, products, options["orders"])
+            group_rate = self._bench_group_commit(customer, products, options["orders"], options["batch_size"])
+        finally:
+            Order.objects.filter(customer=customer).delete()
+            Product.objects.filter(id__in=[p.id for p in products]).delete()
+            customer.delete()
+
+        self.stdout.write(f"sync:         {sync_rate:>10,.0f} orders/s")
+        self.stdout.write(f"group commit: {group_rate:>10,.0f} orders/s (batch {options['batch_size']})")
+        self.stdout.write(f"speedup:      {group_rate / sync_rate:>10.1f}x")
+
+    def _bench_sync(self, customer, products, orders):
+        items = [{"product": product, "quantity": 1} for product in products]
+        started = time.perf_counter()
+        for _ in range(orders):
+            with transaction.atomic():
+                create_order(customer, items)
+        return orders / (time.perf_counter() - started)
+
+    def _bench_group_commit(self, customer, products, orders, batch_size):
+        items = [{"product": str(product.id), "quantity": 1} for product in products]
+        payloads = [
+            # both paths write to "default" so they measure the same database
+            {"id": str(new_order_id("default")), "customer": customer.pk, "items": items, "queued_at": time.time()}
+            for _ in range(orders)
+        ]
+        started = time.perf_counter()
+        for start in range(0, orders, batch_size):
+            commit_batch(payloads[start:start + batch_size])
+        return orders / (time.perf_counter() - started)
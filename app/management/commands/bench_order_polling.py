@@ -0,0 +1,64 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from app.ids import uuid7
+from app.models import Customer, Product
+from app.services import create_order
+
+
+class Command(BaseCommand):
+    help = (
+        "Poll GET /api/orders/<pk>/ with and without If-None-Match and report "
+        "bytes, queries and server time per request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--polls", type=int, default=1000)
+        parser.add_argument("--items", type=int, default=10, help="Items on the polled order.")
+
+    def handle(self, *args, **options):
+        customer = Customer.objects.create(username=f"bench-{uuid7().hex}")
+        product = Product.objects.create(name="bench product", price=Decimal("9.99"))
+        try:
+            with transaction.atomic():
+                order = create_order(customer, [{"product": product, "quantity": 1}] * options["items"])
+            url = reverse("order-retrive", kwargs={"pk": order.id})
+            client = Client(HTTP_HOST="localhost")
+            etag = client.get(url)["ETag"]
+
+            full = self._poll(client, url, options["polls"], {})
+            conditional = self._poll(client, url, options["polls"], {"HTTP_IF_NONE_MATCH": etag})
+        finally:
+            customer.delete()
+            product.delete()
+
+        self.stdout.write(f"{'':<12} {'status':>6} {'bytes/req':>10} {'queries/req':>12} {'ms/req':>8}")
+        for label, row in (("full GET", full), ("conditional", conditional)):
+            self.stdout.write(
+                f"{label:<12} {row['status']:>6} {row['bytes']:>10.0f} {row['queries']:>12.1f} {row['ms']:>8.3f}"
+            )
+        self.stdout.write(
+            f"saved {1 - conditional['bytes'] / full['bytes']:.0%} of body bytes and "
+            f"{1 - conditional['ms'] / full['ms']:.0%} of server time per poll"
+        )
+
+    def _poll(self, client, url, polls, headers):
+        body_bytes = 0
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for _ in range(polls):
+                response = client.get(url, **headers)
+                body_bytes += len(response.content)
+            elapsed = time.perf_counter() - started
+        return {
+            "status": response.status_code,
+            "bytes": body_bytes / polls,
+            "queries": len(queries) / polls,
+            "ms": elapsed * 1000 / polls,
+        }
@@ -0,0 +1,108 @@
+import io
+import random
+import statistics
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from app.models import Product
+
+ADJECTIVES = ["red", "blue", "black", "leather", "wireless", "steel", "cotton", "organic", "compact", "vintage",
+              "smart", "waterproof", "portable", "classic", "ultra", "mini", "heavy", "soft", "bamboo", "glass"]
+NOUNS = ["shoes", "wallet", "bottle", "charger", "headphones", "jacket", "lamp", "backpack", "kettle", "watch",
+         "speaker", "blender", "mug", "notebook", "umbrella", "towel", "keyboard", "mirror", "cable", "pillow"]
+FILLER = ["durable", "everyday", "lightweight", "premium", "gift", "travel", "kitchen", "office", "outdoor", "home"]
+
+# marks seeded rows so --cleanup only removes those
+MARKER = "[bench]"
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed synthetic products and measure GET /api/products/ latency "
+        "(p50/p95/p99) for typical searches, with the result cache off."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=0, help="Insert this many synthetic products first.")
+        parser.add_argument("--requests", type=int, default=200, help="Requests per query shape.")
+        parser.add_argument("--cleanup", action="store_true", help="Delete the synthetic products afterwards.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("This benchmark needs PostgreSQL.")
+        if options["seed"]:
+            self._seed(options["seed"])
+
+        rng = random.Random(42)
+        shapes = {
+            "word": lambda: {"q": rng.choice(NOUNS)},
+            "two words": lambda: {"q": f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}"},
+            "substring": lambda: {"q": rng.choice(NOUNS)[:4]},
+            "word + price": lambda: {"q": rng.choice(NOUNS), "min_price": "10", "max_price": "50"},
+            "price only": lambda: {"min_price": "10", "max_price": "12", "ordering": "price"},
+            "page 5": None,
+        }
+        client = Client(HTTP_HOST="localhost")
+        url = reverse("product-search")
+
+        self.stdout.write(f"{Product.objects.count():,} products")
+        self.stdout.write(f"{'query':<14} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        with override_settings(PRODUCT_SEARCH={**settings.PRODUCT_SEARCH, "CACHE_TTL": 0}):
+            for label, make_params in shapes.items():
+                timings = []
+                for _ in range(options["requests"]):
+                    if make_params is None:
+                        timings.append(self._deep_page(client, url, rng))
+                        continue
+                    started = time.perf_counter()
+                    response = client.get(url, make_params())
+                    timings.append((time.perf_counter() - started) * 1000)
+                    assert response.status_code == 200, response.content
+                quantiles = statistics.quantiles(timings, n=100)
+                self.stdout.write(f"{label:<14} {quantiles[49]:>8.2f} {quantiles[94]:>8.2f} {quantiles[98]:>8.2f}")
+
+        if options["cleanup"]:
+            deleted, _ = Product.objects.filter(description__startswith=MARKER).delete()
+            self.stdout.write(f"deleted {deleted:,} synthetic products")
+
+    def _deep_page(self, client, url, rng):
+        """Time the fifth page of a popular query, reached by following next links."""
+        response = client.get(url, {"q": rng.choice(NOUNS)})
+        for _ in range(4):
+            next_url = response.json()["next"]
+            if next_url is None:
+                raise CommandError("Not enough products for five pages; seed more with --seed.")
+            started = time.perf_counter()
+            response = client.get(next_url)
+        return (time.perf_counter() - started) * 1000
+
+    def _seed(self, count, batch_size=50_000):
+        rng = random.Random()
+        created_at = timezone.now().isoformat()
+        inserted = 0
+        while inserted < count:
+            rows = min(batch_size, count - inserted)
+            buffer = io.StringIO()
+            for _ in range(rows):
+                name = f"{rng.choice(ADJECTIVES).title()} {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {rng.randint(1, 9999)}"
+                description = f"{MARKER} {' '.join(rng.sample(FILLER, 4))} {rng.choice(NOUNS)}"
+                price = f"{rng.randint(100, 50_000) / 100:.2f}"
+                buffer.write(f"{uuid.uuid4()}\t{name}\t{description}\t{price}\t{created_at}\n")
+            buffer.seek(0)
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    "COPY app_product (id, name, description, price, created_at) FROM STDIN", buffer
+                )
+            inserted += rows
+            self.stdout.write(f"seeded {inserted:,}/{count:,} products", ending="\r")
+        self.stdout.write("")
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE app_product")
@@ -0,0 +1,72 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from app.ids import uuid7
+from app.models import Customer, Product
+from app.services import create_order
+from app.tasks import send_confirmation_message, sweep_stale_payments
+from core.celery import app
+
+BULK_QUEUE = "bulk"
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure send_confirmation_message latency (enqueue to result) with "
+        "an idle bulk queue, with a backlog of sweeps on the bulk queue, and "
+        "with confirmations queued behind that backlog as on a single shared "
+        "queue. Needs the celery-realtime and celery-bulk workers running."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--samples", type=int, default=100, help="Confirmations per mode.")
+        parser.add_argument("--backlog", type=int, default=500, help="Sweeps kept waiting on the bulk queue.")
+        parser.add_argument("--shared-samples", type=int, default=3, help="Confirmations behind the backlog.")
+        parser.add_argument("--timeout", type=float, default=300.0, help="Seconds to wait for one confirmation.")
+
+    def handle(self, *args, **options):
+        customer = Customer.objects.create(username=f"bench-{uuid7().hex}")
+        product = Product.objects.create(name="bench product", price=Decimal("9.99"))
+        order = create_order(customer, [{"product": product, "quantity": 1}])
+        modes = (
+            ("idle bulk", "realtime", 0, options["samples"]),
+            ("bulk backlog", "realtime", options["backlog"], options["samples"]),
+            ("shared queue", BULK_QUEUE, options["backlog"], options["shared_samples"]),
+        )
+        results = {}
+        try:
+            send_confirmation_message.apply_async(args=[order.id]).get(timeout=options["timeout"])
+            for label, queue, backlog, samples in modes:
+                results[label] = [self._confirm(order, queue, backlog, options["timeout"]) for _ in range(samples)]
+                self._purge_bulk()
+        finally:
+            self._purge_bulk()
+            order.delete()
+            customer.delete()
+            product.delete()
+
+        self.stdout.write(f"{'mode':<14} {'samples':>7} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+        for label, timings in results.items():
+            p95 = statistics.quantiles(timings, n=20, method="inclusive")[18] if len(timings) > 1 else timings[0]
+            self.stdout.write(
+                f"{label:<14} {len(timings):>7} {statistics.median(timings):>9.1f} {p95:>9.1f} {max(timings):>9.1f}"
+            )
+
+    def _confirm(self, order, queue, backlog, timeout):
+        self._fill_bulk(backlog)
+        started = time.perf_counter()
+        send_confirmation_message.apply_async(args=[order.id], queue=queue).get(timeout=timeout)
+        return (time.perf_counter() - started) * 1000
+
+    def _fill_bulk(self, backlog):
+        with app.connection_for_write() as connection:
+            waiting = connection.default_channel.queue_declare(BULK_QUEUE).message_count
+        for _ in range(backlog - waiting):
+            sweep_stale_payments.apply_async(ignore_result=True)
+
+    def _purge_bulk(self):
+        with app.connection_for_write() as connection:
+            connection.default_channel.queue_purge(BULK_QUEUE)
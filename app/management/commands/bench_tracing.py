@@ -0,0 +1,89 @@
+import statistics
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from app.ids import uuid7
+from app.models import Customer, Product
+from app.services import create_order
+from app.tasks import send_confirmation_message
+from app.tracing import exporter
+
+MODES = {
+    "off": {"ENABLED": False},
+    "0%": {"ENABLED": True, "SAMPLE_RATE": 0.0},
+    "1%": {"ENABLED": True, "SAMPLE_RATE": 0.01},
+    "100%": {"ENABLED": True, "SAMPLE_RATE": 1.0},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure tracing overhead on an order retrieve request and a Celery "
+        "task run, with tracing off and at 0%, 1% and 100% sampling."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=2000, help="Calls per workload and mode.")
+        parser.add_argument("--items", type=int, default=10, help="Items on the order.")
+        parser.add_argument("--rounds", type=int, default=5, help="Modes alternate this many times to even out drift.")
+
+    def handle(self, *args, **options):
+        customer = Customer.objects.create(username=f"bench-{uuid7().hex}")
+        product = Product.objects.create(name="bench product", price=Decimal("9.99"))
+        try:
+            with transaction.atomic():
+                order = create_order(customer, [{"product": product, "quantity": 1}] * options["items"])
+            client = Client(HTTP_HOST="localhost")
+            url = reverse("order-retrive", kwargs={"pk": order.id})
+            workloads = {
+                "GET order": lambda: client.get(url),
+                # already confirmed after the first run: one locked read per call
+                "task": lambda: send_confirmation_message.apply(args=[order.id]),
+            }
+            with tempfile.TemporaryDirectory() as directory:
+                results = self._measure(workloads, Path(directory) / "spans.jsonl", options)
+        finally:
+            customer.delete()
+            product.delete()
+
+        self.stdout.write(f"{'workload':<10} {'sampling':>8} {'mean us':>9} {'p99 us':>9} {'overhead':>9} {'spans/call':>11}")
+        for workload, by_mode in results.items():
+            baseline = statistics.mean(by_mode["off"]["timings"])
+            for mode, row in by_mode.items():
+                mean = statistics.mean(row["timings"])
+                p99 = statistics.quantiles(row["timings"], n=100)[98]
+                self.stdout.write(
+                    f"{workload:<10} {mode:>8} {mean:>9.1f} {p99:>9.1f} "
+                    f"{(mean - baseline) / baseline:>+9.1%} {row['spans'] / len(row['timings']):>11.2f}"
+                )
+
+    def _measure(self, workloads, export_path, options):
+        results = {name: {mode: {"timings": [], "spans": 0} for mode in MODES} for name in workloads}
+        per_round = max(1, options["iterations"] // options["rounds"])
+        for call in workloads.values():
+            call()  # warm up connections and caches
+        for _ in range(options["rounds"]):
+            for mode, overrides in MODES.items():
+                config = {**settings.TRACING, **overrides, "EXPORT_PATH": str(export_path)}
+                with override_settings(TRACING=config):
+                    for name, call in workloads.items():
+                        exporter.flush()
+                        exported = exporter.exported
+                        row = results[name][mode]
+                        for _ in range(per_round):
+                            started = time.perf_counter()
+                            call()
+                            row["timings"].append((time.perf_counter() - started) * 1_000_000)
+                        # export happens off the request path; flushing here only counts the spans
+                        exporter.flush()
+                        row["spans"] += exporter.exported - exported
+        return results
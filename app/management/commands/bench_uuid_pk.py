@@ -0,0 +1,85 @@
+import io
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from app.ids import uuid7
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare insert throughput and index size for uuid4 vs uuid7 primary "
+        "keys on scratch tables shaped like app_orderitem."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10_000_000)
+        parser.add_argument("--batch-size", type=int, default=50_000)
+        parser.add_argument("--keep", action="store_true", help="Keep the scratch tables afterwards.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("This benchmark needs PostgreSQL.")
+
+        results = []
+        for label, generator in (("uuid4", uuid.uuid4), ("uuid7", uuid7)):
+            results.append(self._run(label, generator, options["rows"], options["batch_size"], options["keep"]))
+
+        self.stdout.write(f"{'pk':<6} {'rows/s':>12} {'pk index':>12} {'fk index':>12} {'table':>12}")
+        for row in results:
+            self.stdout.write(
+                f"{row['label']:<6} {row['rows_per_sec']:>12,.0f} {row['pk_index']:>12} "
+                f"{row['fk_index']:>12} {row['table']:>12}"
+            )
+
+    def _run(self, label, generator, rows, batch_size, keep):
+        table = f"bench_pk_{label}"
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            cursor.execute(
+                f"CREATE TABLE {table} ("
+                " id uuid PRIMARY KEY,"
+                " order_id uuid NOT NULL,"
+                " quantity integer NOT NULL,"
+                " unit_price numeric(12, 2) NOT NULL)"
+            )
+            cursor.execute(f"CREATE INDEX {table}_order_id ON {table} (order_id)")
+
+        started = time.perf_counter()
+        inserted = 0
+        order_id = generator()
+        while inserted < rows:
+            count = min(batch_size, rows - inserted)
+            buffer = io.StringIO()
+            for i in range(count):
+                # ~4 items per order, like a typical basket
+                if i % 4 == 0:
+                    order_id = generator()
+                buffer.write(f"{generator()}\t{order_id}\t1\t10.00\n")
+            buffer.seek(0)
+            with connection.cursor() as cursor:
+                cursor.copy_expert(f"COPY {table} (id, order_id, quantity, unit_price) FROM STDIN", buffer)
+            inserted += count
+            self.stdout.write(f"{label}: {inserted:,}/{rows:,} rows", ending="\r")
+        elapsed = time.perf_counter() - started
+        self.stdout.write("")
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_size_pretty(pg_relation_size(%s)), pg_size_pretty(pg_relation_size(%s)),"
+                " pg_size_pretty(pg_relation_size(%s))",
+                [f"{table}_pkey", f"{table}_order_id", table],
+            )
+            pk_index, fk_index, table_size = cursor.fetchone()
+            if not keep:
+                cursor.execute(f"DROP TABLE {table}")
+
+        return {
+            "label": label,
+            "rows_per_sec": rows / elapsed,
+            "pk_index": pk_index,
+            "fk_index": fk_index,
+            "table": table_size,
+        }
@@ -0,0 +1,209 @@
+import csv
+import io
+import json
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from app.models import Product
+from app.search import bump_search_version
+
+STAGING_TABLE = "product_import"
+COLUMNS = ("sku", "name", "description", "price")
+MAX_REPORTED_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = (
+        "Insert or update products from a CSV or JSON-lines file, matched on "
+        "sku. Each chunk is COPYed into a temporary staging table and merged "
+        "with one INSERT ... ON CONFLICT, in its own transaction. A file with "
+        "only sku and price columns updates prices of existing products."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or .jsonl file, or - for stdin.")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="Default: from the file extension.")
+        parser.add_argument("--chunk-size", type=int, default=50_000, help="Rows per transaction.")
+        parser.add_argument(
+            "--rebuild-indexes",
+            action="store_true",
+            help="Drop the search indexes during the import and rebuild them afterwards. Faster for "
+                 "large loads, but searches scan the whole table until the rebuild finishes.",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("import_products needs PostgreSQL.")
+        file_format = options["format"] or ("jsonl" if options["path"].endswith((".jsonl", ".ndjson")) else "csv")
+        stream = sys.stdin if options["path"] == "-" else open(options["path"], newline="", encoding="utf-8")
+        dropped = self._drop_search_indexes() if options["rebuild_indexes"] else []
+        try:
+            records = self._read_jsonl(stream) if file_format == "jsonl" else self._read_csv(stream)
+            self._import(records, options["chunk_size"])
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if dropped:
+                self._rebuild_indexes(dropped)
+
+    def _drop_search_indexes(self):
+        """Drop the Product Meta indexes that exist; the unique sku and primary keys stay."""
+        with connection.cursor() as cursor:
+            existing = connection.introspection.get_constraints(cursor, Product._meta.db_table)
+        dropped = [index for index in Product._meta.indexes if index.name in existing]
+        with connection.schema_editor() as editor:
+            for index in dropped:
+                editor.remove_index(Product, index)
+        return dropped
+
+    def _rebuild_indexes(self, indexes):
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute("SET maintenance_work_mem = '256MB'")
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.add_index(Product, index)
+        self.stdout.write(f"rebuilt {len(indexes)} indexes in {time.perf_counter() - started:.1f}s")
+
+    def _import(self, records, chunk_size):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} "
+                "(line bigint, sku text, name text, description text, price numeric(12, 2))"
+            )
+
+        started = time.perf_counter()
+        totals = {"read": 0, "inserted": 0, "updated": 0, "unchanged": 0, "unknown": 0, "skipped": 0}
+        errors = []
+        columns = None
+        chunk = []
+        for line, record in records:
+            if columns is None:
+                columns = self._columns(record)
+            row, error = self._clean(record, columns)
+            totals["read"] += 1
+            if error:
+                totals["skipped"] += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append(f"line {line}: {error}")
+                continue
+            chunk.append((line, *row))
+            if len(chunk) >= chunk_size:
+                self._merge_chunk(chunk, columns, totals, started)
+                chunk = []
+        if chunk:
+            self._merge_chunk(chunk, columns, totals, started)
+
+        if totals["inserted"] or totals["updated"]:
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {Product._meta.db_table}")
+        self.stdout.write("")
+        for error in errors:
+            self.stderr.write(error)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{totals['read']:,} rows in {elapsed:.1f}s: {totals['inserted']:,} inserted, "
+            f"{totals['updated']:,} updated, {totals['unchanged']:,} unchanged, "
+            f"{totals['unknown']:,} unknown skus, {totals['skipped']:,} invalid"
+        )
+
+    def _columns(self, record):
+        columns = [column for column in COLUMNS if column in record]
+        if "sku" not in columns:
+            raise CommandError("The input needs a sku column.")
+        if not {"name", "price"} <= set(columns) and columns != ["sku", "price"]:
+            raise CommandError("Give sku, name and price (and optionally description), or only sku and price.")
+        return columns
+
+    def _clean(self, record, columns):
+        """Return ``(row, None)`` with values for COLUMNS, or ``(None, error)``."""
+        sku = str(record.get("sku") or "").strip()
+        if not sku or len(sku) > Product._meta.get_field("sku").max_length:
+            return None, "sku is missing or too long"
+        name = str(record.get("name") or "").strip()
+        if "name" in columns and (not name or len(name) > Product._meta.get_field("name").max_length):
+            return None, "name is missing or too long"
+        try:
+            price = Decimal(str(record.get("price")).strip())
+            if not price.is_finite() or price < 0 or price >= Decimal("1e10"):
+                raise InvalidOperation
+        except InvalidOperation:
+            return None, f"invalid price {record.get('price')!r}"
+        return (sku, name, str(record.get("description") or ""), price.quantize(Decimal("0.01"))), None
+
+    def _merge_chunk(self, chunk, columns, totals, started):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(chunk)
+        buffer.seek(0)
+        table = Product._meta.db_table
+        # the last row for a sku wins
+        staged = f"(SELECT DISTINCT ON (sku) * FROM {STAGING_TABLE} ORDER BY sku, line DESC) AS staged"
+        price_only = columns == ["sku", "price"]
+        if price_only:
+            merge = (
+                f"UPDATE {table} AS product SET price = staged.price FROM {staged} "
+                "WHERE product.sku = staged.sku AND product.price IS DISTINCT FROM staged.price RETURNING false AS inserted"
+            )
+        else:
+            # Rows identical to the stored product are filtered out up front:
+            # ON CONFLICT would still build and lock each of them, so this
+            # keeps re-importing an unchanged catalogue cheap.
+            changed = [column for column in columns if column != "sku"]
+            stored = ", ".join(f"product.{column}" for column in changed)
+            merge = (
+                f"INSERT INTO {table} (id, created_at, sku, name, description, price) "
+                f"SELECT gen_random_uuid(), now(), sku, name, description, price FROM {staged} "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {table} AS product WHERE product.sku = staged.sku "
+                f"AND ({stored}) = ({', '.join(f'staged.{column}' for column in changed)})) "
+                # in name order, so the (name, id) index is filled page by page
+                "ORDER BY name "
+                f"ON CONFLICT (sku) DO UPDATE SET {', '.join(f'{column} = EXCLUDED.{column}' for column in changed)} "
+                "RETURNING (xmax = 0) AS inserted"
+            )
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {STAGING_TABLE}")
+            cursor.copy_expert(
+                f"COPY {STAGING_TABLE} (line, {', '.join(COLUMNS)}) FROM STDIN "
+                "WITH (FORMAT csv, FORCE_NOT_NULL (name, description))",
+                buffer,
+            )
+            cursor.execute(f"WITH merged AS ({merge}) SELECT count(*) FILTER (WHERE inserted), count(*) FROM merged")
+            inserted, written = cursor.fetchone()
+            cursor.execute(
+                f"SELECT count(DISTINCT sku), count(DISTINCT sku) FILTER (WHERE NOT EXISTS "
+                f"(SELECT 1 FROM {table} AS product WHERE product.sku = {STAGING_TABLE}.sku)) FROM {STAGING_TABLE}"
+                if price_only else f"SELECT count(DISTINCT sku), 0 FROM {STAGING_TABLE}"
+            )
+            distinct, unknown = cursor.fetchone()
+            # COPY skips model signals, so invalidate cached search pages here
+            transaction.on_commit(bump_search_version)
+
+        totals["inserted"] += inserted
+        totals["updated"] += written - inserted
+        totals["unknown"] += unknown
+        totals["unchanged"] += distinct - written - unknown
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"{totals['read']:,} rows merged, {totals['read'] / elapsed:,.0f} rows/s", ending="\r")
+        self.stdout.flush()
+
+    def _read_csv(self, stream):
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+
+    def _read_jsonl(self, stream):
+        for line, text in enumerate(stream, start=1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except json.JSONDecodeError as exc:
+                raise CommandError(f"line {line}: invalid JSON: {exc}")
+            if not isinstance(record, dict):
+                raise CommandError(f"line {line}: expected a JSON object")
+            yield line, record
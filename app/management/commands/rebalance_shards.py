@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import Customer
+from app.sharding import move_customer, ring_shard, shard_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        "Move customers' orders, items and payments between order shards. "
+        "Either move the given --customer ids --to a shard, or use --ring to "
+        "move every customer whose ring shard changed after ORDER_SHARDS['RING'] "
+        "was edited."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--customer", type=int, action="append", default=[], help="Customer id; repeatable.")
+        parser.add_argument("--to", help="Target shard for --customer.")
+        parser.add_argument("--ring", action="store_true", help="Move customers to their current ring shard.")
+        parser.add_argument("--limit", type=int, help="Move at most this many customers.")
+        parser.add_argument("--batch-size", type=int, default=500, help="Orders per copy transaction.")
+        parser.add_argument("--dry-run", action="store_true", help="Only list the moves.")
+
+    def handle(self, *args, **options):
+        if options["ring"] == bool(options["customer"]):
+            raise CommandError("Pass either --customer ... --to SHARD, or --ring.")
+        if options["customer"] and options["to"] not in shard_aliases():
+            raise CommandError(f"--to must be one of {', '.join(shard_aliases())}")
+
+        moved_customers = moved_orders = 0
+        for customer, target in self._plan(options):
+            if options["limit"] is not None and moved_customers >= options["limit"]:
+                break
+            if options["dry_run"]:
+                self.stdout.write(f"would move customer {customer.pk}: {customer.order_shard or '-'} -> {target}")
+            else:
+                orders = move_customer(customer, target, batch_size=options["batch_size"])
+                moved_orders += orders
+                self.stdout.write(f"moved customer {customer.pk} to {target} ({orders} orders)")
+            moved_customers += 1
+
+        verb = "would move" if options["dry_run"] else "moved"
+        self.stdout.write(f"{verb} {moved_customers} customers ({moved_orders} orders)")
+
+    def _plan(self, options):
+        if options["customer"]:
+            customers = Customer.objects.filter(pk__in=options["customer"]).only("id", "order_shard")
+            found = {customer.pk for customer in customers}
+            missing = set(options["customer"]) - found
+            if missing:
+                raise CommandError(f"Unknown customers: {', '.join(map(str, sorted(missing)))}")
+            for customer in customers:
+                if customer.order_shard != options["to"]:
+                    yield customer, options["to"]
+            return
+
+        for customer in Customer.objects.exclude(order_shard="").only("id", "order_shard").iterator(chunk_size=2000):
+            target = ring_shard(customer.pk)
+            if target != customer.order_shard:
+                yield customer, target
@@ -0,0 +1,76 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from app.models import Customer, CustomerStats, Order
+from app.services import PAID_STATUSES, STATS_FIELDS, STATUS_COUNTERS, write_customer_stats
+from app.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild CustomerStats from the orders on every shard, a chunk of "
+        "customers per transaction, and overwrite the counters that drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--customer", type=int, action="append", default=[], help="Customer id; repeatable.")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Customers per transaction.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report the drifted customers.")
+
+    def handle(self, *args, **options):
+        customers = Customer.objects.order_by("pk")
+        if options["customer"]:
+            customers = customers.filter(pk__in=options["customer"])
+
+        checked = fixed = 0
+        last = 0
+        while True:
+            customer_ids = list(customers.filter(pk__gt=last).values_list("pk", flat=True)[: options["chunk_size"]])
+            if not customer_ids:
+                break
+            last = customer_ids[-1]
+            with transaction.atomic():
+                drifted = self._repair_chunk(customer_ids, options["dry_run"])
+            checked += len(customer_ids)
+            fixed += len(drifted)
+            for customer_id in drifted:
+                self.stdout.write(f"customer {customer_id}: counters drifted")
+            self.stdout.write(f"checked {checked} customers", ending="\r")
+
+        verb = "would fix" if options["dry_run"] else "fixed"
+        self.stdout.write(f"checked {checked} customers, {verb} {fixed}")
+
+    def _repair_chunk(self, customer_ids, dry_run):
+        # Locking the rows makes counter updates for these customers wait
+        # until the rebuilt values are written.
+        current = {
+            stats.customer_id: stats
+            for stats in CustomerStats.objects.select_for_update().filter(customer_id__in=customer_ids)
+        }
+        rebuilt = {customer_id: Counter() for customer_id in customer_ids}
+        for shard in shard_aliases():
+            totals = (
+                Order.objects.using(shard).filter(customer_id__in=customer_ids)
+                .values("customer_id", "status").annotate(orders=Count("id"), spent=Sum("total_amount")).order_by()
+            )
+            for row in totals:
+                counters = rebuilt[row["customer_id"]]
+                counters["orders_count"] += row["orders"]
+                if row["status"] in STATUS_COUNTERS:
+                    counters[STATUS_COUNTERS[row["status"]]] += row["orders"]
+                if row["status"] in PAID_STATUSES:
+                    counters["total_spent"] += row["spent"]
+
+        drifted = []
+        for customer_id, counters in rebuilt.items():
+            stats = current.get(customer_id)
+            # customers without orders don't need a row
+            stored = {field: getattr(stats, field) if stats else 0 for field in STATS_FIELDS}
+            if any(stored[field] != counters.get(field, 0) for field in STATS_FIELDS):
+                drifted.append((customer_id, counters))
+        if drifted and not dry_run:
+            write_customer_stats(drifted, replace=True)
+        return [customer_id for customer_id, _ in drifted]
@@ -0,0 +1,172 @@
+import json
+import multiprocessing
+import time
+import uuid
+import zlib
+from collections import Counter
+from contextlib import ExitStack
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections, transaction
+
+from app.journal import read_journal
+from app.models import Payment
+from app.sharding import shard_aliases
+from app.webhooks import process_momo_webhook
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid timestamp {value!r}; use ISO 8601, e.g. 2025-08-21T09:00:00")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+def _order_id(body):
+    try:
+        return str(uuid.UUID(str(json.loads(body).get("order_id"))))
+    except (ValueError, AttributeError):
+        return ""
+
+
+def _snapshot(order_ids):
+    order_ids = [order_id for order_id in order_ids if order_id]
+    return {
+        str(order_id): {"payment": payment_status, "reference": reference, "order": order_status}
+        for shard in shard_aliases()
+        for order_id, payment_status, reference, order_status in Payment.objects.using(shard).filter(
+            order_id__in=order_ids
+        ).values_list("order_id", "status", "provider_reference", "order__status")
+    }
+
+
+def _init_worker():
+    # Replay is a batch job: per-query debug logging under DEBUG would only
+    # cost CPU and memory in the worker processes.
+    settings.DEBUG = False
+
+
+def _replay_batch(batch, dry_run):
+    statuses = Counter()
+    diffs = []
+    with ExitStack() as stack:
+        # one transaction per shard, so a dry run can roll back every write
+        for shard in shard_aliases():
+            stack.enter_context(transaction.atomic(using=shard))
+        order_ids = {_order_id(body) for _, _, body in batch}
+        before = _snapshot(order_ids) if dry_run else None
+        for _, headers, body in batch:
+            try:
+                status_code, _ = process_momo_webhook(
+                    body, headers.get("HTTP_X_MOMO_SIGNATURE"), enqueue=not dry_run
+                )
+            except (ValidationError, ValueError, DatabaseError):
+                # the live view would have answered 500 here
+                status_code = 500
+            statuses[status_code] += 1
+        if dry_run:
+            after = _snapshot(order_ids)
+            diffs = [
+                {"order_id": order_id, "before": before.get(order_id), "after": state}
+                for order_id, state in after.items()
+                if before.get(order_id) != state
+            ]
+            # discards the writes and their on_commit events
+            for shard in shard_aliases():
+                transaction.set_rollback(True, using=shard)
+    return statuses, diffs
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay journaled MoMo webhooks through the webhook processing logic, "
+        "without HTTP. Use --dry-run to roll everything back and report diffs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", help="Replay from this time (ISO 8601, UTC if no offset).")
+        parser.add_argument("--until", help="Replay up to, not including, this time.")
+        parser.add_argument("--dir", help="Journal directory (defaults to WEBHOOK_JOURNAL['DIR']).")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=8)
+        parser.add_argument("--dry-run", action="store_true", help="Roll back every batch and print what would change.")
+        parser.add_argument("--max-diffs", type=int, default=50, help="Diffs to print in dry-run mode.")
+
+    def handle(self, *args, **options):
+        self.dry_run = options["dry_run"]
+        since_ms = _parse_time(options["since"]) or 0
+        until_ms = _parse_time(options["until"])
+        workers = options["workers"]
+        batch_size = options["batch_size"]
+
+        # One worker process per partition: callbacks for the same order always
+        # land in the same partition, so they replay in order, and processes
+        # (unlike threads) aren't serialized on the GIL. Forked children must
+        # not share the parent's database connections.
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        partitions = [
+            ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_worker)
+            for _ in range(workers)
+        ]
+        buffers = [[] for _ in range(workers)]
+        pending = set()
+        statuses = Counter()
+        diffs = []
+        replayed = 0
+        started = time.perf_counter()
+
+        def collect(done):
+            nonlocal replayed
+            for future in done:
+                batch_statuses, batch_diffs = future.result()
+                statuses.update(batch_statuses)
+                diffs.extend(batch_diffs)
+                replayed += sum(batch_statuses.values())
+
+        def submit(partition):
+            batch, buffers[partition] = buffers[partition], []
+            pending.add(partitions[partition].submit(_replay_batch, batch, self.dry_run))
+            # bound memory: never hold more than two batches per worker
+            while len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                pending.difference_update(done)
+                collect(done)
+
+        try:
+            for record in read_journal(options["dir"], since_ms, until_ms):
+                partition = hash(_order_id(record[2])) % workers
+                buffers[partition].append(record)
+                if len(buffers[partition]) >= batch_size:
+                    submit(partition)
+            for partition in range(workers):
+                if buffers[partition]:
+                    submit(partition)
+            done, _ = wait(pending)
+            collect(done)
+        except (OSError, zlib.error) as exc:
+            raise CommandError(f"Could not read journal: {exc}")
+        finally:
+            for executor in partitions:
+                executor.shutdown(wait=True)
+
+        elapsed = time.perf_counter() - started
+        mode = "dry run" if self.dry_run else "replayed"
+        self.stdout.write(
+            f"{mode}: {replayed} webhooks in {elapsed:.1f}s ({replayed / elapsed if elapsed else 0:,.0f}/s)"
+        )
+        for code, count in sorted(statuses.items()):
+            self.stdout.write(f"  HTTP {code}: {count}")
+        if self.dry_run:
+            self.stdout.write(f"{len(diffs)} orders would change")
+            for diff in diffs[: options["max_diffs"]]:
+                self.stdout.write(f"  {json.dumps(diff, sort_keys=True)}")
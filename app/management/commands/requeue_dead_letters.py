@@ -0,0 +1,59 @@
+from datetime import datetime, timezone
+from queue import Empty
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.queues import DEAD_LETTER_HEADER
+from core.celery import app
+
+
+class Command(BaseCommand):
+    help = (
+        "List the task calls in the dead-letter queue and send them back to "
+        "their task's queue, with their retries reset."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--task", help="Only calls of this task name.")
+        parser.add_argument("--limit", type=int, help="At most this many matching calls.")
+        parser.add_argument("--dry-run", action="store_true", help="Only list them; leave the queue as it is.")
+
+    def handle(self, *args, **options):
+        with app.connection_for_read() as connection:
+            dead_letters = connection.SimpleQueue(settings.TASK_QUEUES["DEAD_LETTER"])
+            # take every message before putting any back, so none is read twice
+            messages, matched = [], []
+            while options["limit"] is None or len(matched) < options["limit"]:
+                try:
+                    message = dead_letters.get(block=False)
+                except Empty:
+                    break
+                messages.append(message)
+                name = message.headers.get("task")
+                # messages without a task name can't be sent again; leave them
+                if name and (not options["task"] or name == options["task"]):
+                    matched.append(message)
+
+            for message in messages:
+                if message not in matched:
+                    message.requeue()
+                    continue
+                name = message.headers["task"]
+                args, kwargs, _ = message.decode()
+                info = message.headers.get(DEAD_LETTER_HEADER) or {}
+                failed_at = datetime.fromtimestamp(info.get("failed_at", 0), timezone.utc)
+                self.stdout.write(
+                    f"{failed_at:%Y-%m-%d %H:%M:%S} {name} args={args!r} kwargs={kwargs!r} "
+                    f"after {info.get('retries', '?')} retries: {info.get('error', 'unknown error')}"
+                )
+                if options["dry_run"]:
+                    message.requeue()
+                    continue
+                # routed like a new call, so it goes back to the task's own queue
+                app.send_task(name, args, kwargs)
+                message.ack()
+            dead_letters.close()
+
+        verb = "would requeue" if options["dry_run"] else "requeued"
+        self.stdout.write(f"{verb} {len(matched)} of {len(messages)} dead letters")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from app.ingest import OrderIngester
+
+
+class Command(BaseCommand):
+    help = "Drain the order ingestion queue, committing orders in group-commit batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--name", help="Worker name; keys this worker's in-flight batch in Redis.")
+        parser.add_argument("--max-batch", type=int)
+        parser.add_argument("--max-wait-ms", type=int)
+
+    def handle(self, *args, **options):
+        ingester = OrderIngester(
+            name=options["name"],
+            max_batch=options["max_batch"],
+            max_wait_ms=options["max_wait_ms"],
+        )
+        self.stdout.write(f"Order ingester {ingester.name} started (batch {ingester.max_batch}, wait {ingester.max_wait * 1000:.0f}ms)")
+        ingester.run()
@@ -0,0 +1,25 @@
+# Generated by Django 5.0 on 2026-10-19 07:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_order_confirmation_sent'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at', 'id'], name='app_order_created_5c3320_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['provider_reference'], name='app_payment_provide_7b1376_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['created_at', 'id'], name='app_payment_created_f880ab_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0 on 2026-10-19 07:04
+
+import app.ids
+from django.db import migrations, models
+
+
+# Only the Python-side default changes: existing uuid4 keys stay valid and
+# are not rewritten, new rows get time-ordered uuid7 keys.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='id',
+            field=models.UUIDField(default=app.ids.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='id',
+            field=models.UUIDField(default=app.ids.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='id',
+            field=models.UUIDField(default=app.ids.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+    ]
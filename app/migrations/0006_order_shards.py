@@ -0,0 +1,51 @@
+# Generated by Django 5.0 on 2026-10-19 07:22
+
+import app.ids
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_uuid7_primary_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderLocation',
+            fields=[
+                ('order_id', models.UUIDField(primary_key=True, serialize=False)),
+                ('shard', models.CharField(max_length=64)),
+                ('moved_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='order_shard',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        # Orders placed before sharding are all on "default": pin their customers there.
+        migrations.RunSQL(
+            "UPDATE app_customer SET order_shard = 'default' "
+            "WHERE EXISTS (SELECT 1 FROM app_order WHERE app_order.customer_id = app_customer.id)",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='customer',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='id',
+            field=models.UUIDField(default=app.ids.default_shard_uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='product',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.PROTECT, to='app.product'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.0 on 2026-10-19 07:25
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.db.models.functions.text
+from django.db import migrations, models
+
+TRIGRAM_INDEX = django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='product_name_trgm_idx')
+
+
+def add_trigram_index(apps, schema_editor):
+    # pg_trgm ships with Postgres' contrib package. Without it, substring
+    # search still works, just without an index.
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.add_index(apps.get_model('app', 'Product'), TRIGRAM_INDEX)
+
+
+def remove_trigram_index(apps, schema_editor):
+    schema_editor.execute("DROP INDEX IF EXISTS product_name_trgm_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_order_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.SearchVector('name', 'description', config='english'), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='product',
+                    index=TRIGRAM_INDEX,
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(add_trigram_index, remove_trigram_index),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], include=('search_vector', 'price'), name='product_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], include=('search_vector', 'name'), name='product_price_id_idx'),
+        ),
+    ]
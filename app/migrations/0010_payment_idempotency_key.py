@@ -0,0 +1,22 @@
+# Generated by Django 5.0 on 2026-10-19 08:07
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_product_sku'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentIdempotencyKey',
+            fields=[
+                ('idempotency_key', models.CharField(max_length=128, primary_key=True, serialize=False)),
+                ('order_id', models.UUIDField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
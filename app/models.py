@@ -3,11 +3,20 @@ import uuid
 from decimal import Decimal
 from django.db import models
 from django.utils import timezone
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db.models.functions import Upper
+
+from .ids import default_shard_uuid7, uuid7
 
 
 class Customer(AbstractUser):
     phone_number = models.CharField(max_length=20, blank=True, null=True)
+    # Database alias holding this customer's orders; empty until the first
+    # order, when it is pinned from the hash ring (see app/sharding.py).
+    order_shard = models.CharField(max_length=64, blank=True, default="")
 
     def __str__(self):
         return self.username
@@ -17,10 +26,34 @@ class Customer(AbstractUser):
 
 class Product(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # catalogue key used by import_products; products added in the admin may have none
+    sku = models.CharField(max_length=64, null=True, blank=True)
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=12, decimal_places=2)  # store in currency units
     created_at = models.DateTimeField(default=timezone.now)
+    # maintained by Postgres, so search never runs to_tsvector per row
+    search_vector = models.GeneratedField(
+        expression=SearchVector("name", "description", config=settings.PRODUCT_SEARCH["CONFIG"]),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["search_vector"], name="product_search_vector_idx"),
+            # substring matches on name (icontains); needs pg_trgm, see migration 0007
+            GinIndex(OpClass(Upper("name"), name="gin_trgm_ops"), name="product_name_trgm_idx"),
+            # Keyset pagination for each search ordering. The included columns
+            # let a search walk the index in order and test every filter
+            # without touching the table (index-only scan).
+            models.Index(fields=["name", "id"], include=["search_vector", "price"], name="product_name_id_idx"),
+            models.Index(fields=["price", "id"], include=["search_vector", "name"], name="product_price_id_idx"),
+        ]
+        constraints = [
+            # a constraint rather than unique=True, which would add a LIKE index imports don't need
+            models.UniqueConstraint(fields=["sku"], name="product_sku_uniq"),
+        ]
 
 
     def __str__(self):
@@ -36,8 +69,9 @@ class Order(models.Model):
         ("CANCELLED", "Cancelled"),
     ]
 
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="orders")
+    id = models.UUIDField(primary_key=True, default=default_shard_uuid7, editable=False)
+    # customers live on "default" while orders may live on another shard
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="orders", db_constraint=False)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="PENDING")
     total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
     created_at = models.DateTimeField(default=timezone.now)
@@ -47,6 +81,8 @@ class Order(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=["status"]),
+            # serves the admin changelist ordering (-created_at, -pk)
+            models.Index(fields=["created_at", "id"]),
         ]
 
 
@@ -57,9 +93,9 @@ class Order(models.Model):
 
 
 class OrderItem(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="items")
-    product = models.ForeignKey(Product, on_delete=models.PROTECT)
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, db_constraint=False)
     quantity = models.PositiveIntegerField()
     unit_price = models.DecimalField(max_digits=12, decimal_places=2)
 
@@ -80,7 +116,7 @@ class Payment(models.Model):
         ("FAILED", "Failed"),
     ]
 
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="payments")
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     idempotency_key = models.CharField(max_length=128, unique=True)  # enforce single charge per key
@@ -92,9 +128,59 @@ class Payment(models.Model):
         indexes = [
             models.Index(fields=["idempotency_key"]),
             models.Index(fields=["status"]),
+            models.Index(fields=["provider_reference"]),
+            models.Index(fields=["created_at", "id"]),
         ]
 
     def __str__(self):
         return f"Payment {self.id} ({self.status})"
 
 
+
+class CustomerStats(models.Model):
+    """
+    Running order counters for a customer, kept on "default" next to the
+    customer and updated on every order status transition (see
+    ``services.record_customer_stats``). ``repair_customer_stats`` rebuilds
+    them from the orders.
+    """
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name="stats")
+    orders_count = models.IntegerField(default=0)
+    pending_orders = models.IntegerField(default=0)
+    paid_orders = models.IntegerField(default=0)
+    cancelled_orders = models.IntegerField(default=0)
+    # sum of the totals of paid orders
+    total_spent = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Stats for customer {self.customer_id}"
+
+
+
+class OrderLocation(models.Model):
+    """
+    Orders that no longer live on the shard their id encodes, because
+    ``rebalance_shards`` moved their customer. Always stored on "default".
+    """
+    order_id = models.UUIDField(primary_key=True)
+    shard = models.CharField(max_length=64)
+    moved_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Order {self.order_id} on {self.shard}"
+
+
+class PaymentIdempotencyKey(models.Model):
+    """
+    Every Idempotency-Key used to charge a payment, always stored on
+    "default": payments live on their order's shard, where the unique
+    ``Payment.idempotency_key`` can't see keys used on other shards.
+    """
+    idempotency_key = models.CharField(max_length=128, primary_key=True)
+    # the payment is found through its order, which rebalance_shards may move
+    order_id = models.UUIDField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Idempotency key {self.idempotency_key} for order {self.order_id}"
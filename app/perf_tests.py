@@ -0,0 +1,186 @@
+"""
+Performance regression suite.
+
+Query budgets assert the exact number of SQL queries each hot path issues
+for orders with 1, 10 and 100 items, so an N+1 fails CI instead of shipping.
+
+Microbenchmarks use pytest-benchmark and run once, untimed, in a normal test
+run (``--benchmark-disable`` in pytest.ini). The ``perf`` service in
+docker-compose.yml times them and fails if a mean regresses by more than 25%
+against a baseline it records on its own host in ``.benchmarks/`` the first
+time it runs. Timings from different hosts are never compared.
+"""
+import hashlib
+import hmac
+import json
+from decimal import Decimal
+from uuid import uuid4
+
+import pytest
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+from unittest.mock import patch
+
+from app.models import Customer, Order, Payment, Product
+from app.serializers import OrderSerializer
+from app.services import create_order
+from app.tasks import send_confirmation_message
+from app.webhooks import process_momo_webhook, verify_signature
+
+ITEM_COUNTS = [1, 10, 100]
+
+
+@pytest.fixture(autouse=True)
+def no_admission_control(settings):
+    """Keep limiter round trips out of the measurements."""
+    settings.ADMISSION_CONTROL = {**settings.ADMISSION_CONTROL, "ENABLED": False}
+    settings.WEBHOOK_JOURNAL = {**settings.WEBHOOK_JOURNAL, "ENABLED": False}
+
+
+@pytest.fixture
+def customer(db):
+    # already pinned to a shard, as every customer is after their first order
+    return Customer.objects.create(username="perf", phone_number="+233200000000", order_shard="default")
+
+
+@pytest.fixture
+def products(db):
+    return [Product.objects.create(name=f"Product {i}", price=Decimal("5.00")) for i in range(100)]
+
+
+def make_order(customer, products, item_count):
+    with transaction.atomic():
+        return create_order(customer, [{"product": product, "quantity": 2} for product in products[:item_count]])
+
+
+def signed_webhook(order, provider_reference="MO-PERF-1"):
+    payload = {"order_id": str(order.id), "provider_reference": provider_reference, "status": "success"}
+    canonical = json.dumps(payload, separators=(',', ':'), sort_keys=True)
+    signature = hmac.new(settings.MOMO_WEBHOOK_SECRET.encode(), canonical.encode(), hashlib.sha256).hexdigest()
+    return json.dumps(payload).encode(), signature
+
+
+# --- query budgets ----------------------------------------------------------
+
+
+@pytest.mark.parametrize("item_count", ITEM_COUNTS)
+def test_order_create_query_budget(client, django_assert_num_queries, customer, products, item_count):
+    """
+    customer lookup, one product lookup for all items, savepoint pair, order
+    insert, bulk item insert, customer stats upsert, item reload for the
+    response.
+    """
+    payload = {
+        "customer": customer.id,
+        "items": [{"product": str(product.id), "quantity": 1} for product in products[:item_count]],
+    }
+    with django_assert_num_queries(8):
+        response = client.post(reverse("order-create"), data=payload, content_type="application/json")
+    assert response.status_code == 201
+    assert len(response.json()["items"]) == item_count
+
+
+@pytest.mark.parametrize("item_count", ITEM_COUNTS)
+def test_order_retrieve_query_budget(client, django_assert_num_queries, customer, products, item_count):
+    order = make_order(customer, products, item_count)
+    url = reverse("order-retrive", kwargs={"pk": order.id})
+
+    with django_assert_num_queries(2):
+        response = client.get(url)
+    assert len(response.json()["items"]) == item_count
+
+    with django_assert_num_queries(1):
+        assert client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code == 304
+
+
+@pytest.mark.parametrize("item_count", ITEM_COUNTS)
+def test_payment_charge_query_budget(client, django_assert_num_queries, customer, products, item_count):
+    """
+    shard lookup, idempotency key and payment lookups, order lookup, key
+    claim, payment insert, status update, plus the savepoint pair.
+    Independent of the item count.
+    """
+    order = make_order(customer, products, item_count)
+
+    with django_assert_num_queries(9):
+        response = client.post(
+            reverse("payment-charge"),
+            data={"order": str(order.id)},
+            content_type="application/json",
+            HTTP_IDEMPOTENCY_KEY=f"charge:{order.id}",
+        )
+    assert response.status_code == 201
+
+
+@pytest.mark.parametrize("item_count", ITEM_COUNTS)
+def test_webhook_query_budget(client, django_assert_num_queries, customer, products, item_count):
+    """
+    reference check, payment + order locked in one query, two updates,
+    customer stats upsert, plus the savepoint pair.
+    """
+    order = make_order(customer, products, item_count)
+    Payment.objects.create(order=order, amount=order.total_amount, idempotency_key=str(uuid4()))
+    body, signature = signed_webhook(order)
+
+    with patch("app.webhooks.send_confirmation_message.delay"), django_assert_num_queries(7):
+        response = client.post(
+            reverse("momo-webhook"), data=body, content_type="application/json", HTTP_X_MOMO_SIGNATURE=signature
+        )
+    assert response.status_code == 200
+
+
+def test_send_confirmation_message_query_budget(django_assert_num_queries, customer, products):
+    """
+    order lock on its shard, phone number from "default", update, plus the
+    savepoint pair.
+    """
+    order = make_order(customer, products, 10)
+
+    with django_assert_num_queries(5):
+        send_confirmation_message.apply(args=[order.id])
+    order.refresh_from_db()
+    assert order.confirmation_sent
+
+
+# --- microbenchmarks --------------------------------------------------------
+
+
+def test_bench_order_serialization(benchmark, customer, products):
+    order = make_order(customer, products, 10)
+    order = Order.objects.prefetch_related("items").get(id=order.id)
+
+    data = benchmark(lambda: OrderSerializer(order).data)
+    assert len(data["items"]) == 10
+
+
+def test_bench_webhook_hmac_verification(benchmark, customer, products):
+    order = make_order(customer, products, 1)
+    body, signature = signed_webhook(order)
+
+    assert benchmark(verify_signature, body, signature) == json.loads(body)
+
+
+def test_bench_order_creation(benchmark, customer, products):
+    payload = {
+        "customer": customer.id,
+        "items": [{"product": str(product.id), "quantity": 1} for product in products[:10]],
+    }
+
+    def create():
+        serializer = OrderSerializer(data=payload)
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    assert benchmark(create).items.count() == 10
+
+
+def test_bench_webhook_processing(benchmark, customer, products):
+    order = make_order(customer, products, 1)
+    Payment.objects.create(order=order, amount=order.total_amount, idempotency_key=str(uuid4()))
+    body, signature = signed_webhook(order)
+    process_momo_webhook(body, signature, enqueue=False)
+
+    # measures the replay/idempotent path every provider retry takes
+    status_code, _ = benchmark(process_momo_webhook, body, signature, enqueue=False)
+    assert status_code == 200
@@ -0,0 +1,28 @@
+import logging
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MomoClient:
+    """
+    Client for the MoMo transaction status API.
+
+    There is no sandbox credential in this project yet, so the client is a
+    local stub: it waits ``MOMO_STUB["LATENCY"]`` seconds to mimic the network
+    round trip and answers with ``MOMO_STUB["STATUS"]``.
+    """
+
+    def get_transaction_status(self, payment):
+        """
+        Return ``{"status": ..., "provider_reference": ...}`` for ``payment``.
+        ``status`` uses the webhook vocabulary ("success", "failed") or
+        "pending" while the provider has no final answer.
+        """
+        time.sleep(settings.MOMO_STUB["LATENCY"])
+        return {
+            "status": settings.MOMO_STUB["STATUS"],
+            "provider_reference": f"momo_stub_{payment.id.hex}",
+        }
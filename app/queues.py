@@ -0,0 +1,74 @@
+"""
+Celery queues: time-sensitive work on "realtime", bulk and reconciliation
+jobs on "bulk", everything else on "maintenance" (see ``CELERY_TASK_ROUTES``),
+each drained by its own worker service so a bulk backlog never delays a
+confirmation.
+
+Tasks built on ``DeadLetterTask`` are re-published to the dead-letter queue
+when they fail for good, and ``manage.py requeue_dead_letters`` sends them
+back. Every task logs how long it waited in its queue.
+"""
+import logging
+import time
+from datetime import datetime
+
+from celery import Task
+from celery.signals import before_task_publish, task_prerun
+from django.conf import settings
+
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+ENQUEUED_AT_HEADER = "enqueued_at"
+DEAD_LETTER_HEADER = "dead_letter"
+
+
+class DeadLetterTask(Task):
+    """
+    Base for tasks whose calls must not be lost. Once a call has used up
+    ``max_retries`` (or raised an error it doesn't retry), it is published,
+    with its arguments unchanged, to ``TASK_QUEUES["DEAD_LETTER"]`` where
+    no worker consumes it. The error and retry count go in its headers.
+    """
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        queue = settings.TASK_QUEUES["DEAD_LETTER"]
+        try:
+            self.apply_async(args, kwargs, queue=queue, headers={DEAD_LETTER_HEADER: {
+                "task_id": task_id,
+                "error": f"{type(exc).__name__}: {exc}",
+                "retries": self.request.retries,
+                "failed_at": time.time(),
+            }})
+        except Exception as publish_exc:
+            logger.error(f"Could not dead-letter {self.name} {task_id}: {publish_exc}")
+            return
+        logger.warning(f"{self.name} {task_id} failed after {self.request.retries} retries, moved to {queue}: {exc!r}")
+
+
+@before_task_publish.connect
+def _stamp_enqueued_at(headers=None, **kwargs):
+    if headers is None:
+        return
+    enqueued_at = time.time()
+    if headers.get("eta"):
+        # retries and countdowns only start waiting once they are due
+        enqueued_at = max(enqueued_at, datetime.fromisoformat(headers["eta"]).timestamp())
+    headers[ENQUEUED_AT_HEADER] = enqueued_at
+
+
+@task_prerun.connect
+def _log_queue_wait(task_id=None, task=None, **kwargs):
+    request = task.request
+    # a worker exposes message headers as request attributes; apply() keeps them apart
+    enqueued_at = getattr(request, ENQUEUED_AT_HEADER, None) or (request.headers or {}).get(ENQUEUED_AT_HEADER)
+    if enqueued_at is None or request.is_eager:
+        return
+    wait_ms = (time.time() - enqueued_at) * 1000
+    queue = (request.delivery_info or {}).get("routing_key") or "unknown"
+    tracing.set_attribute("celery.queue_wait_ms", round(wait_ms, 1))
+    if wait_ms > settings.TASK_QUEUES["MAX_WAIT_MS"].get(queue, float("inf")):
+        logger.warning(f"{task.name} {task_id} waited {wait_ms:.0f}ms in {queue}")
+    else:
+        logger.debug(f"{task.name} {task_id} waited {wait_ms:.0f}ms in {queue}")
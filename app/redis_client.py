@@ -0,0 +1,40 @@
+import logging
+import time
+
+from django.conf import settings
+
+from .tracing import TracedRedis
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_down_until = 0.0
+
+
+def get_redis():
+    """
+    Return the process-wide Redis client, or None while Redis is marked down.
+
+    Callers on the request path must fail open: if this returns None (or a
+    command raises redis.RedisError) they should carry on without Redis.
+    """
+    global _client
+    if time.monotonic() < _down_until:
+        return None
+    if _client is None:
+        _client = TracedRedis.from_url(
+            settings.REDIS_URL,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+    return _client
+
+
+def mark_redis_down(exc):
+    """
+    Stop talking to Redis for a short cooldown after a connection error, so an
+    outage costs one timeout per cooldown instead of one per request.
+    """
+    global _down_until
+    _down_until = time.monotonic() + settings.REDIS_FAILURE_COOLDOWN
+    logger.warning(f"Redis unavailable, failing open for {settings.REDIS_FAILURE_COOLDOWN}s: {exc}")
@@ -0,0 +1,202 @@
+"""
+Product search for ``GET /api/products/``.
+
+Matching uses the stored ``Product.search_vector`` (full text over name and
+description, GIN indexed) plus a case-insensitive substring match on the
+name, served by the ``pg_trgm`` GIN index. Results are paged by keyset on
+``(ordering column, id)``, so every page costs the same however deep it is.
+Result pages are cached in Redis for ``PRODUCT_SEARCH["CACHE_TTL"]``
+seconds under a version number that any product change bumps.
+"""
+import base64
+import hashlib
+import json
+import uuid
+from decimal import Decimal, InvalidOperation
+
+import redis
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.exceptions import ValidationError
+
+from .models import Product
+from .redis_client import get_redis, mark_redis_down
+
+# ordering parameter -> (column, descending)
+ORDERINGS = {
+    "name": ("name", False),
+    "price": ("price", False),
+    "-price": ("price", True),
+}
+VERSION_KEY = "products:search:version"
+# Substring matching (partial words while typing) only pays off for a
+# single term of at least one full trigram; longer queries use full text.
+MIN_SUBSTRING_LENGTH = 3
+
+
+class SearchParams:
+    """Validated query parameters of one search request."""
+
+    def __init__(self, query_params):
+        config = settings.PRODUCT_SEARCH
+        errors = {}
+
+        self.q = " ".join(query_params.get("q", "").split())
+        if len(self.q) > config["MAX_QUERY_LENGTH"]:
+            errors["q"] = [f"Ensure this field has no more than {config['MAX_QUERY_LENGTH']} characters."]
+
+        self.min_price = self._price(query_params, "min_price", errors)
+        self.max_price = self._price(query_params, "max_price", errors)
+
+        self.ordering = query_params.get("ordering", "name")
+        if self.ordering not in ORDERINGS:
+            errors["ordering"] = [f"Must be one of: {', '.join(ORDERINGS)}."]
+
+        try:
+            self.page_size = min(int(query_params.get("page_size", config["PAGE_SIZE"])), config["MAX_PAGE_SIZE"])
+            if self.page_size < 1:
+                raise ValueError
+        except ValueError:
+            errors["page_size"] = ["A positive integer is required."]
+
+        self.cursor = query_params.get("cursor") or None
+        self.after = None
+        if self.cursor and not errors:
+            self.after = self._decode_cursor(self.cursor, errors)
+
+        if errors:
+            raise ValidationError(errors)
+
+    def _price(self, query_params, name, errors):
+        value = query_params.get(name)
+        if value in (None, ""):
+            return None
+        try:
+            price = Decimal(value)
+        except InvalidOperation:
+            errors[name] = ["A valid number is required."]
+            return None
+        if not price.is_finite() or price < 0:
+            errors[name] = ["A valid non-negative number is required."]
+            return None
+        return price
+
+    def _decode_cursor(self, cursor, errors):
+        try:
+            ordering, value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if ordering != self.ordering:
+                raise ValueError
+            column, _ = ORDERINGS[ordering]
+            return (Decimal(value) if column == "price" else value), uuid.UUID(last_id)
+        except (ValueError, TypeError, KeyError, InvalidOperation):
+            errors["cursor"] = ["Invalid cursor."]
+            return None
+
+    def cache_key(self, version):
+        raw = json.dumps(
+            [self.q.lower(), str(self.min_price), str(self.max_price), self.ordering, self.page_size, self.cursor]
+        )
+        return f"products:search:{version}:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+
+def encode_cursor(ordering, value, product_id):
+    return base64.urlsafe_b64encode(json.dumps([ordering, str(value), str(product_id)]).encode()).decode()
+
+
+def search_products(params):
+    """
+    Return one page of products for ``params`` and the cursor of the next
+    page (None on the last page).
+    """
+    queryset = Product.objects.all()
+    if params.q:
+        matches = Q(search_vector=SearchQuery(params.q, search_type="websearch", config=settings.PRODUCT_SEARCH["CONFIG"]))
+        if len(params.q) >= MIN_SUBSTRING_LENGTH and " " not in params.q:
+            matches |= Q(name__icontains=params.q)
+        queryset = queryset.filter(matches)
+    if params.min_price is not None:
+        queryset = queryset.filter(price__gte=params.min_price)
+    if params.max_price is not None:
+        queryset = queryset.filter(price__lte=params.max_price)
+
+    column, descending = ORDERINGS[params.ordering]
+    if params.after is not None:
+        value, last_id = params.after
+        # the first condition bounds the index range scan, the second skips ties already seen
+        if descending:
+            queryset = queryset.filter(Q(**{f"{column}__lte": value}), Q(**{f"{column}__lt": value}) | Q(id__lt=last_id))
+        else:
+            queryset = queryset.filter(Q(**{f"{column}__gte": value}), Q(**{f"{column}__gt": value}) | Q(id__gt=last_id))
+    order = [f"-{column}", "-id"] if descending else [column, "id"]
+
+    # Find the page's keys first: that query only needs the covering index,
+    # so rows that fail the filters are rejected without reading the table.
+    # One extra key tells us whether there is a next page.
+    keys = list(queryset.order_by(*order).values_list(column, "id")[: params.page_size + 1])
+    next_cursor = None
+    if len(keys) > params.page_size:
+        keys = keys[: params.page_size]
+        next_cursor = encode_cursor(params.ordering, *keys[-1])
+
+    products = Product.objects.defer("search_vector", "created_at").in_bulk([product_id for _, product_id in keys])
+    return [products[product_id] for _, product_id in keys if product_id in products], next_cursor
+
+
+def cache_version(client):
+    """The current cache version, or None if Redis is unavailable."""
+    try:
+        return int(client.get(VERSION_KEY) or 0)
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return None
+
+
+def get_cached_page(params):
+    """Return ``(cached_page_or_None, cache_key_or_None)``."""
+    client = get_redis()
+    if client is None or not settings.PRODUCT_SEARCH["CACHE_TTL"]:
+        return None, None
+    version = cache_version(client)
+    if version is None:
+        return None, None
+    key = params.cache_key(version)
+    try:
+        raw = client.get(key)
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return None, None
+    return (json.loads(raw) if raw else None), key
+
+
+def cache_page(key, page):
+    client = get_redis()
+    if client is None or key is None:
+        return
+    try:
+        client.set(key, json.dumps(page), ex=settings.PRODUCT_SEARCH["CACHE_TTL"])
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+
+
+def bump_search_version():
+    """
+    Invalidate every cached search page. Called after product writes commit;
+    bulk writes that skip model signals must call it themselves.
+    """
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.incr(VERSION_KEY)
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, **kwargs):
+    transaction.on_commit(bump_search_version)
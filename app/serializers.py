@@ -1,15 +1,38 @@
+import uuid
+
+from django.db import DEFAULT_DB_ALIAS, transaction
 from rest_framework import serializers
-from .models import Customer, Product, Order, OrderItem, Payment
+from .models import Customer, CustomerStats, Product, Order, OrderItem, Payment
+from .services import create_order
+from .sharding import shard_for_customer
 
 
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ["id", "name", "description", "price"]
+        fields = ["id", "sku", "name", "description", "price"]
+
+
+class PrefetchedProductField(serializers.PrimaryKeyRelatedField):
+    """
+    Product lookup that reads from the products OrderSerializer fetched for
+    all items in one query, instead of one query per item. Falls back to the
+    regular lookup (and its error messages) for anything not prefetched.
+    """
+
+    def to_internal_value(self, data):
+        prefetched = self.context.get("prefetched_products", {})
+        try:
+            product = prefetched.get(uuid.UUID(str(data)))
+        except ValueError:
+            product = None
+        if product is not None:
+            return product
+        return super().to_internal_value(data)
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
-    # product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all())
+    product = PrefetchedProductField(queryset=Product.objects.all())
 
     class Meta:
         model = OrderItem
@@ -33,31 +56,35 @@ class OrderSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ["status", "total_amount", "created_at", "status"]
 
+    def to_internal_value(self, data):
+        items = data.get("items") if hasattr(data, "get") else None
+        if isinstance(items, list):
+            product_ids = set()
+            for item in items:
+                try:
+                    product_ids.add(uuid.UUID(str(item["product"])))
+                except (TypeError, KeyError, ValueError):
+                    continue
+            self.context["prefetched_products"] = Product.objects.in_bulk(product_ids)
+        return super().to_internal_value(data)
+
     def create(self, validated_data):
         items_data = validated_data.pop("items")
-        order = Order.objects.create(**validated_data)
+        shard = shard_for_customer(validated_data["customer"])
+        with transaction.atomic(using=shard):
+            return create_order(items=items_data, using=shard, **validated_data)
 
-        total = 0
-        for item_data in items_data:
-            product = item_data["product"]
-            quantity = item_data["quantity"]
-            unit_price = product.price
-            total_price = unit_price * quantity
 
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                quantity=quantity,
-                unit_price=unit_price,
-            )
-            total += total_price
+class ShardOrderField(serializers.PrimaryKeyRelatedField):
+    """Order lookup on the shard the view resolved (``context["shard"]``)."""
 
-        order.total_amount = total
-        order.save()
-        return order
+    def get_queryset(self):
+        return super().get_queryset().using(self.context.get("shard", DEFAULT_DB_ALIAS))
 
 
 class PaymentSerializer(serializers.ModelSerializer):
+    order = ShardOrderField(queryset=Order.objects.all())
+
     class Meta:
         model = Payment
         fields = [
@@ -76,7 +103,19 @@ class PaymentSerializer(serializers.ModelSerializer):
         # enforce order amount
         validated_data["amount"] = order.total_amount  
 
-        return super().create(validated_data)
+        return Payment.objects.using(order._state.db).create(**validated_data)
 
 
+class CustomerStatsSerializer(serializers.ModelSerializer):
+    orders_by_status = serializers.SerializerMethodField()
 
+    class Meta:
+        model = CustomerStats
+        fields = ["customer", "orders_count", "orders_by_status", "total_spent", "updated_at"]
+
+    def get_orders_by_status(self, stats):
+        return {
+            "PENDING": stats.pending_orders,
+            "PAID": stats.paid_orders,
+            "CANCELLED": stats.cancelled_orders,
+        }
@@ -0,0 +1,165 @@
+from collections import Counter
+from decimal import Decimal
+from functools import partial
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from .models import CustomerStats, Order, OrderItem, PaymentIdempotencyKey
+from .sharding import new_order_id
+
+# Payment statuses a charge can be left in while we wait for the provider.
+# PaymentChargeView writes "Initiated"; the model default is "INITIATED".
+INITIATED_STATUSES = ("INITIATED", "Initiated")
+
+# Order status -> CustomerStats counter. payment_transition writes "Paid"
+# while the model's choices say "PAID"; both count as paid.
+STATUS_COUNTERS = {
+    "PENDING": "pending_orders",
+    "PAID": "paid_orders",
+    "Paid": "paid_orders",
+    "CANCELLED": "cancelled_orders",
+}
+PAID_STATUSES = ("PAID", "Paid")
+STATS_FIELDS = ("orders_count", "pending_orders", "paid_orders", "cancelled_orders", "total_spent")
+
+
+def payment_transition(status_from_provider):
+    """
+    Map a provider status to ``(payment_status, order_status)``.
+
+    This is the single source of the rules MomoWebhookView applies, so the
+    stale-payment sweeper ends up in exactly the same states. ``order_status``
+    is None when the order should be left alone.
+    """
+    if status_from_provider == "success":
+        return "Success", "Paid"
+    return status_from_provider or "failed", None
+
+
+def order_stats_change(old_status, new_status, total_amount):
+    """
+    CustomerStats changes for one order moving from ``old_status`` to
+    ``new_status``; ``old_status`` is None for a new order.
+    """
+    change = Counter()
+    if old_status == new_status:
+        return change
+    if old_status is None:
+        change["orders_count"] += 1
+    if old_status in STATUS_COUNTERS:
+        change[STATUS_COUNTERS[old_status]] -= 1
+    if new_status in STATUS_COUNTERS:
+        change[STATUS_COUNTERS[new_status]] += 1
+    if (new_status in PAID_STATUSES) != (old_status in PAID_STATUSES):
+        change["total_spent"] += total_amount if new_status in PAID_STATUSES else -total_amount
+    return change
+
+
+def record_customer_stats(changes, using=DEFAULT_DB_ALIAS):
+    """
+    Add ``changes`` (``{customer_id: Counter}``) to the customers' stats as
+    part of the current transaction on shard ``using``.
+
+    Stats live on "default". For orders on "default" they are updated in the
+    order's own transaction; for other shards, right after it commits, so a
+    crash in between can lose an update until ``repair_customer_stats`` runs.
+    """
+    rows = sorted((customer_id, change) for customer_id, change in changes.items() if any(change.values()))
+    if not rows:
+        return
+    if using == DEFAULT_DB_ALIAS:
+        write_customer_stats(rows)
+    else:
+        transaction.on_commit(partial(write_customer_stats, rows), using=using)
+
+
+def write_customer_stats(rows, replace=False):
+    """
+    Upsert ``(customer_id, counters)`` rows into CustomerStats with a single
+    statement: counters are added to the stored ones (``col = col + n``), or
+    overwrite them with ``replace``. Rows for new customers are created.
+    Rows must be sorted by customer id so concurrent writers lock in the
+    same order.
+    """
+    table = CustomerStats._meta.db_table
+    if replace:
+        updates = ", ".join(f"{field} = EXCLUDED.{field}" for field in STATS_FIELDS)
+    else:
+        updates = ", ".join(f"{field} = {table}.{field} + EXCLUDED.{field}" for field in STATS_FIELDS)
+    values = ", ".join(["(" + ", ".join(["%s"] * (len(STATS_FIELDS) + 2)) + ")"] * len(rows))
+    now = timezone.now()
+    params = []
+    for customer_id, counters in rows:
+        params += [customer_id, *(counters.get(field, 0) for field in STATS_FIELDS), now]
+    with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (customer_id, {', '.join(STATS_FIELDS)}, updated_at) VALUES {values} "
+            f"ON CONFLICT (customer_id) DO UPDATE SET {updates}, updated_at = EXCLUDED.updated_at",
+            params,
+        )
+
+
+def claim_idempotency_key(idempotency_key, order_id):
+    """
+    Register ``idempotency_key`` for a charge of ``order_id`` on "default",
+    with one INSERT ... ON CONFLICT DO NOTHING. Returns False if the key was
+    already used. A concurrent claim of the same key blocks until the first
+    transaction ends.
+    """
+    with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {PaymentIdempotencyKey._meta.db_table} (idempotency_key, order_id, created_at) "
+            "VALUES (%s, %s, %s) ON CONFLICT (idempotency_key) DO NOTHING",
+            [idempotency_key, order_id, timezone.now()],
+        )
+        return cursor.rowcount == 1
+
+
+def _build_order(customer, items, order_id, using):
+    total = sum((item["product"].price * item["quantity"] for item in items), Decimal("0.00"))
+    order = Order(id=order_id or new_order_id(using), customer=customer, total_amount=total)
+    order_items = [
+        OrderItem(
+            order=order,
+            product=item["product"],
+            quantity=item["quantity"],
+            unit_price=item["product"].price,
+        )
+        for item in items
+    ]
+    return order, order_items
+
+
+def create_order(customer, items, order_id=None, using=DEFAULT_DB_ALIAS):
+    """
+    Insert an order and its items on shard ``using``, pricing each item at the
+    product's current price. ``items`` is a list of
+    ``{"product": Product, "quantity": int}``.
+
+    The total is computed up front so the order is written once, and items go
+    in with a single bulk insert. Must be called inside a transaction on
+    ``using``. A new order id encodes ``using``; a given ``order_id`` must
+    already encode it.
+    """
+    order, order_items = _build_order(customer, items, order_id, using)
+    order.save(force_insert=True, using=using)
+    OrderItem.objects.using(using).bulk_create(order_items)
+    record_customer_stats({order.customer_id: order_stats_change(None, order.status, order.total_amount)}, using)
+    return order
+
+
+def create_orders(orders, using=DEFAULT_DB_ALIAS):
+    """
+    Bulk variant of ``create_order`` for ``(customer, items, order_id)``
+    tuples: two INSERT statements, plus one for the customers' stats,
+    however many orders there are.
+    """
+    built = [_build_order(customer, items, order_id, using) for customer, items, order_id in orders]
+    Order.objects.using(using).bulk_create([order for order, _ in built])
+    OrderItem.objects.using(using).bulk_create([item for _, order_items in built for item in order_items])
+    changes = {}
+    for order, _ in built:
+        changes.setdefault(order.customer_id, Counter()).update(order_stats_change(None, order.status, order.total_amount))
+    record_customer_stats(changes, using)
+    return [order for order, _ in built]
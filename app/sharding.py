@@ -0,0 +1,270 @@
+"""
+Customer-sharded storage for orders, order items and payments.
+
+Each customer is pinned to one database alias (``Customer.order_shard``) the
+first time they order; until then their shard comes from a consistent-hash
+ring over ``ORDER_SHARDS["RING"]``, so adding a shard to the ring only
+changes the assignment of about 1/N of new customers. Customers, products
+and everything else stay on "default".
+
+Order ids encode the position of their shard in ``ORDER_SHARDS["DATABASES"]``
+(see ``ids.uuid7``), so a lookup by order id alone goes straight to the
+right database. Orders moved by ``rebalance_shards`` keep their id and get an
+``OrderLocation`` row instead; orders created before sharding are on
+"default". ``candidate_shards`` tries those places in that order.
+"""
+import bisect
+import hashlib
+import uuid
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import ProtectedError
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .ids import uuid7, uuid7_shard
+from .models import Customer, Order, OrderItem, OrderLocation, Payment, Product
+
+SHARDED_MODELS = {"order", "orderitem", "payment"}
+
+
+def _is_sharded(model):
+    return model._meta.app_label == "app" and model._meta.model_name in SHARDED_MODELS
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent-hash ring with ``vnodes`` points per node."""
+
+    def __init__(self, nodes, vnodes):
+        if not nodes:
+            raise ValueError("A hash ring needs at least one node")
+        points = sorted((_hash(f"{node}#{vnode}"), node) for node in nodes for vnode in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        position = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._nodes[position]
+
+
+@lru_cache(maxsize=8)
+def _ring(nodes, vnodes):
+    return HashRing(nodes, vnodes)
+
+
+def shard_aliases():
+    return settings.ORDER_SHARDS["DATABASES"]
+
+
+def ring_shard(customer_id):
+    """Shard the ring assigns to a customer that has not been pinned yet."""
+    config = settings.ORDER_SHARDS
+    return _ring(tuple(config["RING"]), config["VNODES"]).node_for(customer_id)
+
+
+def shard_for_customer(customer):
+    """
+    Return the alias holding ``customer``'s orders, pinning an unpinned
+    customer to their ring shard so later ring changes never move them.
+    """
+    if not customer.order_shard:
+        alias = ring_shard(customer.pk)
+        if Customer.objects.filter(pk=customer.pk, order_shard="").update(order_shard=alias):
+            customer.order_shard = alias
+        else:
+            # pinned concurrently
+            customer.order_shard = Customer.objects.filter(pk=customer.pk).values_list("order_shard", flat=True).get()
+    return customer.order_shard
+
+
+def shard_index(alias):
+    return shard_aliases().index(alias)
+
+
+def new_order_id(alias):
+    """A fresh order id that routes lookups to ``alias``."""
+    return uuid7(shard=shard_index(alias))
+
+
+def encoded_shard(order_id):
+    """The shard an order id was created for, or None if it encodes none."""
+    index = uuid7_shard(order_id)
+    aliases = shard_aliases()
+    return aliases[index] if index is not None and index < len(aliases) else None
+
+
+def candidate_shards(order_id):
+    """
+    Yield, most likely first, the aliases an order may live on: the shard its
+    id encodes, then the shard ``rebalance_shards`` recorded for it, then
+    "default". Yields nothing for values that aren't UUIDs.
+    """
+    try:
+        order_id = order_id if isinstance(order_id, uuid.UUID) else uuid.UUID(str(order_id))
+    except ValueError:
+        return
+    tried = set()
+
+    encoded = encoded_shard(order_id)
+    if encoded is not None:
+        tried.add(encoded)
+        yield encoded
+        if len(shard_aliases()) == 1:
+            return
+
+    moved_to = OrderLocation.objects.filter(order_id=order_id).values_list("shard", flat=True).first()
+    for alias in (moved_to, DEFAULT_DB_ALIAS):
+        if alias and alias not in tried:
+            tried.add(alias)
+            yield alias
+
+
+def find_on_shards(order_id, query):
+    """
+    Return the first result of ``query(alias)`` that isn't None, trying the
+    aliases from ``candidate_shards``, or None if the order is on none of them.
+    """
+    for alias in candidate_shards(order_id):
+        result = query(alias)
+        if result is not None:
+            return result
+    return None
+
+
+def order_shard(order_id):
+    """Alias of the shard holding the order, or None if there is no such order."""
+    return find_on_shards(
+        order_id, lambda alias: alias if Order.objects.using(alias).filter(pk=order_id).exists() else None
+    )
+
+
+def move_customer(customer, target, batch_size=500):
+    """
+    Move all of a customer's orders, items and payments to shard ``target``
+    and pin the customer there. Returns the number of orders moved.
+
+    The customer is repinned first so new orders go straight to ``target``,
+    then every other shard is drained in batches until none of the
+    customer's orders are left, which also catches orders that were being
+    written while the move started. Each batch stays locked on its source
+    while it is copied to ``target`` and recorded in ``OrderLocation``, and
+    is deleted from the source last, so every order stays reachable by id
+    throughout. An interrupted move can simply be run again.
+    """
+    if target not in shard_aliases():
+        raise ValueError(f"Unknown shard {target!r}")
+    Customer.objects.filter(pk=customer.pk).update(order_shard=target)
+    customer.order_shard = target
+
+    moved = 0
+    for source in shard_aliases():
+        if source == target:
+            continue
+        while True:
+            with transaction.atomic(using=source):
+                orders = list(
+                    Order.objects.using(source).select_for_update()
+                    .filter(customer_id=customer.pk).order_by("id")[:batch_size]
+                )
+                if not orders:
+                    break
+                order_ids = [order.id for order in orders]
+                items = list(OrderItem.objects.using(source).filter(order_id__in=order_ids))
+                payments = list(Payment.objects.using(source).filter(order_id__in=order_ids))
+                _copy_rows(target, orders, items, payments)
+                _record_locations(order_ids, target)
+                Order.objects.using(source).filter(id__in=order_ids).delete()
+            moved += len(orders)
+    return moved
+
+
+def _copy_rows(target, orders, items, payments):
+    # rows already on the target come from an earlier, interrupted move
+    with transaction.atomic(using=target):
+        for model, rows in ((Order, orders), (OrderItem, items), (Payment, payments)):
+            present = set(
+                model.objects.using(target).filter(pk__in=[row.pk for row in rows]).values_list("pk", flat=True)
+            )
+            model.objects.using(target).bulk_create([row for row in rows if row.pk not in present])
+
+
+def _record_locations(order_ids, target):
+    home = [order_id for order_id in order_ids if encoded_shard(order_id) == target]
+    away = [order_id for order_id in order_ids if encoded_shard(order_id) != target]
+    OrderLocation.objects.filter(order_id__in=home).delete()
+    OrderLocation.objects.bulk_create(
+        [OrderLocation(order_id=order_id, shard=target, moved_at=timezone.now()) for order_id in away],
+        update_conflicts=True,
+        unique_fields=["order_id"],
+        update_fields=["shard", "moved_at"],
+    )
+
+
+@receiver(pre_delete, sender=Customer)
+def _delete_sharded_orders(sender, instance, using, **kwargs):
+    """
+    Deleting a customer cascades to their orders only on the customer's own
+    database; delete the orders (with their items and payments) on every
+    other shard here, so none are left orphaned.
+    """
+    order_ids = []
+    for alias in shard_aliases():
+        orders = Order.objects.using(alias).filter(customer_id=instance.pk)
+        order_ids += orders.values_list("id", flat=True)
+        if alias != using:
+            with transaction.atomic(using=alias):
+                orders.delete()
+    OrderLocation.objects.filter(order_id__in=order_ids).delete()
+
+
+@receiver(pre_delete, sender=Product)
+def _protect_sharded_order_items(sender, instance, using, **kwargs):
+    """
+    ``OrderItem.product`` is PROTECT, but the delete collector only checks
+    the database the delete runs on and the shards have no foreign key to
+    products; refuse to delete a product ordered on any other shard.
+    """
+    for alias in shard_aliases():
+        if alias == using:
+            continue
+        items = list(OrderItem.objects.using(alias).filter(product_id=instance.pk)[:1])
+        if items:
+            raise ProtectedError(
+                f"Cannot delete {instance!r}: it is referenced through the protected "
+                f"foreign key 'OrderItem.product' on shard {alias!r}.",
+                set(items),
+            )
+
+
+class ShardRouter:
+    """
+    Keep everything but orders, items and payments on "default", and keep
+    sharded rows on the database of the instance they are reached through.
+
+    Sharded querysets without such an instance need an explicit ``.using()``;
+    the router leaves them on "default". Every model is migrated on every
+    shard so all databases share one schema.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get("instance")
+        if instance is not None and _is_sharded(type(instance)) and instance._state.db:
+            return instance._state.db
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # orders and items point at customers and products on "default"
+        if _is_sharded(type(obj1)) or _is_sharded(type(obj2)):
+            return True
+        return None
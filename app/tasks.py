@@ -1,31 +1,166 @@
-from django.db import transaction
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, transaction
+from django.db.models import Q
+from django.utils import timezone
 from celery import shared_task
-from .models import Order
+from .events import publish_order_event
+from .models import Customer, Order, Payment
+from .providers import MomoClient
+from .queues import DeadLetterTask
+from .services import INITIATED_STATUSES, order_stats_change, payment_transition, record_customer_stats
+from .sharding import candidate_shards, shard_aliases
+from . import tracing
 import logging
 
 
 logger = logging.getLogger(__name__)
 
-@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+# Database outages are retried with backoff; a call that still fails, or
+# whose order doesn't exist, ends up in the dead-letter queue.
+@shared_task(
+    bind=True,
+    base=DeadLetterTask,
+    max_retries=3,
+    autoretry_for=(OperationalError, InterfaceError),
+    retry_backoff=True,
+)
 def send_confirmation_message(self, order_id):
-    try:
-        with transaction.atomic():
-            order = Order.objects.select_for_update().get(id=order_id)
+    tracing.set_attribute("order.id", str(order_id))
+    for shard in candidate_shards(order_id):
+        with transaction.atomic(using=shard):
+            order = Order.objects.using(shard).select_for_update().filter(id=order_id).first()
+            if order is None:
+                continue
 
             if order.confirmation_sent:
                 logger.info(f"Message for order {order_id} already sent. Skipping.")
                 return
 
+            # customers live on "default", not on the order's shard
+            phone_number = Customer.objects.filter(pk=order.customer_id).values_list("phone_number", flat=True).first()
+
             # Simulate sending a message
-            logger.info(f"SEND_MSG to {order.customer.phone_number} for order {order_id}")
+            logger.info(f"SEND_MSG to {phone_number} for order {order_id}")
             provider_message_id = "mock_provider_id"
 
             # Mark as sent
             order.confirmation_sent = True
             order.save(update_fields=["confirmation_sent"])
+            publish_order_event(order.id, using=shard, status=order.status, confirmation_sent=True)
 
         logger.info(f"Message sent successfully. Provider ID: {provider_message_id}")
+        return
+
+    logger.error(f"Order with ID {order_id} not found.")
+    raise Order.DoesNotExist(f"Order {order_id} not found on any shard")
+
+
+@shared_task
+def sweep_stale_payments():
+    """
+    Resolve payments stuck in INITIATED because the webhook never arrived.
+
+    Each batch is claimed with SELECT ... FOR UPDATE SKIP LOCKED, so several
+    sweepers (or a slow previous run) never contend for the same rows. The
+    provider is polled concurrently for the whole batch, then the resulting
+    transitions are written with one bulk UPDATE per table before commit.
+    Every order shard is swept in turn, each within MAX_BATCHES.
+    """
+    config = settings.STALE_PAYMENT_SWEEP
+    cutoff = timezone.now() - timedelta(minutes=config["AGE_MINUTES"])
+    client = MomoClient()
+
+    started = time.perf_counter()
+    swept = resolved = backlog = 0
+    with ThreadPoolExecutor(max_workers=config["POOL_SIZE"]) as pool:
+        for shard in shard_aliases():
+            shard_swept, shard_resolved, shard_backlog = _sweep_shard(shard, cutoff, client, pool, config)
+            swept += shard_swept
+            resolved += shard_resolved
+            backlog += shard_backlog
+
+    elapsed = time.perf_counter() - started
+    report = {
+        "swept": swept,
+        "resolved": resolved,
+        "seconds": round(elapsed, 3),
+        "per_second": round(swept / elapsed, 1) if elapsed else 0.0,
+        "backlog": backlog,
+    }
+    logger.info(
+        f"Stale payment sweep: {swept} polled, {resolved} resolved in {report['seconds']}s "
+        f"({report['per_second']}/s), backlog {backlog}"
+    )
+    return report
+
+
+def _sweep_shard(shard, cutoff, client, pool, config):
+    stale = Payment.objects.using(shard).filter(status__in=INITIATED_STATUSES, created_at__lt=cutoff)
+    swept = resolved = 0
+    last = None
+    for _ in range(config["MAX_BATCHES"]):
+        batch_query = stale
+        if last:
+            # keyset over (created_at, id) so pending rows aren't re-claimed
+            batch_query = batch_query.filter(
+                Q(created_at__gt=last[0]) | Q(created_at=last[0], id__gt=last[1])
+            )
+        with transaction.atomic(using=shard):
+            batch = list(
+                batch_query.select_for_update(skip_locked=True)
+                .order_by("created_at", "id")[: config["BATCH_SIZE"]]
+            )
+            if not batch:
+                break
+            last = (batch[-1].created_at, batch[-1].id)
+            results = list(pool.map(client.get_transaction_status, batch))
+            paid_order_ids = _apply_provider_results(batch, results, shard)
+
+        for order_id in paid_order_ids:
+            send_confirmation_message.delay(order_id)
+        swept += len(batch)
+        resolved += sum(1 for result in results if result["status"] != "pending")
+    return swept, resolved, stale.count()
+
+
+def _apply_provider_results(payments, results, shard):
+    """
+    Apply provider results to locked payments in bulk, using the same
+    transitions as MomoWebhookView. Returns the ids of orders that became paid.
+    """
+    changed = []
+    order_updates = {}
+    events = []
+    for payment, result in zip(payments, results):
+        if result["status"] == "pending":
+            continue
+        payment_status, order_status = payment_transition(result["status"])
+        payment.status = payment_status
+        if order_status:
+            payment.provider_reference = result["provider_reference"]
+            order_updates.setdefault(order_status, []).append(payment.order_id)
+            events.append((payment.order_id, {"status": order_status, "payment_status": payment_status}))
+        else:
+            events.append((payment.order_id, {"payment_status": payment_status}))
+        changed.append(payment)
 
-    except Order.DoesNotExist:
-        logger.error(f"Order with ID {order_id} not found.")
-        raise
+    if changed:
+        Payment.objects.using(shard).bulk_update(changed, ["status", "provider_reference"])
+    stats_changes = {}
+    for order_status, order_ids in order_updates.items():
+        orders = Order.objects.using(shard).select_for_update().filter(id__in=order_ids).exclude(status=order_status)
+        for customer_id, previous_status, total_amount in orders.values_list("customer_id", "status", "total_amount"):
+            stats_changes.setdefault(customer_id, Counter()).update(
+                order_stats_change(previous_status, order_status, total_amount)
+            )
+        # update() skips auto_now, so set updated_at explicitly
+        Order.objects.using(shard).filter(id__in=order_ids).update(status=order_status, updated_at=timezone.now())
+    record_customer_stats(stats_changes, shard)
+    for order_id, fields in events:
+        publish_order_event(order_id, using=shard, **fields)
+    return order_updates.get("Paid", [])
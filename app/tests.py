@@ -1,3 +1,4 @@
+import io
 import uuid
 import pytest
 import hmac
@@ -8,11 +9,12 @@ from uuid import uuid4
 
 from django.urls import reverse
 from django.conf import settings
-from unittest.mock import patch
+from django.db import transaction
+from unittest.mock import MagicMock, patch
 
 # Assumes models and the view are in a file named `your_app_name/models.py`
 # and `your_app_name/views.py`.
-from app.models import Order, Payment, Customer, Product
+from app.models import Order, Payment, Customer, CustomerStats, Product
 
 # We'll use this view to test the endpoint
 from app.views import MomoWebhookView
@@ -86,7 +88,7 @@ def test_happy_path_success(client, setup_test_data, generate_webhook_payload):
     pending payment and its associated order to a "SUCCESS" state.
     """
     # Use a mock to verify that the confirmation message task is called
-    with patch("app.views.send_confirmation_message.delay") as mock_task:
+    with patch("app.webhooks.send_confirmation_message.delay") as mock_task:
         # Get the payload and signature from the fixture
         payload = generate_webhook_payload["payload_dict"]
         signature = generate_webhook_payload["signature"]
@@ -123,7 +125,7 @@ def test_webhook_replay_idempotency(client, setup_test_data, generate_webhook_pa
     payload twice. The second request should not cause any duplicate effects.
     """
     # Use a mock to verify that the task is NOT called on the second request
-    with patch("app.views.send_confirmation_message.delay") as mock_task:
+    with patch("app.webhooks.send_confirmation_message.delay") as mock_task:
         payload = generate_webhook_payload["payload_dict"]
         signature = generate_webhook_payload["signature"]
         webhook_url = reverse("momo-webhook")
@@ -161,3 +163,1177 @@ def test_webhook_replay_idempotency(client, setup_test_data, generate_webhook_pa
 
         # 4. Assert the task was NOT called again
         mock_task.assert_called_once() # The call count is still 1
+
+
+def test_payment_charge_rejected_when_bucket_empty(client, setup_test_data):
+    """
+    When a token bucket is exhausted the charge endpoint answers 429 with a
+    Retry-After header and never touches the payments table.
+    """
+    with patch("app.throttling.consume_tokens", return_value=(False, 1.2, "client")):
+        response = client.post(
+            reverse("payment-charge"),
+            data={"order": str(setup_test_data["order"].id)},
+            content_type="application/json",
+            HTTP_IDEMPOTENCY_KEY="charge:retry-storm",
+        )
+
+    assert response.status_code == 429
+    assert response["Retry-After"] == "2"
+    assert not Payment.objects.filter(idempotency_key="charge:retry-storm").exists()
+
+
+def test_webhook_shed_when_concurrency_limit_reached(client, generate_webhook_payload):
+    """
+    Webhooks over the concurrency limit are shed with a 503 and Retry-After.
+    """
+    with patch("app.throttling.acquire_slot", return_value=None):
+        response = client.post(
+            reverse("momo-webhook"),
+            data=generate_webhook_payload["payload_dict"],
+            content_type="application/json",
+            HTTP_X_MOMO_SIGNATURE=generate_webhook_payload["signature"],
+        )
+
+    assert response.status_code == 503
+    assert response["Retry-After"] == "1"
+    assert Payment.objects.get(order__id=generate_webhook_payload["payload_dict"]["order_id"]).status == "INITIATED"
+    # shed callbacks are still journaled, so they can be replayed
+    from app.journal import read_journal
+
+    (record,) = read_journal(settings.WEBHOOK_JOURNAL["DIR"])
+    assert json.loads(record[2]) == generate_webhook_payload["payload_dict"]
+
+
+def test_concurrency_slot_released_when_the_view_raises(client, generate_webhook_payload):
+    """An unhandled error (a 500) gives its slot back instead of holding it until SLOT_TTL."""
+    with patch("app.throttling.acquire_slot", return_value="slot-token"), \
+            patch("app.throttling.release_slot") as release_slot, \
+            patch("app.views.process_momo_webhook", side_effect=RuntimeError("boom")):
+        with pytest.raises(RuntimeError):
+            client.post(
+                reverse("momo-webhook"),
+                data=generate_webhook_payload["payload_dict"],
+                content_type="application/json",
+                HTTP_X_MOMO_SIGNATURE=generate_webhook_payload["signature"],
+            )
+
+    release_slot.assert_called_once_with("webhooks", "slot-token")
+
+
+def test_token_bucket_script_refills_and_charges_all_buckets_or_none(live_redis, settings):
+    import time
+    from app.throttling import admission_state, consume_tokens
+
+    settings.ADMISSION_CONTROL = {
+        **settings.ADMISSION_CONTROL,
+        "BUCKETS": {"client": {"rate": 10, "burst": 2}, "global": {"rate": 1, "burst": 5}},
+    }
+    buckets = [("client", "10.0.0.1"), ("global", "all")]
+
+    def global_tokens():
+        return float(live_redis.hget("admission:bucket:test:global:all", "t"))
+
+    with patch("app.throttling.get_redis", return_value=live_redis):
+        assert consume_tokens("test", buckets)[0]
+        assert consume_tokens("test", buckets)[0]
+        charged = global_tokens()
+        allowed, wait, limited_by = consume_tokens("test", buckets)
+        # the empty client bucket rejects the request and the global one isn't charged
+        assert not allowed and limited_by == "client" and 0 < wait <= 0.1
+        assert charged <= global_tokens() < charged + 0.5
+
+        time.sleep(0.15)  # 10 tokens a second refill the client bucket
+        assert consume_tokens("test", buckets)[0]
+        assert global_tokens() < charged
+        assert admission_state()["counters"] == {"test:admitted": 3, "test:rejected:client": 1}
+
+
+def test_slot_script_caps_concurrency_and_reclaims_expired_slots(live_redis, settings):
+    import time
+    from app.throttling import acquire_slot, release_slot
+
+    settings.ADMISSION_CONTROL = {**settings.ADMISSION_CONTROL, "CONCURRENCY": {"test": 2}, "SLOT_TTL": 1}
+
+    with patch("app.throttling.get_redis", return_value=live_redis):
+        first, second = acquire_slot("test"), acquire_slot("test")
+        assert first and second
+        assert acquire_slot("test") is None
+        release_slot("test", first)
+        assert acquire_slot("test")
+        assert acquire_slot("test") is None
+
+        time.sleep(1.1)  # slots of crashed workers expire after SLOT_TTL
+        assert acquire_slot("test")
+        assert live_redis.zcard("admission:slots:test") == 1
+        assert live_redis.hget("admission:stats", "test:shed") == b"2"
+
+
+def test_token_buckets_checked_per_scope(rf):
+    """
+    The payment throttle charges the client, Idempotency-Key prefix and global
+    buckets in one call.
+    """
+    from app.throttling import PaymentChargeThrottle
+    from django.contrib.auth.models import AnonymousUser
+
+    request = rf.post("/api/payments/charge/", HTTP_IDEMPOTENCY_KEY="charge:abc", REMOTE_ADDR="10.0.0.1")
+    request.user = AnonymousUser()
+
+    with patch("app.throttling.consume_tokens", return_value=(True, 0, None)) as mock_consume:
+        assert PaymentChargeThrottle().allow_request(request, view=None)
+
+    mock_consume.assert_called_once_with(
+        "payments",
+        [("client", "10.0.0.1"), ("idempotency_prefix", "charge"), ("global", "all")],
+    )
+
+
+def test_admission_stats_reports_redis_errors_as_unavailable():
+    """
+    A Redis that fails mid-snapshot is reported like one that is down, not
+    raised from the ``admission_stats`` command.
+    """
+    import redis
+    from django.core.management import CommandError, call_command
+    from app.throttling import admission_state
+
+    client = MagicMock()
+    client.hgetall.side_effect = redis.ConnectionError("Connection refused")
+    with patch("app.throttling.get_redis", return_value=client), \
+            patch("app.throttling.mark_redis_down") as mark_redis_down:
+        assert admission_state() is None
+        with pytest.raises(CommandError, match="Redis is unavailable"):
+            call_command("admission_stats")
+    assert mark_redis_down.call_count == 2
+
+
+@pytest.mark.parametrize("url_name", ["admin:app_order_changelist", "admin:app_orderitem_changelist", "admin:app_payment_changelist"])
+def test_admin_changelist_queries_do_not_grow_with_rows(admin_client, django_assert_max_num_queries, setup_test_data, url_name):
+    """
+    Changelists join their foreign keys up front instead of issuing a query
+    per row to render customer/product/order columns.
+    """
+    from app.models import OrderItem
+
+    customer = setup_test_data["customer"]
+    product = setup_test_data["product"]
+    for _ in range(20):
+        order = Order.objects.create(customer=customer, total_amount=Decimal("50.00"))
+        OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=product.price)
+        Payment.objects.create(order=order, amount=Decimal("50.00"), idempotency_key=str(uuid4()))
+
+    with django_assert_max_num_queries(12):
+        response = admin_client.get(reverse(url_name))
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db(databases=["default", "shard_1"])
+def test_admin_lists_and_edits_orders_on_other_shards(admin_client, setup_test_data):
+    from app.services import create_order
+
+    customer = Customer.objects.create(username="sharded-admin", order_shard="shard_1")
+    with transaction.atomic(using="shard_1"):
+        order = create_order(customer, [{"product": setup_test_data["product"], "quantity": 1}], using="shard_1")
+    payment = Payment.objects.using("shard_1").create(order=order, amount=order.total_amount, idempotency_key="admin")
+    changelist = reverse("admin:app_order_changelist")
+
+    assert str(order.id) not in admin_client.get(changelist).content.decode()
+    listed = admin_client.get(changelist, {"shard": "shard_1"}).content.decode()
+    assert str(order.id) in listed and "sharded-admin" in listed
+    assert str(order.id) in admin_client.get(changelist, {"q": str(order.id)}).content.decode()
+    assert admin_client.get(changelist, {"shard": "nope"}).status_code == 302
+    for url_name in ("admin:app_orderitem_changelist", "admin:app_payment_changelist"):
+        assert str(order.id) in admin_client.get(reverse(url_name), {"shard": "shard_1"}).content.decode()
+
+    assert admin_client.get(reverse("admin:app_order_change", args=[order.id])).status_code == 200
+    response = admin_client.post(
+        reverse("admin:app_payment_change", args=[payment.id]),
+        {"amount": "10.00", "idempotency_key": "admin", "provider_reference": "MO-ADMIN", "status": "SUCCESS",
+         "created_at_0": "2025-01-01", "created_at_1": "00:00:00"},
+    )
+    assert response.status_code == 302
+    assert Payment.objects.using("shard_1").get(id=payment.id).provider_reference == "MO-ADMIN"
+
+
+def test_estimated_count_paginator_uses_table_estimate(setup_test_data):
+    """
+    Above the threshold an unfiltered changelist reads reltuples instead of
+    running COUNT(*).
+    """
+    from app.admin import EstimatedCountPaginator
+
+    paginator = EstimatedCountPaginator(Order.objects.order_by("-created_at"), 50)
+    paginator.exact_count_threshold = 0
+    with patch.object(EstimatedCountPaginator, "_table_estimate", return_value=50_000_000):
+        assert paginator.count == 50_000_000
+
+
+def test_uuid7_keys_are_time_ordered():
+    """
+    uuid7 keys carry the version bits and sort in creation order, even when
+    many are generated within the same millisecond.
+    """
+    import time
+    from app.ids import uuid7, uuid7_timestamp
+
+    keys = [uuid7() for _ in range(5000)]
+
+    assert all(key.version == 7 for key in keys)
+    assert keys == sorted(keys)
+    assert len(set(keys)) == len(keys)
+    assert abs(uuid7_timestamp(keys[0]) - time.time()) < 5
+    assert uuid7_timestamp(uuid4()) is None
+
+
+def test_new_orders_get_uuid7_keys(setup_test_data):
+    assert setup_test_data["order"].id.version == 7
+    assert setup_test_data["payment"].id.version == 7
+
+
+@pytest.mark.django_db(databases=["default", "shard_1"])
+def test_sweeper_resolves_stale_payments_like_the_webhook(setup_test_data):
+    """
+    The sweeper polls the provider for payments stuck in INITIATED and applies
+    the same transitions as the webhook; fresh and still-pending payments are
+    left alone.
+    """
+    from datetime import timedelta
+    from django.utils import timezone
+    from app.tasks import sweep_stale_payments
+
+    customer = setup_test_data["customer"]
+    old = timezone.now() - timedelta(hours=1)
+    setup_test_data["payment"].delete()
+
+    def make_payment(created_at, status="INITIATED"):
+        order = Order.objects.create(customer=customer, total_amount=Decimal("10.00"))
+        return Payment.objects.create(
+            order=order, amount=Decimal("10.00"), idempotency_key=str(uuid4()), status=status, created_at=created_at
+        )
+
+    paid = make_payment(old, status="Initiated")
+    failed = make_payment(old)
+    pending = make_payment(old)
+    fresh = make_payment(timezone.now())
+
+    provider_answers = {
+        paid.id: {"status": "success", "provider_reference": "MO-SWEEP-1"},
+        failed.id: {"status": "failed", "provider_reference": "MO-SWEEP-2"},
+        pending.id: {"status": "pending", "provider_reference": ""},
+    }
+    with patch("app.tasks.MomoClient.get_transaction_status", side_effect=lambda p: provider_answers[p.id]), \
+            patch("app.tasks.send_confirmation_message.delay") as mock_task:
+        report = sweep_stale_payments()
+
+    assert report["swept"] == 3
+    assert report["resolved"] == 2
+    assert report["backlog"] == 1
+
+    paid.refresh_from_db()
+    failed.refresh_from_db()
+    assert (paid.status, paid.provider_reference, paid.order.status) == ("Success", "MO-SWEEP-1", "Paid")
+    assert (failed.status, failed.order.status) == ("failed", "PENDING")
+    assert Payment.objects.get(id=pending.id).status == "INITIATED"
+    assert Payment.objects.get(id=fresh.id).status == "INITIATED"
+    mock_task.assert_called_once_with(paid.order_id)
+    # these orders were created without counters, so only the transition shows
+    stats = CustomerStats.objects.get(customer=customer)
+    assert (stats.pending_orders, stats.paid_orders, stats.total_spent) == (-1, 1, Decimal("10.00"))
+
+
+def test_group_commit_mode_queues_order_and_returns_202(client, settings, setup_test_data):
+    """
+    In group-commit mode the order is validated and queued, not written, and
+    the client gets a status URL to poll.
+    """
+    from app.ids import uuid7
+
+    settings.ORDER_INGESTION = {**settings.ORDER_INGESTION, "MODE": "group_commit"}
+    order_id = uuid7()
+    payload = {
+        "customer": setup_test_data["customer"].id,
+        "items": [{"product": str(setup_test_data["product"].id), "quantity": 2}],
+    }
+    with patch("app.views.enqueue_order", return_value=order_id) as mock_enqueue:
+        response = client.post(reverse("order-create"), data=payload, content_type="application/json")
+
+    assert response.status_code == 202
+    assert response.json()["id"] == str(order_id)
+    assert response["Location"].endswith(reverse("order-retrive", kwargs={"pk": order_id}))
+    assert mock_enqueue.call_args.args[0]["items"][0]["quantity"] == 2
+    assert not Order.objects.filter(id=order_id).exists()
+
+
+def test_commit_batch_isolates_failing_orders(setup_test_data):
+    """
+    A group-commit batch writes every good order and reports the bad ones
+    individually instead of failing the whole batch.
+    """
+    from app.ingest import commit_batch
+    from app.sharding import new_order_id
+
+    customer = setup_test_data["customer"]
+    product = setup_test_data["product"]
+    good, missing_product, missing_customer = (str(new_order_id("default")) for _ in range(3))
+    payloads = [
+        {"id": good, "customer": customer.id, "items": [{"product": str(product.id), "quantity": 3}], "queued_at": 0},
+        {"id": missing_product, "customer": customer.id, "items": [{"product": str(uuid4()), "quantity": 1}], "queued_at": 0},
+        {"id": missing_customer, "customer": 999999, "items": [{"product": str(product.id), "quantity": 1}], "queued_at": 0},
+    ]
+
+    failures = commit_batch(payloads)
+    assert set(failures) == {missing_product, missing_customer}
+    assert Order.objects.get(id=good).total_amount == Decimal("150.00")
+    assert Order.objects.get(id=good).items.count() == 1
+
+    # replaying the same batch after a crash does not duplicate the good order
+    assert set(commit_batch(payloads)) == {missing_product, missing_customer}
+    assert Order.objects.filter(id=good).count() == 1
+
+
+def test_order_retrieve_reports_queued_and_failed_ingestion(client, db):
+    pk = str(uuid4())
+    url = reverse("order-retrive", kwargs={"pk": pk})
+
+    with patch("app.views.ingestion_status", return_value={"status": "QUEUED"}):
+        assert client.get(url).status_code == 202
+    with patch("app.views.ingestion_status", return_value={"status": "FAILED", "errors": {"items": ["x"]}}):
+        response = client.get(url)
+    assert response.status_code == 422
+    assert response.json()["errors"] == {"items": ["x"]}
+    with patch("app.views.ingestion_status", return_value=None):
+        assert client.get(url).status_code == 404
+
+
+def test_order_retrieve_finds_an_order_committed_during_the_status_check(client, setup_test_data):
+    customer = setup_test_data["customer"]
+    order_id = uuid4()
+
+    def commit_then_drop_status(pk):
+        # the ingester commits the order and deletes its status key in between
+        Order.objects.create(id=order_id, customer=customer, total_amount=Decimal("5.00"))
+        return None
+
+    with patch("app.views.ingestion_status", side_effect=commit_then_drop_status):
+        response = client.get(reverse("order-retrive", kwargs={"pk": order_id}))
+    assert response.status_code == 200 and response.json()["id"] == str(order_id)
+
+
+def test_order_retrieve_conditional_get(client, django_assert_num_queries, setup_test_data):
+    """
+    Polls that present a current ETag or Last-Modified get a 304 from a
+    single-column query; a changed order invalidates both validators.
+    """
+    from datetime import timedelta
+    from django.utils import timezone
+
+    order = setup_test_data["order"]
+    url = reverse("order-retrive", kwargs={"pk": order.id})
+    # Last-Modified is only sent for orders not changed in the current second
+    Order.objects.filter(pk=order.pk).update(updated_at=timezone.now() - timedelta(seconds=5))
+
+    first = client.get(url)
+    assert first.status_code == 200
+    etag, last_modified = first["ETag"], first["Last-Modified"]
+
+    with django_assert_num_queries(1):
+        cached = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert cached.status_code == 304
+    assert cached["ETag"] == etag
+    assert cached.content == b""
+
+    assert client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 304
+
+    order.status = "PAID"
+    order.save()
+    changed = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert changed.status_code == 200
+    assert changed["ETag"] != etag
+    assert changed.json()["status"] == "PAID"
+
+
+@pytest.fixture
+def live_redis(settings):
+    """
+    A real Redis server for the tests that run Lua scripts or pub/sub, from
+    TEST_REDIS_URL (skipped when it is unset or unreachable), also set as
+    REDIS_URL. Its database is flushed before and after each test, so point
+    it at a scratch database.
+    """
+    import os
+    import redis
+
+    url = os.getenv("TEST_REDIS_URL")
+    if not url:
+        pytest.skip("TEST_REDIS_URL is not set")
+    client = redis.Redis.from_url(url)
+    try:
+        client.flushdb()
+    except redis.RedisError as exc:
+        pytest.skip(f"Redis at TEST_REDIS_URL is unavailable: {exc}")
+    settings.REDIS_URL = url
+    yield client
+    client.flushdb()
+    client.close()
+
+
+def test_order_retrieve_conditional_get_with_two_updates_in_one_second(client, setup_test_data):
+    """
+    A second change within the second of the first can't leave a client with
+    a stale order: the ETag decides when If-None-Match is sent, and no
+    Last-Modified is handed out while the order's last change is that recent.
+    """
+    from datetime import datetime, timedelta, timezone
+    from django.utils.http import http_date
+
+    order = setup_test_data["order"]
+    url = reverse("order-retrive", kwargs={"pk": order.id})
+    second = datetime(2030, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+
+    def get_at(offset, **headers):
+        with patch("app.views.timezone.now", return_value=second + timedelta(seconds=offset)):
+            return client.get(url, **headers)
+
+    Order.objects.filter(pk=order.pk).update(updated_at=second + timedelta(seconds=0.2))
+    first = get_at(0.3)
+    assert first.status_code == 200 and "Last-Modified" not in first
+    last_modified = http_date(second.timestamp())
+
+    Order.objects.filter(pk=order.pk).update(status="PAID", updated_at=second + timedelta(seconds=0.7))
+    # the ETag wins over an If-Modified-Since that can't tell the updates apart
+    changed = get_at(0.8, HTTP_IF_NONE_MATCH=first["ETag"], HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert changed.status_code == 200 and changed.json()["status"] == "PAID"
+
+    # once that second is over, Last-Modified is safe to hand out and use
+    later = get_at(1.5)
+    assert later["Last-Modified"] == last_modified
+    assert get_at(1.6, HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 304
+    Order.objects.filter(pk=order.pk).update(status="CANCELLED", updated_at=second + timedelta(seconds=1.7))
+    assert get_at(1.8, HTTP_IF_MODIFIED_SINCE=last_modified).json()["status"] == "CANCELLED"
+
+
+def without_event_reader():
+    """Stand in for the Redis subscriber: tests feed events with broker.dispatch."""
+    import asyncio
+    from app.events import broker
+
+    def subscribed():
+        broker.subscribed = asyncio.Event()
+        broker.subscribed.set()
+        return broker.subscribed
+
+    return patch.object(broker, "_ensure_reader", side_effect=subscribed)
+
+
+def test_order_events_stream_pushes_status_changes(setup_test_data):
+    """
+    The SSE endpoint sends the current status, then every event the shared
+    subscriber dispatches for that order, and releases its queue on close.
+    """
+    import time
+    from asgiref.sync import async_to_sync
+    from django.test import AsyncClient
+    from app.events import broker
+
+    order = setup_test_data["order"]
+
+    async def consume():
+        response = await AsyncClient().get(reverse("order-events", kwargs={"pk": order.id}))
+        chunks = response.streaming_content
+        first = await anext(chunks)
+        broker.dispatch(json.dumps({"order_id": str(order.id), "status": "Paid", "published_at": time.time()}))
+        second = await anext(chunks)
+        connections = broker.stats()["connections"]
+        await chunks.aclose()
+        return response, first, second, connections
+
+    with without_event_reader():
+        response, first, second, connections = async_to_sync(consume)()
+
+    assert response["Content-Type"] == "text/event-stream"
+    assert b'"status": "PENDING"' in first
+    assert b'"status": "Paid"' in second
+    assert connections == 1
+    assert broker.stats()["connections"] == 0
+
+
+def test_order_events_canonicalizes_the_id_and_releases_the_queue_on_errors(setup_test_data):
+    from asgiref.sync import async_to_sync
+    from django.test import AsyncClient
+    from app.events import broker
+
+    order = setup_test_data["order"]
+    braced = "{" + str(order.id).upper() + "}"
+
+    async def open_stream(pk):
+        response = await AsyncClient().get(reverse("order-events", kwargs={"pk": pk}))
+        listening = set(broker.listeners)
+        if response.streaming:
+            await anext(response.streaming_content)
+            await response.streaming_content.aclose()
+        return response, listening
+
+    with without_event_reader():
+        response, listening = async_to_sync(open_stream)(braced)
+        assert response.status_code == 200 and listening == {str(order.id)}
+        assert async_to_sync(open_stream)("not-a-uuid")[0].status_code == 404
+        with patch("app.views.find_on_shards", side_effect=RuntimeError("database down")):
+            with pytest.raises(RuntimeError):
+                async_to_sync(open_stream)(str(order.id))
+    assert broker.stats()["connections"] == 0 and not broker.listeners
+
+
+def test_order_events_subscribe_before_reading_the_state_on_a_cold_start(live_redis, setup_test_data):
+    """
+    The first stream in a process starts the Redis subscriber; a change
+    published while the stream reads the order's current state still reaches it.
+    """
+    import asyncio
+    import time
+    from asgiref.sync import async_to_sync
+    from django.test import AsyncClient
+    from app import views
+    from app.events import CHANNEL_PREFIX, broker
+
+    order = setup_test_data["order"]
+    find_on_shards = views.find_on_shards
+
+    def find_and_change(*args):
+        # the webhook commits a change while the view reads the current state
+        event = {"order_id": str(order.id), "status": "PAID", "published_at": time.time()}
+        live_redis.publish(f"{CHANNEL_PREFIX}{order.id}", json.dumps(event))
+        return find_on_shards(*args)
+
+    async def consume():
+        response = await AsyncClient().get(reverse("order-events", kwargs={"pk": order.id}))
+        chunks = response.streaming_content
+        first = await anext(chunks)
+        second = await asyncio.wait_for(anext(chunks), timeout=5)
+        await chunks.aclose()
+        return first, second
+
+    # each async_to_sync call runs a new event loop, which starts a new reader
+    with patch("app.views.find_on_shards", side_effect=find_and_change):
+        first, second = async_to_sync(consume)()
+
+    assert b'"status": "PENDING"' in first
+    assert b'"status": "PAID"' in second
+    assert broker.stats()["connections"] == 0
+
+
+def test_webhook_publishes_order_event_after_commit(client, django_capture_on_commit_callbacks, generate_webhook_payload):
+    with patch("app.webhooks.send_confirmation_message.delay"), \
+            patch("app.events.get_redis") as mock_redis, \
+            django_capture_on_commit_callbacks(execute=True):
+        response = client.post(
+            reverse("momo-webhook"),
+            data=generate_webhook_payload["payload_dict"],
+            content_type="application/json",
+            HTTP_X_MOMO_SIGNATURE=generate_webhook_payload["signature"],
+        )
+
+    assert response.status_code == 200
+    channel, message = mock_redis.return_value.publish.call_args.args
+    assert channel == f"orders:events:{generate_webhook_payload['payload_dict']['order_id']}"
+    assert json.loads(message)["status"] == "Paid"
+
+
+@pytest.fixture(autouse=True)
+def webhook_journal_dir(settings, tmp_path):
+    """Keep journaled webhooks out of the working tree during tests."""
+    from app.journal import journal
+
+    settings.WEBHOOK_JOURNAL = {**settings.WEBHOOK_JOURNAL, "DIR": str(tmp_path / "webhook-journal")}
+    yield tmp_path / "webhook-journal"
+    journal.close()
+
+
+def test_webhook_body_is_journaled_and_readable_by_time_range(client, webhook_journal_dir, generate_webhook_payload):
+    """
+    Every webhook is appended to the journal with its signature header, and a
+    time-range read seeks past older records using the offset index.
+    """
+    import time
+    from app.journal import read_journal
+
+    url = reverse("momo-webhook")
+    with patch("app.webhooks.send_confirmation_message.delay"):
+        client.post(url, data={"order_id": "first"}, content_type="application/json", HTTP_X_MOMO_SIGNATURE="bad")
+        time.sleep(0.01)
+        cutoff_ms = time.time_ns() // 1_000_000
+        client.post(
+            url,
+            data=generate_webhook_payload["payload_dict"],
+            content_type="application/json",
+            HTTP_X_MOMO_SIGNATURE=generate_webhook_payload["signature"],
+        )
+
+    records = list(read_journal(webhook_journal_dir))
+    assert len(records) == 2
+    assert records[0][1]["HTTP_X_MOMO_SIGNATURE"] == "bad"
+
+    recent = list(read_journal(webhook_journal_dir, since_ms=cutoff_ms))
+    assert len(recent) == 1
+    assert json.loads(recent[0][2]) == generate_webhook_payload["payload_dict"]
+    assert recent[0][1]["HTTP_X_MOMO_SIGNATURE"] == generate_webhook_payload["signature"]
+
+
+# available_apps makes the flush TRUNCATE ... CASCADE, which also empties the
+# table of the removed MessageLog model that still references customers
+@pytest.mark.django_db(
+    transaction=True,
+    databases=["default", "shard_1"],
+    available_apps=["app", "django.contrib.auth", "django.contrib.contenttypes", "django.contrib.admin"],
+)
+def test_replay_webhooks_dry_run_reports_diff_without_writing(webhook_journal_dir, generate_webhook_payload):
+    """
+    A dry-run replay applies journaled callbacks through the webhook logic,
+    reports what would change and rolls it all back; a real replay applies it.
+    """
+    from io import StringIO
+    from django.core.management import call_command
+    from app.journal import journal
+
+    body = json.dumps(generate_webhook_payload["payload_dict"]).encode()
+    journal.append(body, {"HTTP_X_MOMO_SIGNATURE": generate_webhook_payload["signature"]})
+    journal.append(b"not json", {})
+    payment_id = Payment.objects.get().id
+
+    # replay workers are forked, so they inherit the patched task
+    with patch("app.webhooks.send_confirmation_message.delay"):
+        out = StringIO()
+        call_command("replay_webhooks", "--dry-run", "--workers", "2", stdout=out)
+        output = out.getvalue()
+        assert "dry run: 2 webhooks" in output
+        assert "HTTP 200: 1" in output and "HTTP 400: 1" in output
+        assert "1 orders would change" in output
+        assert '"payment": "Success"' in output
+        assert Payment.objects.get(id=payment_id).status == "INITIATED"
+
+        call_command("replay_webhooks", "--workers", "2", stdout=StringIO())
+        payment = Payment.objects.get(id=payment_id)
+        assert payment.status == "Success"
+        assert payment.order.status == "Paid"
+
+
+def test_hash_ring_only_remaps_customers_onto_a_new_shard():
+    """
+    Adding a shard to the ring moves roughly 1/N of customers, and only onto
+    the new shard; order ids carry the shard they were created for.
+    """
+    from app.ids import uuid7, uuid7_shard
+    from app.sharding import HashRing
+
+    before = HashRing(["default", "shard_1"], 128)
+    after = HashRing(["default", "shard_1", "shard_2"], 128)
+    moved = [key for key in range(10000) if before.node_for(key) != after.node_for(key)]
+
+    assert 0.2 < len(moved) / 10000 < 0.45
+    assert {after.node_for(key) for key in moved} == {"shard_2"}
+    assert uuid7_shard(uuid7(shard=1)) == 1
+    assert uuid7(shard=1).version == 7
+
+
+@pytest.mark.django_db(databases=["default", "shard_1"])
+def test_orders_and_payments_are_routed_to_the_customers_shard(client, settings, generate_webhook_payload):
+    """
+    A new customer is pinned to their ring shard on their first order, and
+    order create, retrieve, charge and webhook all work against that shard.
+    """
+    settings.ORDER_SHARDS = {**settings.ORDER_SHARDS, "RING": ["shard_1"]}
+    customer = Customer.objects.create(username="sharded")
+    product = Product.objects.create(name="Sharded Product", price=Decimal("20.00"))
+
+    response = client.post(
+        reverse("order-create"),
+        data={"customer": customer.id, "items": [{"product": str(product.id), "quantity": 2}]},
+        content_type="application/json",
+    )
+    assert response.status_code == 201
+    order_id = response.json()["id"]
+    customer.refresh_from_db()
+    assert customer.order_shard == "shard_1"
+    assert Order.objects.using("shard_1").get(id=order_id).items.get().product_id == product.id
+    assert not Order.objects.filter(id=order_id).exists()
+    assert client.get(reverse("order-retrive", kwargs={"pk": order_id})).json()["total_amount"] == "40.00"
+
+    response = client.post(
+        reverse("payment-charge"),
+        data={"order": order_id},
+        content_type="application/json",
+        HTTP_IDEMPOTENCY_KEY="sharded-charge",
+    )
+    assert response.status_code == 201
+    assert Payment.objects.using("shard_1").get(order_id=order_id).amount == Decimal("40.00")
+
+    payload = {"order_id": order_id, "provider_reference": "MO-SHARD-1", "status": "success"}
+    canonical = json.dumps(payload, separators=(',', ':'), sort_keys=True)
+    signature = hmac.new(settings.MOMO_WEBHOOK_SECRET.encode(), canonical.encode(), hashlib.sha256).hexdigest()
+    with patch("app.webhooks.send_confirmation_message.delay"):
+        response = client.post(
+            reverse("momo-webhook"), data=payload, content_type="application/json", HTTP_X_MOMO_SIGNATURE=signature
+        )
+    assert response.status_code == 200
+    assert Order.objects.using("shard_1").get(id=order_id).status == "Paid"
+
+
+@pytest.mark.django_db(databases=["default", "shard_1"])
+def test_idempotency_key_reused_on_another_shard_returns_the_first_payment(client, setup_test_data):
+    from app.models import PaymentIdempotencyKey
+    from app.services import create_order
+
+    other = Customer.objects.create(username="elsewhere", order_shard="shard_1")
+    with transaction.atomic(using="shard_1"):
+        other_order = create_order(other, [{"product": setup_test_data["product"], "quantity": 1}], using="shard_1")
+    url = reverse("payment-charge")
+    first = client.post(
+        url, data={"order": str(setup_test_data["order"].id)}, content_type="application/json",
+        HTTP_IDEMPOTENCY_KEY="charge:shared",
+    )
+    assert first.status_code == 201
+
+    replay = client.post(
+        url, data={"order": str(other_order.id)}, content_type="application/json", HTTP_IDEMPOTENCY_KEY="charge:shared"
+    )
+    assert replay.status_code == 200 and replay.json()["id"] == first.json()["id"]
+    assert not Payment.objects.using("shard_1").filter(order_id=other_order.id).exists()
+    assert PaymentIdempotencyKey.objects.get(idempotency_key="charge:shared").order_id == setup_test_data["order"].id
+
+
+@pytest.mark.django_db(databases=["default", "shard_1"])
+def test_deleting_a_customer_deletes_their_orders_on_every_shard(setup_test_data):
+    from app.models import OrderItem, OrderLocation
+    from app.sharding import move_customer
+
+    customer = setup_test_data["customer"]
+    OrderItem.objects.create(
+        order=setup_test_data["order"], product=setup_test_data["product"], quantity=1, unit_price=Decimal("50.00")
+    )
+    move_customer(customer, "shard_1")
+    assert OrderLocation.objects.exists()
+
+    customer.delete()
+    for model in (Order, OrderItem, Payment):
+        assert not model.objects.using("shard_1").exists()
+        assert not model.objects.exists()
+    assert not OrderLocation.objects.exists()
+
+
+@pytest.mark.django_db(databases=["default", "shard_1"])
+def test_products_ordered_only_on_another_shard_are_protected():
+    from django.db.models import ProtectedError
+    from app.models import OrderItem
+    from app.services import create_order
+
+    customer = Customer.objects.create(username="protected-product", order_shard="shard_1")
+    product = Product.objects.create(name="Ordered Elsewhere", price=Decimal("5.00"))
+    with transaction.atomic(using="shard_1"):
+        create_order(customer, [{"product": product, "quantity": 1}], using="shard_1")
+    assert OrderItem.objects.using("shard_1").filter(product=product).exists()
+
+    # the delete runs in a transaction without a savepoint; give it its own
+    with pytest.raises(ProtectedError), transaction.atomic():
+        product.delete()
+    with pytest.raises(ProtectedError), transaction.atomic():
+        Product.objects.filter(pk=product.pk).delete()
+    assert Product.objects.filter(pk=product.pk).exists()
+
+    unordered = Product.objects.create(name="Never Ordered", price=Decimal("5.00"))
+    unordered.delete()
+    assert not Product.objects.filter(pk=unordered.pk).exists()
+
+
+@pytest.mark.django_db(databases=["default", "shard_1"])
+def test_rebalance_moves_orders_and_keeps_them_reachable_by_id(client, setup_test_data, generate_webhook_payload):
+    """
+    rebalance_shards copies a customer's orders, items and payments to the
+    target shard and deletes them from the source; lookups by order id alone
+    still find them through OrderLocation.
+    """
+    from io import StringIO
+    from django.core.management import call_command
+    from app.models import OrderItem, OrderLocation
+    from app.tasks import send_confirmation_message
+
+    customer, order = setup_test_data["customer"], setup_test_data["order"]
+    OrderItem.objects.create(order=order, product=setup_test_data["product"], quantity=2, unit_price=Decimal("50.00"))
+
+    out = StringIO()
+    call_command("rebalance_shards", "--customer", str(customer.id), "--to", "shard_1", stdout=out)
+    assert "moved 1 customers (1 orders)" in out.getvalue()
+
+    customer.refresh_from_db()
+    assert customer.order_shard == "shard_1"
+    assert not Order.objects.filter(id=order.id).exists()
+    assert not Payment.objects.filter(order_id=order.id).exists()
+    assert OrderItem.objects.using("shard_1").filter(order_id=order.id).count() == 1
+    assert OrderLocation.objects.get(order_id=order.id).shard == "shard_1"
+
+    assert client.get(reverse("order-retrive", kwargs={"pk": order.id})).status_code == 200
+    with patch("app.webhooks.send_confirmation_message.delay"):
+        response = client.post(
+            reverse("momo-webhook"),
+            data=generate_webhook_payload["payload_dict"],
+            content_type="application/json",
+            HTTP_X_MOMO_SIGNATURE=generate_webhook_payload["signature"],
+        )
+    assert response.status_code == 200
+    send_confirmation_message.apply(args=[order.id])
+    moved = Order.objects.using("shard_1").get(id=order.id)
+    assert moved.status == "Paid" and moved.confirmation_sent
+
+
+@pytest.fixture
+def catalog(db):
+    products = [
+        Product(name="Red Running Shoes", description="Lightweight trainers", price=Decimal("45.00")),
+        Product(name="Blue Running Shoes", description="Cushioned trainers", price=Decimal("60.00")),
+        Product(name="Leather Wallet", description="Slim, fits running shorts", price=Decimal("25.00")),
+        Product(name="Shoelaces", description="Spare laces", price=Decimal("3.00")),
+        Product(name="Water Bottle", description="Insulated steel", price=Decimal("25.00")),
+    ]
+    return Product.objects.bulk_create(products)
+
+
+def test_product_search_matches_full_text_substrings_and_price_range(client, catalog):
+    url = reverse("product-search")
+
+    def names(**params):
+        response = client.get(url, params)
+        assert response.status_code == 200
+        return [product["name"] for product in response.json()["results"]]
+
+    # full text over name and description, with stemming
+    assert names(q="running") == ["Blue Running Shoes", "Leather Wallet", "Red Running Shoes"]
+    # substring of the name
+    assert names(q="shoe") == ["Blue Running Shoes", "Red Running Shoes", "Shoelaces"]
+    assert names(q="shoe", max_price="50") == ["Red Running Shoes", "Shoelaces"]
+    by_price = names(min_price="25", max_price="45", ordering="-price")
+    # the two 25.00 products tie and are then ordered by id
+    assert by_price[0] == "Red Running Shoes" and sorted(by_price[1:]) == ["Leather Wallet", "Water Bottle"]
+    assert client.get(url, {"min_price": "cheap"}).status_code == 400
+    assert client.get(url, {"cursor": "garbage"}).status_code == 400
+
+
+def test_product_search_keyset_pages_through_ties(client, catalog):
+    """Pages ordered by price follow (price, id), so equal prices are neither skipped nor repeated."""
+    url = reverse("product-search")
+    seen = []
+    response = client.get(url, {"ordering": "price", "page_size": 2})
+    while True:
+        body = response.json()
+        seen.extend(product["name"] for product in body["results"])
+        if body["next"] is None:
+            break
+        response = client.get(body["next"])
+
+    assert len(seen) == len(catalog) == len(set(seen))
+    assert seen[0] == "Shoelaces" and seen[-1] == "Blue Running Shoes"
+
+
+def test_product_search_caches_pages_until_a_product_changes(client, catalog, django_assert_num_queries):
+    class FakeRedis:
+        def __init__(self):
+            self.data = {}
+
+        def get(self, key):
+            return self.data.get(key)
+
+        def set(self, key, value, ex=None):
+            self.data[key] = value
+
+        def incr(self, key):
+            self.data[key] = int(self.data.get(key, 0)) + 1
+
+    from app.search import bump_search_version
+
+    fake = FakeRedis()
+    url = reverse("product-search")
+    with patch("app.search.get_redis", return_value=fake):
+        assert client.get(url, {"q": "wallet"})["X-Cache"] == "MISS"
+        with django_assert_num_queries(0):
+            cached = client.get(url, {"q": "wallet"})
+        assert cached["X-Cache"] == "HIT"
+        assert cached.json()["results"][0]["name"] == "Leather Wallet"
+
+        bump_search_version()
+        assert client.get(url, {"q": "wallet"})["X-Cache"] == "MISS"
+
+
+@pytest.fixture
+def exported_spans(settings, tmp_path):
+    """Sample every trace into a temporary file; call the result to read the spans."""
+    from app.tracing import exporter
+
+    settings.TRACING = {**settings.TRACING, "SAMPLE_RATE": 1.0, "EXPORT_PATH": str(tmp_path / "spans.jsonl")}
+
+    def read():
+        exporter.flush()
+        path = tmp_path / "spans.jsonl"
+        return [json.loads(line) for line in path.read_text().splitlines()] if path.exists() else []
+
+    return read
+
+
+def test_trace_follows_webhook_into_confirmation_task(client, exported_spans, generate_webhook_payload):
+    from celery.signals import before_task_publish
+    from app.tasks import send_confirmation_message
+
+    trace_id, caller_span_id = uuid4().hex, uuid4().hex[:16]
+    published = {}
+    # stands in for apply_async, which sends before_task_publish with the message headers
+    with patch("app.webhooks.send_confirmation_message.delay", lambda order_id: before_task_publish.send(
+        sender=send_confirmation_message.name, body=None, headers=published
+    )):
+        response = client.post(
+            reverse("momo-webhook"),
+            data=generate_webhook_payload["payload_dict"],
+            content_type="application/json",
+            HTTP_X_MOMO_SIGNATURE=generate_webhook_payload["signature"],
+            HTTP_TRACEPARENT=f"00-{trace_id}-{caller_span_id}-01",
+        )
+    assert response.status_code == 200 and response["X-Trace-Id"] == trace_id
+    send_confirmation_message.apply(args=[generate_webhook_payload["payload_dict"]["order_id"]], headers=published)
+
+    spans = exported_spans()
+    assert {span["traceId"] for span in spans} == {trace_id}
+    by_name = {span["name"]: span for span in spans}
+    webhook = by_name["POST /api/webhooks/momo/"]
+    task = by_name["celery.task app.tasks.send_confirmation_message"]
+    assert webhook["parentSpanId"] == caller_span_id and webhook["attributes"]["http.status_code"] == 200
+    assert task["parentSpanId"] == webhook["spanId"] and task["attributes"]["celery.state"] == "SUCCESS"
+    order_id = generate_webhook_payload["payload_dict"]["order_id"]
+    assert webhook["attributes"]["order.id"] == task["attributes"]["order.id"] == order_id
+    queries = [span for span in spans if span["name"] == "db.query"]
+    assert {span["parentSpanId"] for span in queries} == {webhook["spanId"], task["spanId"]}
+    assert any(span["attributes"]["db.statement"].startswith('UPDATE "app_order"') for span in queries)
+
+
+def test_unsampled_traces_record_nothing_but_still_propagate(client, settings, exported_spans, setup_test_data):
+    from app.tasks import send_confirmation_message
+
+    settings.TRACING = {**settings.TRACING, "SAMPLE_RATE": 0.0}
+    response = client.get(reverse("order-retrive", kwargs={"pk": setup_test_data["order"].id}))
+    assert response.status_code == 200 and len(response["X-Trace-Id"]) == 32
+
+    # the caller's "not sampled" decision wins over our sample rate
+    settings.TRACING = {**settings.TRACING, "SAMPLE_RATE": 1.0}
+    send_confirmation_message.apply(
+        args=[setup_test_data["order"].id], headers={"traceparent": f"00-{uuid4().hex}-{uuid4().hex[:16]}-00"}
+    )
+    assert exported_spans() == []
+
+
+def signed_payload(order_id, provider_reference, status="success"):
+    payload = {"order_id": str(order_id), "provider_reference": provider_reference, "status": status}
+    canonical = json.dumps(payload, separators=(',', ':'), sort_keys=True)
+    return payload, hmac.new(settings.MOMO_WEBHOOK_SECRET.encode(), canonical.encode(), hashlib.sha256).hexdigest()
+
+
+@pytest.mark.django_db(databases=["default", "shard_1"])
+@pytest.mark.parametrize("shard", ["default", "shard_1"])
+def test_customer_summary_counts_orders_through_their_transitions(
+    client, settings, django_assert_num_queries, django_capture_on_commit_callbacks, shard
+):
+    settings.ORDER_SHARDS = {**settings.ORDER_SHARDS, "RING": [shard]}
+    customer = Customer.objects.create(username=f"stats-{shard}")
+    product = Product.objects.create(name="Stats Product", price=Decimal("15.00"))
+    summary_url = reverse("customer-summary", kwargs={"pk": customer.id})
+    client.force_login(customer)
+    assert client.get(summary_url).json()["orders_count"] == 0
+
+    order_ids = []
+    # counters for orders on other shards are written once the order commits
+    with django_capture_on_commit_callbacks(using=shard, execute=True):
+        for quantity in (1, 2):
+            response = client.post(
+                reverse("order-create"),
+                data={"customer": customer.id, "items": [{"product": str(product.id), "quantity": quantity}]},
+                content_type="application/json",
+            )
+            order_ids.append(response.json()["id"])
+        for order_id in order_ids:
+            Payment.objects.using(shard).create(order_id=order_id, amount=Decimal("0"), idempotency_key=f"k-{order_id}")
+        payload, signature = signed_payload(order_ids[1], "MO-STATS-1")
+        with patch("app.webhooks.send_confirmation_message.delay"):
+            for _ in range(2):  # a replayed callback changes nothing
+                client.post(reverse("momo-webhook"), data=payload, content_type="application/json",
+                            HTTP_X_MOMO_SIGNATURE=signature)
+
+    # the session and its user, then the stats row
+    with django_assert_num_queries(3):
+        summary = client.get(summary_url).json()
+    assert summary["orders_count"] == 2
+    assert summary["orders_by_status"] == {"PENDING": 1, "PAID": 1, "CANCELLED": 0}
+    assert summary["total_spent"] == "30.00"
+
+
+@pytest.mark.django_db
+def test_customer_summary_is_only_readable_by_the_customer_and_staff(client):
+    customer = Customer.objects.create(username="summary-owner")
+    other = Customer.objects.create(username="summary-other")
+    staff = Customer.objects.create(username="summary-staff", is_staff=True)
+    summary_url = reverse("customer-summary", kwargs={"pk": customer.id})
+
+    assert client.get(summary_url).status_code == 403
+    client.force_login(other)
+    assert client.get(summary_url).status_code == 403
+    assert client.get(reverse("customer-summary", kwargs={"pk": 999_999})).status_code == 403
+    client.force_login(customer)
+    assert client.get(summary_url).status_code == 200
+    client.force_login(staff)
+    assert client.get(summary_url).json()["customer"] == customer.id
+    assert client.get(reverse("customer-summary", kwargs={"pk": 999_999})).status_code == 404
+
+
+@pytest.mark.django_db(databases=["default", "shard_1"])
+def test_repair_customer_stats_rebuilds_counters_from_every_shard(setup_test_data):
+    from django.core.management import call_command
+
+    customer = setup_test_data["customer"]
+    # written without going through the services, so no counters yet
+    Order.objects.using("shard_1").create(customer=customer, total_amount=Decimal("12.50"), status="Paid")
+    out = io.StringIO()
+    call_command("repair_customer_stats", dry_run=True, stdout=out)
+    assert "would fix 1" in out.getvalue() and not CustomerStats.objects.exists()
+
+    call_command("repair_customer_stats", chunk_size=1, stdout=io.StringIO())
+    stats = CustomerStats.objects.get(customer=customer)
+    assert (stats.orders_count, stats.pending_orders, stats.paid_orders) == (2, 1, 1)
+    assert stats.total_spent == Decimal("12.50")
+
+    out = io.StringIO()
+    call_command("repair_customer_stats", stdout=out)
+    assert "fixed 0" in out.getvalue()
+
+
+def test_import_products_upserts_by_sku_and_reports_invalid_rows(tmp_path, django_capture_on_commit_callbacks, db):
+    from django.core.management import call_command
+
+    Product.objects.create(sku="SKU-1", name="Old Mug", price=Decimal("4.00"))
+    Product.objects.create(sku="SKU-2", name="Teapot", description="Cast iron", price=Decimal("30.00"))
+    catalogue = tmp_path / "catalogue.csv"
+    catalogue.write_text(
+        "sku,name,description,price\n"
+        "SKU-1,Mug,Stoneware,5.00\n"
+        "SKU-2,Teapot,Cast iron,30.00\n"
+        "SKU-3,Kettle,,19.99\n"
+        "SKU-3,Kettle,Whistling,21.50\n"
+        "SKU-4,Cup,,free\n"
+    )
+    out, err = io.StringIO(), io.StringIO()
+    with django_capture_on_commit_callbacks() as callbacks:
+        call_command("import_products", str(catalogue), chunk_size=2, stdout=out, stderr=err)
+
+    assert "1 inserted, 1 updated, 1 unchanged, 0 unknown skus, 1 invalid" in out.getvalue()
+    assert "line 6: invalid price 'free'" in err.getvalue()
+    assert callbacks  # cached search pages are invalidated
+    products = {product.sku: product for product in Product.objects.all()}
+    assert (products["SKU-1"].name, products["SKU-1"].price) == ("Mug", Decimal("5.00"))
+    # the last row for a sku wins
+    assert (products["SKU-3"].description, products["SKU-3"].price) == ("Whistling", Decimal("21.50"))
+    assert "SKU-4" not in products
+
+    prices = tmp_path / "prices.jsonl"
+    prices.write_text('{"sku": "SKU-2", "price": "27.00"}\n{"sku": "SKU-9", "price": "1.00"}\n')
+    out = io.StringIO()
+    call_command("import_products", str(prices), stdout=out)
+    assert "0 inserted, 1 updated, 0 unchanged, 1 unknown skus, 0 invalid" in out.getvalue()
+    assert Product.objects.get(sku="SKU-2").price == Decimal("27.00")
+    assert not Product.objects.filter(sku="SKU-9").exists()
+
+
+@pytest.fixture
+def dead_letter_queue(settings):
+    """
+    Run ``requeue_dead_letters`` against an in-memory dead-letter queue, with
+    ``app.send_task`` patched so calls it sends back can be asserted on.
+    """
+    from kombu import Connection
+
+    settings.TASK_QUEUES = {**settings.TASK_QUEUES, "DEAD_LETTER": "test_dead_letter"}
+    with patch("core.celery.app.connection_for_read", side_effect=lambda: Connection("memory://")), \
+            patch("core.celery.app.send_task") as send_task:
+        yield send_task
+    with Connection("memory://") as connection:
+        connection.SimpleQueue("test_dead_letter").clear()
+
+
+def dead_letter(name, args, **info):
+    from kombu import Connection
+    from app.queues import DEAD_LETTER_HEADER
+
+    headers = {DEAD_LETTER_HEADER: {"retries": 3, "error": "OperationalError: gone", "failed_at": 0, **info}}
+    if name:
+        headers["task"] = name
+    with Connection("memory://") as connection:
+        connection.SimpleQueue("test_dead_letter").put([args, {}, {}], serializer="json", headers=headers)
+
+
+def test_tasks_are_routed_to_their_queues():
+    from core.celery import app
+
+    def queue(name):
+        return app.amqp.router.route({}, name)["queue"].name
+
+    assert queue("app.tasks.send_confirmation_message") == "realtime"
+    assert queue("app.tasks.sweep_stale_payments") == "bulk"
+    assert queue("celery.backend_cleanup") == "maintenance"
+
+
+def test_exhausted_confirmations_are_dead_lettered(setup_test_data):
+    from django.db import OperationalError
+    from app.queues import DEAD_LETTER_HEADER, DeadLetterTask
+    from app.tasks import send_confirmation_message
+
+    order_id = str(setup_test_data["order"].id)
+    with patch("app.tasks.candidate_shards", side_effect=OperationalError("server closed the connection")), \
+            patch.object(DeadLetterTask, "apply_async") as apply_async:
+        # apply() runs the retries straight away, ignoring their countdown
+        assert send_confirmation_message.apply(args=[order_id]).state == "FAILURE"
+
+    apply_async.assert_called_once()
+    args, kwargs = apply_async.call_args
+    assert list(args[0]) == [order_id] and args[1] == {} and kwargs["queue"] == "dead_letter"
+    info = kwargs["headers"][DEAD_LETTER_HEADER]
+    assert info["retries"] == 3 and info["error"] == "OperationalError: server closed the connection"
+
+
+def test_requeue_dead_letters_sends_calls_back_to_their_task(dead_letter_queue):
+    from django.core.management import call_command
+
+    dead_letter("app.tasks.send_confirmation_message", ["order-1"])
+    out = io.StringIO()
+    call_command("requeue_dead_letters", dry_run=True, stdout=out)
+    assert "app.tasks.send_confirmation_message args=['order-1']" in out.getvalue()
+    assert "after 3 retries: OperationalError: gone" in out.getvalue()
+    assert "would requeue 1 of 1" in out.getvalue()
+    dead_letter_queue.assert_not_called()
+
+    out = io.StringIO()
+    call_command("requeue_dead_letters", stdout=out)
+    assert "requeued 1 of 1" in out.getvalue()
+    dead_letter_queue.assert_called_once_with("app.tasks.send_confirmation_message", ["order-1"], {})
+    out = io.StringIO()
+    call_command("requeue_dead_letters", stdout=out)
+    assert "requeued 0 of 0" in out.getvalue()
+
+
+def test_requeue_dead_letters_limit_counts_matching_calls_only(dead_letter_queue):
+    from django.core.management import call_command
+
+    dead_letter("app.tasks.sweep_stale_payments", [])
+    dead_letter(None, ["no task"])
+    for order_id in ("order-1", "order-2", "order-3"):
+        dead_letter("app.tasks.send_confirmation_message", [order_id])
+
+    out = io.StringIO()
+    call_command("requeue_dead_letters", task="app.tasks.send_confirmation_message", limit=2, stdout=out)
+    assert "requeued 2 of 4" in out.getvalue()
+    assert [call.args[1] for call in dead_letter_queue.call_args_list] == [["order-1"], ["order-2"]]
+
+    # the rest, including the message without a task name, is still there
+    out = io.StringIO()
+    call_command("requeue_dead_letters", dry_run=True, stdout=out)
+    assert "would requeue 2 of 3" in out.getvalue()
@@ -0,0 +1,272 @@
+import logging
+import math
+import uuid
+
+import redis
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.throttling import BaseThrottle
+
+from .redis_client import get_redis, mark_redis_down
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = "admission:stats"
+
+
+# Refill and take one token from every bucket in a single round trip.
+# The request is admitted only if *all* buckets have a token; otherwise no
+# bucket is charged and the longest wait (ms) is returned with the scope
+# that caused it.
+#
+# KEYS[1..n]: bucket hashes, KEYS[n+1]: stats hash
+# ARGV[1]: limiter name, then (scope, rate per second, burst) per bucket
+TOKEN_BUCKET_LUA = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local n = #KEYS - 1
+local name = ARGV[1]
+local tokens = {}
+local wait = 0
+local limited_by = ''
+for i = 1, n do
+    local rate = tonumber(ARGV[3 * i])
+    local burst = tonumber(ARGV[3 * i + 1])
+    local state = redis.call('HMGET', KEYS[i], 't', 'ts')
+    local t = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    t = math.min(burst, t + math.max(0, now - ts) * rate / 1000)
+    tokens[i] = t
+    if t < 1 then
+        local needed = (1 - t) * 1000 / rate
+        if needed > wait then
+            wait = needed
+            limited_by = ARGV[3 * i - 1]
+        end
+    end
+end
+for i = 1, n do
+    local rate = tonumber(ARGV[3 * i])
+    local burst = tonumber(ARGV[3 * i + 1])
+    local t = tokens[i]
+    if wait == 0 then
+        t = t - 1
+    end
+    redis.call('HSET', KEYS[i], 't', tostring(t), 'ts', now)
+    redis.call('PEXPIRE', KEYS[i], math.ceil(burst * 1000 / rate) + 1000)
+end
+if wait == 0 then
+    redis.call('HINCRBY', KEYS[n + 1], name .. ':admitted', 1)
+    return {1, 0, ''}
+end
+redis.call('HINCRBY', KEYS[n + 1], name .. ':rejected:' .. limited_by, 1)
+return {0, math.ceil(wait), limited_by}
+"""
+
+# Counting semaphore over a sorted set scored by acquisition time. Slots
+# older than the TTL belong to crashed workers and are reclaimed.
+#
+# KEYS[1]: slot zset, KEYS[2]: stats hash
+# ARGV[1]: scope, ARGV[2]: limit, ARGV[3]: slot ttl (ms), ARGV[4]: token
+ACQUIRE_SLOT_LUA = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local ttl = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - ttl)
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    redis.call('PEXPIRE', KEYS[1], ttl)
+    return 1
+end
+redis.call('HINCRBY', KEYS[2], ARGV[1] .. ':shed', 1)
+return 0
+"""
+
+_scripts = {}
+
+
+def _script(client, source):
+    script = _scripts.get(source)
+    if script is None or script.registered_client is not client:
+        script = client.register_script(source)
+        _scripts[source] = script
+    return script
+
+
+def consume_tokens(name, buckets):
+    """
+    Take one token from each of ``buckets`` (a list of ``(scope, identity)``)
+    for the limiter ``name``.
+
+    Returns ``(allowed, wait_seconds, limited_by)``. Fails open when Redis is
+    unavailable.
+    """
+    client = get_redis()
+    if client is None:
+        return True, 0, None
+
+    config = settings.ADMISSION_CONTROL["BUCKETS"]
+    keys, args = [], [name]
+    for scope, identity in buckets:
+        keys.append(f"admission:bucket:{name}:{scope}:{identity}")
+        args.extend([scope, config[scope]["rate"], config[scope]["burst"]])
+    keys.append(STATS_KEY)
+
+    try:
+        allowed, wait_ms, limited_by = _script(client, TOKEN_BUCKET_LUA)(keys=keys, args=args)
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return True, 0, None
+    if isinstance(limited_by, bytes):
+        limited_by = limited_by.decode()
+    return bool(allowed), wait_ms / 1000, limited_by or None
+
+
+def acquire_slot(scope):
+    """
+    Reserve one of the concurrent slots for ``scope``.
+
+    Returns a token to pass to ``release_slot``, ``None`` if the scope is full,
+    or ``""`` when Redis is unavailable and the request is let through.
+    """
+    client = get_redis()
+    if client is None:
+        return ""
+
+    token = uuid.uuid4().hex
+    limit = settings.ADMISSION_CONTROL["CONCURRENCY"][scope]
+    ttl_ms = settings.ADMISSION_CONTROL["SLOT_TTL"] * 1000
+    try:
+        acquired = _script(client, ACQUIRE_SLOT_LUA)(
+            keys=[f"admission:slots:{scope}", STATS_KEY],
+            args=[scope, limit, ttl_ms, token],
+        )
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return ""
+    return token if acquired else None
+
+
+def release_slot(scope, token):
+    if not token:
+        return
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.zrem(f"admission:slots:{scope}", token)
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+
+
+def admission_state():
+    """
+    Snapshot of limiter counters and in-flight slots, for dashboards and the
+    ``admission_stats`` command. None when Redis is unavailable.
+    """
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        stats = {k.decode(): int(v) for k, v in client.hgetall(STATS_KEY).items()}
+        in_flight = {
+            scope: {"in_flight": client.zcard(f"admission:slots:{scope}"), "limit": limit}
+            for scope, limit in settings.ADMISSION_CONTROL["CONCURRENCY"].items()
+        }
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return None
+    return {"counters": stats, "concurrency": in_flight}
+
+
+class ServiceOverloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Service temporarily overloaded, please retry later."
+    default_code = "service_overloaded"
+
+    def __init__(self, wait, detail=None, code=None):
+        super().__init__(detail, code)
+        # DRF's exception handler turns ``wait`` into a Retry-After header.
+        self.wait = wait
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Redis token-bucket throttle. Every scope in ``scopes`` is a separate
+    bucket and all of them are checked atomically in one script call.
+    """
+    name = None
+    scopes = ("client", "global")
+
+    def get_identity(self, scope, request):
+        if scope == "client":
+            if request.user and request.user.is_authenticated:
+                return f"user:{request.user.pk}"
+            return self.get_ident(request)
+        if scope == "global":
+            return "all"
+        if scope == "idempotency_prefix":
+            key = request.headers.get("Idempotency-Key")
+            if not key:
+                return None
+            return key.split(":", 1)[0][:64]
+        raise ValueError(f"Unknown admission scope {scope!r}")
+
+    def allow_request(self, request, view):
+        self._wait = None
+        if not settings.ADMISSION_CONTROL["ENABLED"]:
+            return True
+
+        buckets = []
+        for scope in self.scopes:
+            identity = self.get_identity(scope, request)
+            if identity is not None:
+                buckets.append((scope, identity))
+
+        allowed, wait, limited_by = consume_tokens(self.name, buckets)
+        if not allowed:
+            logger.debug(f"Admission rejected for {self.name} by {limited_by} bucket")
+            self._wait = wait
+        return allowed
+
+    def wait(self):
+        return self._wait
+
+
+class PaymentChargeThrottle(TokenBucketThrottle):
+    name = "payments"
+    scopes = ("client", "idempotency_prefix", "global")
+
+
+class WebhookThrottle(TokenBucketThrottle):
+    name = "webhooks"
+    scopes = ("client", "global")
+
+
+class ConcurrencyLimitMixin:
+    """
+    Cap the number of requests a view handles at once across all workers.
+    Requests over the limit are shed with a 503 and Retry-After instead of
+    queueing for a database connection.
+    """
+    concurrency_scope = None
+
+    def initial(self, request, *args, **kwargs):
+        self._admission_slot = None
+        super().initial(request, *args, **kwargs)
+        if not settings.ADMISSION_CONTROL["ENABLED"]:
+            return
+        slot = acquire_slot(self.concurrency_scope)
+        if slot is None:
+            raise ServiceOverloaded(wait=math.ceil(settings.ADMISSION_CONTROL["SHED_RETRY_AFTER"]))
+        self._admission_slot = slot
+
+    def dispatch(self, request, *args, **kwargs):
+        # released even when the view raises, or a burst of 500s would hold
+        # every slot until SLOT_TTL
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            release_slot(self.concurrency_scope, getattr(self, "_admission_slot", None))
+            self._admission_slot = None
@@ -0,0 +1,370 @@
+"""
+Lightweight tracing for requests, SQL queries, Redis calls and Celery tasks.
+
+A trace starts at an incoming request, or at a task that was queued outside
+one, and carries a W3C ``traceparent`` (``00-<trace id>-<span id>-<flags>``).
+``tracing_middleware`` continues a ``traceparent`` sent by the caller, and
+Celery tasks get the enqueuing span's ``traceparent`` in their message
+headers, so a webhook and the confirmation job it queues share one trace.
+
+Whether a trace is recorded is decided once, at its root, with probability
+``TRACING["SAMPLE_RATE"]``; children and tasks inherit the decision. Work
+inside an unsampled trace costs a context variable lookup and nothing else.
+Finished spans are buffered and appended by a background thread to
+``TRACING["EXPORT_PATH"]`` as JSON lines, using OTLP field names.
+"""
+import atexit
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+import redis
+from asgiref.sync import iscoroutinefunction
+from celery.signals import before_task_publish, task_postrun, task_prerun, worker_process_shutdown
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.decorators import sync_and_async_middleware
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_HEADER = "traceparent"
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+MAX_STATEMENT_LENGTH = 2000
+
+_current = ContextVar("current_span", default=None)
+
+
+class SpanContext:
+    """The identity of a span in another process, read from a ``traceparent``."""
+
+    __slots__ = ("trace_id", "span_id", "sampled")
+
+    def __init__(self, trace_id, span_id, sampled):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "sampled", "attributes", "status", "start_ns", "end_ns")
+
+    def __init__(self, name, trace_id, parent_id, sampled, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = attributes or {}
+        self.status = "ok"
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key, value):
+        if self.sampled:
+            self.attributes[key] = value
+
+    def end(self, status=None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if status is not None:
+            self.status = status
+        if self.sampled:
+            exporter.export(self)
+
+    def to_dict(self):
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": self.attributes,
+            "status": self.status,
+            "pid": os.getpid(),
+        }
+
+
+def parse_traceparent(value):
+    """Return the SpanContext in a ``traceparent`` value, or None if it is malformed."""
+    match = TRACEPARENT_RE.match(value or "")
+    if match is None:
+        return None
+    trace_id, span_id, flags = match.groups()
+    if trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return SpanContext(trace_id, span_id, bool(int(flags, 16) & 1))
+
+
+def current_span():
+    return _current.get()
+
+
+def set_attribute(key, value):
+    """Tag the current span, if it is recorded."""
+    span = _current.get()
+    if span is not None:
+        span.set_attribute(key, value)
+
+
+def start_trace(name, traceparent=None, attributes=None):
+    """
+    Start the entry span of a request or task, or None while tracing is off.
+
+    The parent is ``traceparent`` if it is valid, else the current span (a
+    task run eagerly inside a request). Without either a new trace starts,
+    sampled with probability ``SAMPLE_RATE``. Activate the span with
+    ``activate`` and end it yourself.
+    """
+    config = settings.TRACING
+    if not config["ENABLED"]:
+        return None
+    parent = parse_traceparent(traceparent) if traceparent else None
+    if parent is None:
+        parent = _current.get()
+    if parent is not None:
+        return Span(name, parent.trace_id, parent.span_id, parent.sampled, attributes)
+    return Span(name, os.urandom(16).hex(), None, random.random() < config["SAMPLE_RATE"], attributes)
+
+
+def activate(span):
+    """Make ``span`` current; returns the token to pass to ``_current.reset``."""
+    return _current.set(span)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Record a child of the current span around the block. Yields None, at no
+    cost, when there is no current span or its trace isn't sampled.
+    """
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        yield None
+        return
+    child = Span(name, parent.trace_id, parent.span_id, True, attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as exc:
+        child.status = "error"
+        child.attributes["exception.type"] = type(exc).__name__
+        raise
+    finally:
+        _current.reset(token)
+        child.end()
+
+
+def inject(headers):
+    """Add the current span's ``traceparent`` to a dict of outgoing headers."""
+    parent = _current.get()
+    if parent is not None:
+        headers[TRACEPARENT_HEADER] = parent.traceparent
+    return headers
+
+
+class BatchExporter:
+    """
+    Buffers finished spans and appends them to ``TRACING["EXPORT_PATH"]``
+    from a background thread, every ``EXPORT_INTERVAL`` seconds or as soon
+    as ``BATCH_SIZE`` spans are waiting. Each batch is a single O_APPEND
+    write, so processes sharing the file never interleave lines. When
+    ``MAX_QUEUE`` spans are waiting, new ones are dropped and counted.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._buffer = []
+        self._pid = None
+        self.dropped = 0
+        self.exported = 0
+
+    def export(self, span):
+        config = settings.TRACING
+        with self._lock:
+            if self._pid != os.getpid():
+                # first span in this process, or we were forked and lost the thread
+                self._pid = os.getpid()
+                self._buffer = []
+                threading.Thread(target=self._run, name="trace-exporter", daemon=True).start()
+            if len(self._buffer) >= config["MAX_QUEUE"]:
+                self.dropped += 1
+                return
+            self._buffer.append(span)
+            if len(self._buffer) >= config["BATCH_SIZE"]:
+                self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(settings.TRACING["EXPORT_INTERVAL"])
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        data = "".join(json.dumps(span.to_dict(), default=str) + "\n" for span in batch).encode()
+        path = Path(settings.TRACING["EXPORT_PATH"])
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        except OSError as exc:
+            self.dropped += len(batch)
+            logger.warning(f"Dropped {len(batch)} spans, could not write {path}: {exc}")
+            return
+        self.exported += len(batch)
+
+
+exporter = BatchExporter()
+atexit.register(exporter.flush)
+
+
+@worker_process_shutdown.connect
+def _flush_on_worker_shutdown(**kwargs):
+    exporter.flush()
+
+
+@sync_and_async_middleware
+def tracing_middleware(get_response):
+    """
+    Wrap each request in a span named after its URL route, continuing the
+    caller's ``traceparent`` if it sent one. The trace id is returned in
+    ``X-Trace-Id``.
+    """
+
+    def begin(request):
+        root = start_trace(f"HTTP {request.method}", request.META.get("HTTP_TRACEPARENT"), {
+            "http.method": request.method,
+            "http.target": request.path,
+        })
+        return root, (activate(root) if root is not None else None)
+
+    def finish(request, root, token, response=None, exc=None):
+        _current.reset(token)
+        route = getattr(request.resolver_match, "route", None)
+        if route:
+            root.name = f"{request.method} /{route}"
+            root.set_attribute("http.route", route)
+        if response is not None:
+            root.set_attribute("http.status_code", response.status_code)
+            response["X-Trace-Id"] = root.trace_id
+        if exc is not None:
+            root.set_attribute("exception.type", type(exc).__name__)
+        root.end("error" if exc is not None or response.status_code >= 500 else "ok")
+
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            root, token = begin(request)
+            if root is None:
+                return await get_response(request)
+            try:
+                response = await get_response(request)
+            except Exception as exc:
+                finish(request, root, token, exc=exc)
+                raise
+            finish(request, root, token, response)
+            return response
+
+    else:
+
+        def middleware(request):
+            root, token = begin(request)
+            if root is None:
+                return get_response(request)
+            try:
+                response = get_response(request)
+            except Exception as exc:
+                finish(request, root, token, exc=exc)
+                raise
+            finish(request, root, token, response)
+            return response
+
+    return middleware
+
+
+def _trace_query(execute, sql, params, many, context):
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        return execute(sql, params, many, context)
+    # only the statement: parameters may hold personal data
+    with span("db.query", **{"db.alias": context["connection"].alias, "db.statement": sql[:MAX_STATEMENT_LENGTH]}):
+        return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def _instrument_connection(sender, connection, **kwargs):
+    # fires on every (re)connect; the wrapper list outlives the socket
+    if _trace_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _trace_query)
+
+
+class TracedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        with span("redis.pipeline", **{"redis.commands": len(self.command_stack)}):
+            return super().execute(raise_on_error)
+
+
+class TracedRedis(redis.Redis):
+    """redis.Redis that records a span per command or pipeline."""
+
+    def execute_command(self, *args, **options):
+        with span("redis.command", **{"redis.command": str(args[0])}):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return TracedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+# task id -> (span, context token), between task_prerun and task_postrun
+_task_spans = {}
+
+
+@before_task_publish.connect
+def _inject_task_headers(headers=None, **kwargs):
+    if headers is not None:
+        inject(headers)
+
+
+@task_prerun.connect
+def _start_task_span(task_id=None, task=None, **kwargs):
+    request = task.request
+    # a worker exposes message headers as request attributes; apply() keeps them apart
+    traceparent = getattr(request, TRACEPARENT_HEADER, None) or (request.headers or {}).get(TRACEPARENT_HEADER)
+    root = start_trace(f"celery.task {task.name}", traceparent, {
+        "celery.task_id": task_id,
+        "celery.retries": request.retries,
+    })
+    if root is not None:
+        _task_spans[task_id] = (root, activate(root))
+
+
+@task_postrun.connect
+def _end_task_span(task_id=None, state=None, **kwargs):
+    entry = _task_spans.pop(task_id, None)
+    if entry is None:
+        return
+    root, token = entry
+    _current.reset(token)
+    root.set_attribute("celery.state", state)
+    root.end("error" if state == "FAILURE" else "ok")
@@ -1,14 +1,27 @@
 from django.urls import path
-from .views import OrderCreateView, OrderRetriveView, PaymentChargeView, MomoWebhookView
+from .views import (
+    OrderCreateView,
+    OrderEventsStatsView,
+    OrderEventsView,
+    OrderRetriveView,
+    PaymentChargeView,
+    MomoWebhookView,
+    ProductSearchView,
+    CustomerSummaryView,
+)
 
 
 
 
 urlpatterns = [
     path('orders/<str:pk>/', OrderRetriveView.as_view(), name='order-retrive'),
+    path('orders/<str:pk>/events/', OrderEventsView.as_view(), name='order-events'),
+    path('events/stats/', OrderEventsStatsView.as_view(), name='order-events-stats'),
     path('orders/', OrderCreateView.as_view(), name='order-create'),
     path('payments/charge/', PaymentChargeView.as_view(), name='payment-charge'),
     path('webhooks/momo/', MomoWebhookView.as_view(), name='momo-webhook'),
+    path('products/', ProductSearchView.as_view(), name='product-search'),
+    path('customers/<int:pk>/summary/', CustomerSummaryView.as_view(), name='customer-summary'),
 
 
 ]
\ No newline at end of file
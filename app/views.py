@@ -1,17 +1,33 @@
-import hashlib
-import hmac
+import asyncio
 import json
+import uuid
 from django.forms import ValidationError
 from rest_framework import generics, status
 from rest_framework.response import Response
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views import View
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 
 from core import settings
-from .models import Order, Customer, Payment
-from .serializers import OrderSerializer, PaymentSerializer
-from rest_framework.permissions import AllowAny
+from .models import Order, Customer, CustomerStats, Payment, PaymentIdempotencyKey
+from .services import claim_idempotency_key
+from .serializers import CustomerStatsSerializer, OrderSerializer, PaymentSerializer, ProductSerializer
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.views import APIView
-from django.db import transaction
-from .tasks import send_confirmation_message
+from django.db import DEFAULT_DB_ALIAS, transaction
+from asgiref.sync import sync_to_async
+from .events import broker
+from .ingest import FAILED, QUEUED, enqueue_order, group_commit_enabled, ingestion_status
+from .journal import journal
+from .webhooks import process_momo_webhook
+from .sharding import find_on_shards, order_shard
+from .search import SearchParams, cache_page, get_cached_page, search_products
+from rest_framework.utils.urls import replace_query_param
+from .throttling import ConcurrencyLimitMixin, PaymentChargeThrottle, WebhookThrottle
+from . import tracing
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,17 +35,55 @@ logger = logging.getLogger(__name__)
 
 
 
-class OrderCreateView(APIView):
+def order_validators(pk, updated_at):
+    """
+    Return ``(etag, last_modified)`` for an order. The ETag uses microsecond
+    precision so two updates within the same second still change it.
+
+    Last-Modified only has one-second resolution, so it is None while the
+    order's last change is in the current second: a second change within it
+    would keep the same Last-Modified and a client revalidating with it
+    could get a wrong 304 (RFC 9110 section 8.8.2.2).
+    """
+    last_modified = int(updated_at.timestamp())
+    if last_modified >= int(timezone.now().timestamp()):
+        last_modified = None
+    return quote_etag(f"{pk}-{int(updated_at.timestamp() * 1_000_000)}"), last_modified
+
+
+def set_order_validators(response, etag, last_modified):
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+
+
+class OrderCreateView(ConcurrencyLimitMixin, APIView):
     """
     Create a new order with items.
+
+    In group-commit ingestion mode the order is validated and queued, and a
+    202 is returned with the URL to poll until a worker has committed it.
     """
     serializer_class = OrderSerializer
     permission_classes = [AllowAny]
+    concurrency_scope = "orders"
 
 
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
+
+        if group_commit_enabled():
+            order_id = enqueue_order(serializer.validated_data)
+            if order_id is not None:
+                status_url = request.build_absolute_uri(reverse("order-retrive", kwargs={"pk": order_id}))
+                return Response(
+                    {"id": str(order_id), "status": QUEUED, "status_url": status_url},
+                    status=status.HTTP_202_ACCEPTED,
+                    headers={"Location": status_url},
+                )
+            # Redis is down: fall back to a synchronous write
+
         serializer.save()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
@@ -37,24 +91,175 @@ class OrderCreateView(APIView):
 class OrderRetriveView(APIView):
     """
     Retrieve an order by its ID.
+
+    Supports conditional GET: the ETag and Last-Modified validators come from
+    ``Order.updated_at`` alone, so a poll that matches If-None-Match or
+    If-Modified-Since is answered with 304 without loading items or running
+    the serializer.
     """
     permission_classes = [AllowAny]
 
     def get(self, request, pk, *args, **kwargs):
+        conditional = "HTTP_IF_NONE_MATCH" in request.META or "HTTP_IF_MODIFIED_SINCE" in request.META
+        updated_at = None
+        if conditional:
+            updated_at = find_on_shards(
+                pk, lambda shard: Order.objects.using(shard).filter(pk=pk).values_list("updated_at", flat=True).first()
+            )
+        if updated_at is not None:
+            etag, last_modified = order_validators(pk, updated_at)
+            # the ETag decides whenever If-None-Match is sent; the one-second
+            # If-Modified-Since is only a fallback without it (RFC 9110 13.2.2)
+            not_modified = get_conditional_response(
+                request,
+                etag=etag,
+                last_modified=None if "HTTP_IF_NONE_MATCH" in request.META else last_modified,
+            )
+            if not_modified is not None:
+                set_order_validators(not_modified, etag, last_modified)
+                return not_modified
+
+        order = self._find_order(pk)
+        if order is not None:
+            return self._order_response(pk, order)
+
+        ingestion = ingestion_status(pk)
+        if ingestion and ingestion["status"] == QUEUED:
+            return Response({"id": pk, **ingestion}, status=status.HTTP_202_ACCEPTED)
+        if ingestion and ingestion["status"] == FAILED:
+            return Response({"id": pk, **ingestion}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        # the ingester drops the status key once it commits, which may have
+        # happened since the first lookup
+        order = self._find_order(pk)
+        if order is not None:
+            return self._order_response(pk, order)
+        return Response({"detail": "Order not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    def _find_order(self, pk):
+        return find_on_shards(pk, lambda shard: Order.objects.using(shard).filter(pk=pk).first())
+
+    def _order_response(self, pk, order):
+        response = Response(OrderSerializer(order).data, status=status.HTTP_200_OK)
+        # validators from the row we serialized, in case it changed since the check
+        set_order_validators(response, *order_validators(pk, order.updated_at))
+        return response
+
+
+class CustomerSummaryView(APIView):
+    """
+    Order counts by status and total spend of a customer, read from their
+    CustomerStats row: one primary-key lookup however many orders they have.
+    Only the customer themselves and staff may read it.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk, *args, **kwargs):
+        if request.user.pk != pk and not request.user.is_staff:
+            self.permission_denied(request)
+        stats = CustomerStats.objects.filter(customer_id=pk).first()
+        if stats is None:
+            if not Customer.objects.filter(pk=pk).exists():
+                return Response({"detail": "Customer not found."}, status=status.HTTP_404_NOT_FOUND)
+            # no orders yet
+            stats = CustomerStats(customer_id=pk)
+        return Response(CustomerStatsSerializer(stats).data)
+
+
+class ProductSearchView(APIView):
+    """
+    Search products by name and description.
+
+    Query parameters: ``q``, ``min_price``, ``max_price``, ``ordering``
+    (``name``, ``price`` or ``-price``), ``page_size`` and ``cursor``. Pages
+    are keyset-paginated; follow ``next`` for the following page.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        params = SearchParams(request.query_params)
+        page, cache_key = get_cached_page(params)
+        cache_status = "HIT" if page is not None else "MISS"
+        if page is None:
+            products, next_cursor = search_products(params)
+            page = {"results": ProductSerializer(products, many=True).data, "next_cursor": next_cursor}
+            cache_page(cache_key, page)
+
+        next_url = None
+        if page["next_cursor"]:
+            next_url = replace_query_param(request.build_absolute_uri(), "cursor", page["next_cursor"])
+        return Response({"next": next_url, "results": page["results"]}, headers={"X-Cache": cache_status})
+
+
+class OrderEventsView(View):
+    """
+    Stream an order's status changes as Server-Sent Events.
+
+    Must be served by the ASGI app (core/asgi.py): each open stream is a
+    coroutine waiting on a queue fed by the process-wide Redis subscriber,
+    not a worker thread.
+    """
+
+    async def get(self, request, pk, *args, **kwargs):
         try:
-            order = Order.objects.get(pk=pk)
-            serializer = OrderSerializer(order)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        except Order.DoesNotExist:
-            return Response({"detail": "Order not found."}, status=status.HTTP_404_NOT_FOUND)
+            # events are dispatched by the canonical form of the id
+            pk = str(uuid.UUID(pk))
+        except ValueError:
+            return JsonResponse({"detail": "Order not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        queue = broker.subscribe(pk)
+        try:
+            # read the current state only once Redis delivers changes to the
+            # queue, so none published in between is missed
+            if not await broker.wait_subscribed(settings.ORDER_EVENTS["SUBSCRIBE_TIMEOUT_SECONDS"]):
+                logger.warning(f"Order event subscription not ready, streaming {pk} without live updates")
+            order = await sync_to_async(find_on_shards)(
+                pk, lambda shard: Order.objects.using(shard).filter(pk=pk).values("status", "confirmation_sent").first()
+            )
+        except BaseException:
+            broker.unsubscribe(pk, queue)
+            raise
+        if order is None:
+            broker.unsubscribe(pk, queue)
+            return JsonResponse({"detail": "Order not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        response = StreamingHttpResponse(self.stream(pk, queue, order), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    async def stream(self, pk, queue, order):
+        keepalive = settings.ORDER_EVENTS["KEEPALIVE_SECONDS"]
+        try:
+            yield f"event: status\ndata: {json.dumps({'order_id': pk, **order})}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: status\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(pk, queue)
+
+
+class OrderEventsStatsView(View):
+    """
+    Connection count, fan-out latency and memory per connection for the
+    event streams held by this process.
+    """
 
+    async def get(self, request, *args, **kwargs):
+        return JsonResponse(broker.stats())
 
-class PaymentChargeView(generics.CreateAPIView):
+
+class PaymentChargeView(ConcurrencyLimitMixin, generics.CreateAPIView):
     """
     Charge a payment for an order.
     """
    
     serializer_class = PaymentSerializer
+    throttle_classes = [PaymentChargeThrottle]
+    concurrency_scope = "payments"
 
     def create(self, request, *args, **kwargs):
         idempotency_key = request.headers.get("Idempotency-Key")
@@ -64,16 +269,30 @@ class PaymentChargeView(generics.CreateAPIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        with transaction.atomic():
-            existing_payment = Payment.objects.filter(idempotency_key=idempotency_key).first()
-            if existing_payment:
-                # return the existing payment to enforce idempotency
-                serializer = self.get_serializer(existing_payment)
-                return Response(serializer.data, status=status.HTTP_200_OK)
+        # payments live on their order's shard; an unknown order is left to
+        # the serializer to reject
+        shard = order_shard(request.data.get("order")) or DEFAULT_DB_ALIAS
+        tracing.set_attribute("order.id", str(request.data.get("order")))
+
+        # Keys are registered on "default" so a key reused for an order on
+        # another shard still finds the first payment. Payments charged
+        # before the registry existed are only found on their own shard.
+        existing_payment = self._existing_payment(idempotency_key) or (
+            Payment.objects.using(shard).filter(idempotency_key=idempotency_key).first()
+        )
+        if existing_payment:
+            # return the existing payment to enforce idempotency
+            serializer = self.get_serializer(existing_payment)
+            return Response(serializer.data, status=status.HTTP_200_OK)
 
-            # normal create
-            serializer = self.get_serializer(data=request.data)
-            serializer.is_valid(raise_exception=True)
+        serializer = self.get_serializer(data=request.data, context={**self.get_serializer_context(), "shard": shard})
+        serializer.is_valid(raise_exception=True)
+        # no savepoint when the order is on "default" too: one transaction covers both
+        with transaction.atomic(using=DEFAULT_DB_ALIAS), transaction.atomic(using=shard, savepoint=False):
+            # a concurrent request with the same key waits here for ours to commit
+            if not claim_idempotency_key(idempotency_key, serializer.validated_data["order"].pk):
+                existing_payment = self._existing_payment(idempotency_key)
+                return Response(self.get_serializer(existing_payment).data, status=status.HTTP_200_OK)
             payment = serializer.save(idempotency_key=idempotency_key)
 
         # TODO: Call provider (e.g. MTN) here
@@ -83,8 +302,17 @@ class PaymentChargeView(generics.CreateAPIView):
 
         return Response(self.get_serializer(payment).data, status=status.HTTP_201_CREATED)
 
+    def _existing_payment(self, idempotency_key):
+        key = PaymentIdempotencyKey.objects.filter(idempotency_key=idempotency_key).first()
+        if key is None:
+            return None
+        return find_on_shards(
+            key.order_id,
+            lambda shard: Payment.objects.using(shard).filter(idempotency_key=idempotency_key).first(),
+        )
 
-class MomoWebhookView(APIView):
+
+class MomoWebhookView(ConcurrencyLimitMixin, APIView):
     """
     Handle MoMo Webhooks:
     - Verify HMAC signature
@@ -92,80 +320,17 @@ class MomoWebhookView(APIView):
     - Update payment & order status
     - Enqueue confirmation job
     """
+    throttle_classes = [WebhookThrottle]
+    concurrency_scope = "webhooks"
+
+    def initial(self, request, *args, **kwargs):
+        # Keep the raw callback before anything can reject it, so it can be
+        # replayed: throttling and load shedding happen in super().initial()
+        if request.method == "POST":
+            journal.append(request.body, request.META)
+        super().initial(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
-        
         signature = request.META.get("HTTP_X_MOMO_SIGNATURE")
-        # 1. Get the raw payload
-        raw_payload = request.body.decode('utf-8')
-
-        payment = ""
-
-        # 2. Parse the raw payload into a dictionary
-        try:
-            payload_dict = json.loads(raw_payload)
-        except json.JSONDecodeError:
-            return Response({"error": "Invalid JSON payload"}, status=status.HTTP_400_BA_REQUEST)
-        
-        # 3. Canonicalize the payload by re-dumping it
-        # This creates a consistent string for hashing, ignoring whitespace and key order
-        payload_string = json.dumps(payload_dict, separators=(',', ':'), sort_keys=True)
-        
-        hmac_hash = hmac.new(
-            settings.MOMO_WEBHOOK_SECRET.encode("utf-8"),
-            payload_string.encode('utf-8'),
-            hashlib.sha256,
-        ).hexdigest()
-      
-
-        if not hmac.compare_digest(hmac_hash, signature or ""):
-            logger.error("Invalid signature in Momo webhook payload")
-            return Response({"error": "Invalid signature"}, status=status.HTTP_401_UNAUTHORIZED)
-
-        # 2. Extract provider transaction id for idempotency
-        provider_reference = request.data.get("provider_reference")
-        if not provider_reference:
-            logger.error("Missing provider_reference in Momo webhook payload")  
-            return Response({"error": "Missing provider_reference"}, status=status.HTTP_400_BAD_REQUEST)
-
-        # 3. Process payment atomically
-        with transaction.atomic():
-            # Idempotency check: payment already processed
-            payment = Payment.objects.filter(provider_reference=provider_reference).first()
-
-            if payment:
-                # If a payment with this reference already exists, the transaction has
-                # already been processed. Return a 200 OK to avoid retries.
-                logger.info(f"Payment with reference {provider_reference} already processed.")
-                return Response({"message": "Payment already processed"}, status=status.HTTP_200_OK)
-
-            # Try locating payment by order_id
-            order_id = request.data.get("order_id")
-            try:
-                payment = Payment.objects.select_for_update().get(order__id=order_id)
-
-            except Payment.DoesNotExist:
-                logger.info(f"Payment record not found for order {order_id}")
-                return Response({"error": "Payment record not found"}, status=status.HTTP_404_NOT_FOUND)
-
-            # Update payment status
-            status_from_provider = request.data.get("status")
-            if status_from_provider == "success":
-                payment.status = "Success"
-                payment.provider_reference = provider_reference
-                payment.save()
-
-                # Update order
-                order = payment.order
-                order.status = "Paid"
-                order.save()
-
-                # Enqueue async confirmation job (idempotent worker)
-                logger.info(f"Enqueuing confirmation job for order {order.id}")
-                send_confirmation_message.delay(order.id)
-            else:
-                payment.status = status_from_provider or "failed"
-                payment.save()
-
-
-        return Response({"message": "Payment Webhook processed successfully"}, status=status.HTTP_200_OK)
\ No newline at end of file
+        status_code, data = process_momo_webhook(request.body, signature)
+        return Response(data, status=status_code)
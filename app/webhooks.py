@@ -0,0 +1,124 @@
+import hashlib
+import hmac
+import json
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework import status
+
+from .events import publish_order_event
+from .models import Payment
+from .services import order_stats_change, payment_transition, record_customer_stats
+from .sharding import candidate_shards
+from .tasks import send_confirmation_message
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+
+def verify_signature(raw_body, signature):
+    """
+    Return the payload of a MoMo callback if ``signature`` is the HMAC-SHA256
+    of its canonical JSON, or None if it isn't. Raises ValueError if the body
+    is not a JSON object.
+    """
+    payload_dict = json.loads(raw_body)
+    if not isinstance(payload_dict, dict):
+        raise ValueError("Webhook payload is not a JSON object")
+
+    # Canonicalize the payload by re-dumping it
+    # This creates a consistent string for hashing, ignoring whitespace and key order
+    payload_string = json.dumps(payload_dict, separators=(',', ':'), sort_keys=True)
+
+    hmac_hash = hmac.new(
+        settings.MOMO_WEBHOOK_SECRET.encode("utf-8"),
+        payload_string.encode('utf-8'),
+        hashlib.sha256,
+    ).hexdigest()
+
+    if not hmac.compare_digest(hmac_hash, signature or ""):
+        return None
+    return payload_dict
+
+
+def process_momo_webhook(raw_body, signature, enqueue=True):
+    """
+    Verify and apply one MoMo webhook callback.
+
+    Takes the raw request body and X-Momo-Signature header and returns
+    ``(status_code, response_data)``. Used by MomoWebhookView and by the
+    journal replay, so both go through exactly the same logic. With
+    ``enqueue=False`` no confirmation job is queued (dry-run replays).
+    """
+    # 1. Parse the payload and check its signature
+    try:
+        payload_dict = verify_signature(raw_body, signature)
+    except ValueError:
+        return status.HTTP_400_BAD_REQUEST, {"error": "Invalid JSON payload"}
+
+    if payload_dict is None:
+        logger.error("Invalid signature in Momo webhook payload")
+        return status.HTTP_401_UNAUTHORIZED, {"error": "Invalid signature"}
+
+    # 2. Extract provider transaction id for idempotency
+    provider_reference = payload_dict.get("provider_reference")
+    if not provider_reference:
+        logger.error("Missing provider_reference in Momo webhook payload")
+        return status.HTTP_400_BAD_REQUEST, {"error": "Missing provider_reference"}
+
+    # 3. Process payment atomically, on the shard holding the order
+    order_id = payload_dict.get("order_id")
+    tracing.set_attribute("order.id", str(order_id))
+    for shard in candidate_shards(order_id):
+        with transaction.atomic(using=shard):
+            # Idempotency check: payment already processed
+            payment = Payment.objects.using(shard).filter(provider_reference=provider_reference).first()
+
+            if payment:
+                # If a payment with this reference already exists, the transaction has
+                # already been processed. Return a 200 OK to avoid retries.
+                logger.info(f"Payment with reference {provider_reference} already processed.")
+                return status.HTTP_200_OK, {"message": "Payment already processed"}
+
+            # Try locating payment by order_id
+            try:
+                payment = (
+                    Payment.objects.using(shard)
+                    .select_for_update(of=("self", "order"))
+                    .select_related("order")
+                    .get(order__id=order_id)
+                )
+            except Payment.DoesNotExist:
+                # not on this shard (or moved off it while we waited for the lock)
+                continue
+
+            # Update payment status
+            payment_status, order_status = payment_transition(payload_dict.get("status"))
+            if order_status:
+                payment.status = payment_status
+                payment.provider_reference = provider_reference
+                payment.save()
+
+                # Update order
+                order = payment.order
+                previous_status, order.status = order.status, order_status
+                order.save()
+                record_customer_stats(
+                    {order.customer_id: order_stats_change(previous_status, order.status, order.total_amount)}, shard
+                )
+
+                # Enqueue async confirmation job (idempotent worker)
+                if enqueue:
+                    logger.info(f"Enqueuing confirmation job for order {order.id}")
+                    send_confirmation_message.delay(order.id)
+                publish_order_event(order.id, using=shard, status=order.status, payment_status=payment.status)
+            else:
+                payment.status = payment_status
+                payment.save()
+                publish_order_event(payment.order_id, using=shard, payment_status=payment.status)
+
+        return status.HTTP_200_OK, {"message": "Payment Webhook processed successfully"}
+
+    logger.info(f"Payment record not found for order {order_id}")
+    return status.HTTP_404_NOT_FOUND, {"error": "Payment record not found"}
@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'app',
 
@@ -55,6 +56,7 @@ AUTH_USER_MODEL = 'app.Customer'
 MOMO_WEBHOOK_SECRET = os.getenv("MOMO_WEBHOOK_SECRET", "default-secret") 
 
 MIDDLEWARE = [
+    'app.tracing.tracing_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,6 +90,124 @@ WSGI_APPLICATION = 'core.wsgi.application'
 CELERY_BROKER_URL = "redis://redis:6379/0"
 CELERY_RESULT_BACKEND = "redis://redis:6379/0"
 
+# Queues (see app/queues.py), each drained by its own worker service in
+# docker-compose.yml. Unrouted tasks, including Celery's own housekeeping,
+# go to "maintenance".
+CELERY_TASK_DEFAULT_QUEUE = "maintenance"
+CELERY_TASK_ROUTES = {
+    "app.tasks.send_confirmation_message": {"queue": "realtime"},
+    "app.tasks.sweep_stale_payments": {"queue": "bulk"},
+}
+
+# DEAD_LETTER holds DeadLetterTask calls that failed for good; nothing
+# consumes it (manage.py requeue_dead_letters). A task that waited longer
+# than MAX_WAIT_MS in its queue is logged as a warning.
+TASK_QUEUES = {
+    "DEAD_LETTER": "dead_letter",
+    "MAX_WAIT_MS": {"realtime": 1000, "bulk": 60_000, "maintenance": 300_000},
+}
+
+CELERY_BEAT_SCHEDULE = {
+    "sweep-stale-payments": {
+        "task": "app.tasks.sweep_stale_payments",
+        "schedule": 60.0,
+    },
+}
+
+# Payments still INITIATED after AGE_MINUTES are re-checked with the provider.
+STALE_PAYMENT_SWEEP = {
+    "AGE_MINUTES": int(os.getenv("STALE_PAYMENT_AGE_MINUTES", 15)),
+    "BATCH_SIZE": 200,
+    "POOL_SIZE": 16,
+    "MAX_BATCHES": 50,
+}
+
+# Order ingestion: "sync" writes each order in its own transaction;
+# "group_commit" queues validated orders in Redis and a worker
+# (manage.py run_order_ingester) commits up to MAX_BATCH of them per
+# transaction, waiting at most MAX_WAIT_MS to fill a batch.
+ORDER_INGESTION = {
+    "MODE": os.getenv("ORDER_INGESTION_MODE", "sync"),
+    "QUEUE_KEY": "orders:ingest",
+    "MAX_BATCH": int(os.getenv("ORDER_INGESTION_MAX_BATCH", 200)),
+    "MAX_WAIT_MS": int(os.getenv("ORDER_INGESTION_MAX_WAIT_MS", 10)),
+    "STATUS_TTL": 24 * 3600,
+}
+
+# Server-Sent Events for order status (GET /api/orders/<pk>/events/).
+ORDER_EVENTS = {
+    "QUEUE_SIZE": 16,
+    "KEEPALIVE_SECONDS": 15,
+    # how long a new stream waits for the Redis subscription before it reads
+    # the order's state anyway (without live updates until Redis is back)
+    "SUBSCRIBE_TIMEOUT_SECONDS": 2,
+}
+
+# Append-only journal of raw MoMo webhook callbacks, replayable with
+# `manage.py replay_webhooks`.
+WEBHOOK_JOURNAL = {
+    "ENABLED": os.getenv("WEBHOOK_JOURNAL_ENABLED", "True") == "True",
+    "DIR": os.getenv("WEBHOOK_JOURNAL_DIR", str(BASE_DIR / "var" / "webhook-journal")),
+    "SEGMENT_BYTES": 64 * 1024 * 1024,
+    "HEADERS": ["HTTP_X_MOMO_SIGNATURE", "CONTENT_TYPE", "HTTP_USER_AGENT", "REMOTE_ADDR"],
+}
+
+# Product search (GET /api/products/). Result pages are cached in Redis for
+# CACHE_TTL seconds; any product change invalidates them all at once.
+PRODUCT_SEARCH = {
+    "CONFIG": "english",
+    "PAGE_SIZE": 20,
+    "MAX_PAGE_SIZE": 100,
+    "MAX_QUERY_LENGTH": 200,
+    "CACHE_TTL": int(os.getenv("PRODUCT_SEARCH_CACHE_TTL", 30)),
+}
+
+# Local stand-in for the MoMo transaction status API (app/providers.py).
+MOMO_STUB = {
+    "LATENCY": float(os.getenv("MOMO_STUB_LATENCY", 0.05)),
+    "STATUS": os.getenv("MOMO_STUB_STATUS", "pending"),
+}
+
+
+# Tracing (app/tracing.py): a SAMPLE_RATE share of traces is recorded, with
+# spans for the request or task, its SQL queries and Redis calls. Spans are
+# appended to EXPORT_PATH as JSON lines, in batches, by a background thread.
+TRACING = {
+    "ENABLED": os.getenv("TRACING_ENABLED", "True") == "True",
+    "SAMPLE_RATE": float(os.getenv("TRACING_SAMPLE_RATE", 0.01)),
+    "EXPORT_PATH": os.getenv("TRACING_EXPORT_PATH", str(BASE_DIR / "var" / "traces" / "spans.jsonl")),
+    "BATCH_SIZE": 512,
+    "EXPORT_INTERVAL": 2.0,
+    "MAX_QUEUE": 10_000,
+}
+
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+# Keep Redis off the critical path: short timeouts, then fail open for a while.
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 0.05))
+REDIS_FAILURE_COOLDOWN = int(os.getenv("REDIS_FAILURE_COOLDOWN", 5))
+
+
+# Admission control for the payment endpoints (see app/throttling.py).
+# Buckets refill at `rate` tokens per second up to `burst`.
+ADMISSION_CONTROL = {
+    "ENABLED": os.getenv("ADMISSION_CONTROL_ENABLED", "True") == "True",
+    "BUCKETS": {
+        "client": {"rate": 5, "burst": 20},
+        "idempotency_prefix": {"rate": 50, "burst": 100},
+        "global": {"rate": 500, "burst": 1000},
+    },
+    # Max in-flight requests per view across all workers, sized to stay
+    # below the Postgres connection limit.
+    "CONCURRENCY": {
+        "orders": 40,
+        "payments": 30,
+        "webhooks": 30,
+    },
+    "SLOT_TTL": 30,
+    "SHED_RETRY_AFTER": 1,
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
@@ -110,6 +230,30 @@ DATABASES = {
     }
 }
 
+# Customer-sharded order storage (app/sharding.py). Orders, their items and
+# payments live on the shard their customer is pinned to; everything else
+# stays on "default". Order ids encode a shard's position in DATABASES, so
+# that list is append-only and "default" stays first. New customers are
+# hashed onto RING, which defaults to every shard. Each extra shard is a
+# Postgres database named POSTGRES_DB_<ALIAS> (default <POSTGRES_DB>_<alias>).
+ORDER_SHARDS = {
+    "DATABASES": [alias.strip() for alias in os.getenv("ORDER_SHARDS", "default").split(",") if alias.strip()],
+    "VNODES": 128,
+}
+ORDER_SHARDS["RING"] = [
+    alias.strip() for alias in os.getenv("ORDER_SHARD_RING", ",".join(ORDER_SHARDS["DATABASES"])).split(",")
+    if alias.strip()
+]
+for alias in ORDER_SHARDS["DATABASES"]:
+    if alias != "default":
+        DATABASES[alias] = {
+            **DATABASES["default"],
+            "NAME": os.getenv(f"POSTGRES_DB_{alias.upper()}", f"{DATABASES['default']['NAME']}_{alias}"),
+            "HOST": os.getenv(f"POSTGRES_HOST_{alias.upper()}", DATABASES["default"]["HOST"]),
+        }
+
+DATABASE_ROUTERS = ["app.sharding.ShardRouter"]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
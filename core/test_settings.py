@@ -0,0 +1,13 @@
+"""
+Settings for the test suite: a second local database, "shard_1", so the
+sharding tests run against real cross-database routing. New customers are
+still hashed onto "default" only; sharding tests widen the ring themselves.
+Traces are not sampled.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES, ORDER_SHARDS, TRACING
+
+DATABASES["shard_1"] = {**DATABASES["default"], "NAME": f"{DATABASES['default']['NAME']}_shard_1"}
+# tracing tests sample explicitly; nothing else should write spans
+TRACING = {**TRACING, "SAMPLE_RATE": 0.0}
+ORDER_SHARDS = {**ORDER_SHARDS, "DATABASES": ["default", "shard_1"], "RING": ["default"]}